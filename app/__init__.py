@@ -25,13 +25,32 @@ def create_app():
     app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
     app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 
-    # 4. Bind plugins
+    # 4. Grading Queue Config (background OCR + scoring of submissions)
+    app.config['GRADING_WORKERS'] = int(os.environ.get('GRADING_WORKERS', 2))
+    app.config['GRADING_QUEUE_LIMIT'] = int(os.environ.get('GRADING_QUEUE_LIMIT', 500))
+    app.config['GRADING_MAX_ATTEMPTS'] = int(os.environ.get('GRADING_MAX_ATTEMPTS', 3))
+    app.config['GRADING_RETRY_BASE_SECONDS'] = float(os.environ.get('GRADING_RETRY_BASE_SECONDS', 5))
+    app.config['GRADING_JOB_LEASE_SECONDS'] = int(os.environ.get('GRADING_JOB_LEASE_SECONDS', 600))
+    app.config['GRADING_POLL_INTERVAL'] = float(os.environ.get('GRADING_POLL_INTERVAL', 2))
+
+    # 5. Bind plugins
     db.init_app(app)
     migrate.init_app(app, db)
 
-    # 5. Register Blueprints
+    # 6. Register Blueprints
     with app.app_context():
         from app.routes import routes
         app.register_blueprint(routes)
 
-    return app
\ No newline at end of file
+    # 7. Request timing, query timing and the /metrics endpoint
+    from app.metrics import init_metrics
+    init_metrics(app)
+
+    # 8. Start background grading workers (and the OCR processes they hand pages to)
+    from app.grading_queue import init_grading_queue
+    if app.config['GRADING_WORKERS'] > 0:
+        from app.ocr_service import init_ocr_pool
+        init_ocr_pool()
+    init_grading_queue(app)
+
+    return app
@@ -0,0 +1,315 @@
+"""
+Admission control for the AI routes.
+
+    @routes.route('/teacher/generate-test-preview', methods=['POST'])
+    @role_required('teacher')
+    @admission_controlled(cost=3)
+    async def generate_test_preview(): ...
+
+A request to an AI route is admitted only if:
+  1. rate:     the caller's own token bucket and the bucket shared by their role
+               both hold `cost` tokens (refilled continuously at N per minute),
+  2. capacity: one of ADMISSION_AI_CONCURRENCY AI request slots is free, or
+               becomes free within ADMISSION_QUEUE_TIMEOUT while the request
+               waits in a FIFO queue of at most ADMISSION_QUEUE_SIZE.
+Anything else gets a 429 with a Retry-After header. A request turned away
+for capacity gets its tokens back, so "the AI is busy" doesn't also use up
+the caller's rate limit. Because waiting requests are bounded, most server
+threads stay free for login and the dashboards even when the AI routes are
+saturated; keep concurrency + queue below the gunicorn thread count.
+
+State lives in a small SQLite file (ADMISSION_DB) so every gunicorn worker on
+the host shares the same buckets and slots. Slot leases expire, so a crashed
+worker can't hold a slot forever. If the file can't be used the layer fails
+open and logs, rather than taking the AI features down with it.
+"""
+import asyncio
+import inspect
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import make_response, session
+
+from app.metrics import Counter, Gauge, span
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") != "0"
+ADMISSION_DB = os.environ.get("ADMISSION_DB", os.path.join(tempfile.gettempdir(), "eduai_admission.sqlite3"))
+ADMISSION_USER_PER_MINUTE = float(os.environ.get("ADMISSION_USER_PER_MINUTE", 10))
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", 5))
+ADMISSION_ROLE_PER_MINUTE = float(os.environ.get("ADMISSION_ROLE_PER_MINUTE", 300))  # Shared by everyone with a role
+ADMISSION_ROLE_BURST = float(os.environ.get("ADMISSION_ROLE_BURST", 50))
+ADMISSION_AI_CONCURRENCY = int(os.environ.get("ADMISSION_AI_CONCURRENCY", 6))  # Per host, across workers
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 4))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10))
+ADMISSION_LEASE_SECONDS = float(os.environ.get("ADMISSION_LEASE_SECONDS", 300))
+QUEUE_POLL_SECONDS = 0.05
+BUSY_RETRY_AFTER = 5  # Seconds suggested to clients turned away because every slot is taken
+
+ADMISSION_REJECTED = Counter("admission_rejected_total", "AI requests turned away with 429, by reason.")
+ADMISSION_ADMITTED = Counter("admission_admitted_total", "AI requests admitted, by whether they queued first.")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS ticket (id INTEGER PRIMARY KEY AUTOINCREMENT, state TEXT NOT NULL, expires REAL NOT NULL);
+"""
+
+
+class AdmissionStore:
+    """Token buckets and AI slot tickets in a SQLite file shared by all worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # Take the write lock up front: read-modify-write below
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- Token buckets ---
+    def take(self, buckets, cost, now=None):
+        """
+        Takes `cost` tokens from every (key, per_minute, burst) bucket, or from
+        none of them. Returns 0 if taken, else seconds until there would be enough.
+        """
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            levels = []
+            for key, per_minute, burst in buckets:
+                row = conn.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * per_minute / 60)
+                levels.append((key, tokens))
+            waits = [(cost - tokens) * 60 / per_minute
+                     for (_, per_minute, _), (_, tokens) in zip(buckets, levels) if tokens < cost]
+            spend = 0 if waits else cost
+            conn.executemany("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                             [(key, tokens - spend, now) for key, tokens in levels])
+        return max(waits) if waits else 0
+
+    def refund(self, buckets, cost, now=None):
+        """Gives back `cost` tokens taken by take() for a request that was then turned away."""
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            levels = []
+            for key, per_minute, burst in buckets:
+                row = conn.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    levels.append((key, min(burst, row[0] + (now - row[1]) * per_minute / 60 + cost), now))
+            conn.executemany("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)", levels)
+
+    # --- AI slots ---
+    def enter(self, capacity, queue_size, now=None):
+        """
+        Returns (ticket, running): a slot if one is free and nobody is queued,
+        else a place in the queue. Returns (None, False) if the queue is full.
+        """
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM ticket WHERE expires < ?", (now,))
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM ticket GROUP BY state").fetchall())
+            running, waiting = counts.get("running", 0), counts.get("waiting", 0)
+            if running < capacity and waiting == 0:
+                cursor = conn.execute("INSERT INTO ticket (state, expires) VALUES ('running', ?)",
+                                      (now + ADMISSION_LEASE_SECONDS,))
+                return cursor.lastrowid, True
+            if waiting >= queue_size:
+                return None, False
+            cursor = conn.execute("INSERT INTO ticket (state, expires) VALUES ('waiting', ?)",
+                                  (now + ADMISSION_QUEUE_TIMEOUT + ADMISSION_LEASE_SECONDS,))
+            return cursor.lastrowid, False
+
+    def promote(self, ticket, capacity, now=None):
+        """Moves a queued ticket to running if a slot is free and it is at the head of the queue."""
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM ticket WHERE expires < ?", (now,))
+            running = conn.execute("SELECT COUNT(*) FROM ticket WHERE state = 'running'").fetchone()[0]
+            ahead = conn.execute("SELECT COUNT(*) FROM ticket WHERE state = 'waiting' AND id < ?",
+                                 (ticket,)).fetchone()[0]
+            if running + ahead >= capacity:
+                return False
+            conn.execute("UPDATE ticket SET state = 'running', expires = ? WHERE id = ?",
+                         (now + ADMISSION_LEASE_SECONDS, ticket))
+            return True
+
+    def release(self, ticket):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM ticket WHERE id = ?", (ticket,))
+
+    def status(self, now=None):
+        now = time.time() if now is None else now
+        conn = self._connection()
+        counts = dict(conn.execute("SELECT state, COUNT(*) FROM ticket WHERE expires >= ? GROUP BY state",
+                                   (now,)).fetchall())
+        return {"running": counts.get("running", 0), "waiting": counts.get("waiting", 0),
+                "capacity": ADMISSION_AI_CONCURRENCY, "queue_size": ADMISSION_QUEUE_SIZE}
+
+
+admission_store = AdmissionStore(ADMISSION_DB)
+
+
+def _slot_counts():
+    status = admission_store.status()
+    return {(("state", "running"),): status["running"], (("state", "waiting"),): status["waiting"]}
+
+
+ADMISSION_SLOTS = Gauge("admission_ai_requests", "AI requests holding or queued for a slot (all workers on this host).",
+                        callback=_slot_counts)
+
+
+# --- Request helpers ---
+def _too_many(reason, retry_after, message):
+    ADMISSION_REJECTED.inc(reason=reason)
+    retry_after = max(1, math.ceil(retry_after))
+    # "response" is what the chat widget shows; the other AI pages read "error".
+    body = {"error": message, "response": message, "retry_after": retry_after}
+    return body, 429, {"Retry-After": str(retry_after)}
+
+
+def _buckets():
+    return [(f"user:{session['user_id']}", ADMISSION_USER_PER_MINUTE, ADMISSION_USER_BURST),
+            (f"role:{session.get('role')}", ADMISSION_ROLE_PER_MINUTE, ADMISSION_ROLE_BURST)]
+
+
+def _enter(cost):
+    """(rejection response, ticket, running). ticket is None when admission is off or failing open."""
+    try:
+        wait = admission_store.take(_buckets(), cost)
+        if wait:
+            return _too_many("rate", wait, f"You're sending requests too quickly. Try again in {math.ceil(wait)}s."), None, False
+        ticket, running = admission_store.enter(ADMISSION_AI_CONCURRENCY, ADMISSION_QUEUE_SIZE)
+        if ticket is None:
+            _refund(cost)
+            return _too_many("queue_full", BUSY_RETRY_AFTER, "The AI is busy right now. Please try again shortly."), None, False
+        return None, ticket, running
+    except sqlite3.Error as e:
+        print(f"Admission Error (admitting anyway): {e}")
+        return None, None, True
+
+
+def _refund(cost):
+    try:
+        admission_store.refund(_buckets(), cost)
+    except sqlite3.Error as e:
+        print(f"Admission Error (refund): {e}")
+
+
+def _poll(ticket, cost, deadline):
+    """True once the ticket holds a slot, False to keep waiting, a 429 response on timeout."""
+    try:
+        if admission_store.promote(ticket, ADMISSION_AI_CONCURRENCY):
+            return True
+    except sqlite3.Error as e:
+        print(f"Admission Error (admitting anyway): {e}")
+        return True
+    if time.monotonic() >= deadline:
+        _release(ticket)
+        _refund(cost)
+        return _too_many("queue_timeout", BUSY_RETRY_AFTER, "The AI is busy right now. Please try again shortly.")
+    return False
+
+
+def _release(ticket):
+    if ticket is None:
+        return
+    try:
+        admission_store.release(ticket)
+    except sqlite3.Error as e:
+        print(f"Admission Error (release): {e}")  # The lease expires on its own
+
+
+def _finish(ticket, response):
+    """Releases the slot now, or when a streamed response has been fully sent."""
+    response = make_response(response)
+    if response.is_streamed:
+        response.call_on_close(lambda: _release(ticket))
+    else:
+        _release(ticket)
+    return response
+
+
+def admission_controlled(cost=1, precheck=None):
+    """
+    Route decorator: rate limit + global AI slot, as described above. Works on sync and async views.
+    `precheck` runs first; if it returns a response (e.g. a 400 for a bad upload) that is sent
+    without taking any tokens or a slot.
+    """
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def admitted_coroutine(*args, **kwargs):
+                if not ADMISSION_ENABLED or 'user_id' not in session:  # The view rejects anonymous callers
+                    return await f(*args, **kwargs)
+                rejection = precheck() if precheck else None
+                if rejection:
+                    return rejection
+                rejection, ticket, running = _enter(cost)
+                if rejection:
+                    return rejection
+                if not running:
+                    deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+                    with span("admission.wait"):
+                        while (outcome := _poll(ticket, cost, deadline)) is False:
+                            await asyncio.sleep(QUEUE_POLL_SECONDS)
+                    if outcome is not True:
+                        return outcome
+                ADMISSION_ADMITTED.inc(queued=str(not running).lower())
+                try:
+                    response = await f(*args, **kwargs)
+                except BaseException:
+                    _release(ticket)
+                    raise
+                return _finish(ticket, response)
+
+            return admitted_coroutine
+
+        @wraps(f)
+        def admitted_function(*args, **kwargs):
+            if not ADMISSION_ENABLED or 'user_id' not in session:
+                return f(*args, **kwargs)
+            rejection = precheck() if precheck else None
+            if rejection:
+                return rejection
+            rejection, ticket, running = _enter(cost)
+            if rejection:
+                return rejection
+            if not running:
+                deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+                with span("admission.wait"):
+                    while (outcome := _poll(ticket, cost, deadline)) is False:
+                        time.sleep(QUEUE_POLL_SECONDS)
+                if outcome is not True:
+                    return outcome
+            ADMISSION_ADMITTED.inc(queued=str(not running).lower())
+            try:
+                response = f(*args, **kwargs)
+            except BaseException:
+                _release(ticket)
+                raise
+            return _finish(ticket, response)
+
+        return admitted_function
+
+    return decorator
@@ -0,0 +1,235 @@
+"""
+Content-addressed cache for AI results.
+
+Two tiers:
+  1. An in-process LRU bounded by total payload size (bytes).
+  2. An on-disk store shared by every gunicorn worker on the host
+     (AI_CACHE_DIR/<namespace>/<ab>/<key>.json, written atomically).
+
+Entries can expire (ttl_seconds) and the disk tier can be capped
+(max_disk_bytes; oldest entries go first, checked every SWEEP_EVERY writes).
+Entries stored with a `group` live in AI_CACHE_DIR/<namespace>/<group>/ and
+can be dropped together with invalidate(group).
+
+Hit/miss counters are kept per process and exposed through stats(), along
+with the average latency of the calls the cache stands in for (observe_call)
+and an estimate of the time saved.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'ai_cache')
+SWEEP_EVERY = 200  # Disk writes between expiry/size sweeps
+SWEEP_TARGET = 0.9  # A sweep over the size limit trims down to this fraction of it
+DAY = 24 * 3600
+
+
+def make_key(*parts):
+    """sha256 over the given parts (bytes or str), length-prefixed so parts can't run together."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(str(len(part)).encode('ascii') + b':')
+        h.update(part)
+    return h.hexdigest()
+
+
+def normalize_text(text):
+    """Whitespace-insensitive form of a prompt input, so re-pasted or re-extracted text hits the same key."""
+    return " ".join((text or "").split())
+
+
+class AICache:
+    def __init__(self, namespace, max_memory_bytes, directory=None, ttl_seconds=None, max_disk_bytes=None):
+        self.namespace = namespace
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = os.path.join(directory or os.environ.get('AI_CACHE_DIR', DEFAULT_CACHE_DIR), namespace)
+        self._memory = OrderedDict()  # key -> (value, size, stored_at, group)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                          "expired": 0, "disk_evictions": 0, "invalidations": 0}
+        self._calls = [0, 0.0]  # Upstream calls timed via observe_call: [count, seconds]
+
+    # --- Public API ---
+    def get(self, key, group=None):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[2]):
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                self._forget(key)
+
+        value, stored_at = self._read_disk(key, group)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._remember(key, value, stored_at, group)
+        return value
+
+    def set(self, key, value, group=None):
+        now = time.time()
+        with self._lock:
+            self._counters["stores"] += 1
+            self._remember(key, value, now, group)
+            self._writes += 1
+            sweep = self._writes % SWEEP_EVERY == 0
+        self._write_disk(key, value, now, group)
+        if sweep and (self.ttl_seconds or self.max_disk_bytes):
+            self.sweep()
+
+    def invalidate(self, group):
+        """Drops every entry stored with this group, from memory and disk."""
+        with self._lock:
+            for key in [k for k, entry in self._memory.items() if entry[3] == group]:
+                self._forget(key)
+            self._counters["invalidations"] += 1
+        shutil.rmtree(self._group_dir(group), ignore_errors=True)
+
+    def observe_call(self, seconds):
+        """Records the latency of one upstream call made on a miss (used for the time-saved estimate)."""
+        with self._lock:
+            self._calls[0] += 1
+            self._calls[1] += seconds
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            calls, seconds = self._calls
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        stats["calls_saved"] = stats["memory_hits"] + stats["disk_hits"]
+        if calls:
+            stats["avg_call_ms"] = round(seconds * 1000 / calls, 1)
+            stats["seconds_saved"] = round(stats["calls_saved"] * seconds / calls, 1)
+        return stats
+
+    def sweep(self):
+        """Deletes expired entries, then the oldest ones while the disk tier is over max_disk_bytes."""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.json') and self._expired(info.st_mtime, now):
+                    self._unlink(path, "expired")
+                else:
+                    files.append((info.st_mtime, info.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if self.max_disk_bytes and total > self.max_disk_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes * SWEEP_TARGET:
+                    break
+                self._unlink(path, "disk_evictions")
+                total -= size
+
+    # --- Memory tier (caller holds the lock) ---
+    def _expired(self, stored_at, now=None):
+        return self.ttl_seconds is not None and stored_at + self.ttl_seconds < (now or time.time())
+
+    def _forget(self, key):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old[1]
+
+    def _remember(self, key, value, stored_at, group):
+        size = len(value.encode('utf-8')) if isinstance(value, str) else len(json.dumps(value))
+        if size > self.max_memory_bytes:
+            return
+        self._forget(key)
+        self._memory[key] = (value, size, stored_at, group)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size, _, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+            self._counters["evictions"] += 1
+
+    # --- Disk tier ---
+    def _group_dir(self, group):
+        return os.path.join(self.directory, f"g-{group}")
+
+    def _path(self, key, group=None):
+        if group is not None:
+            return os.path.join(self._group_dir(group), f"{key}.json")
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, group=None):
+        """(value, stored_at), or (None, None) if missing, unreadable or expired."""
+        path = self._path(key, group)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            value, stored_at = entry["value"], entry.get("created_at", 0)
+        except (OSError, ValueError, KeyError):
+            return None, None
+        if self._expired(stored_at):
+            self._unlink(path, "expired")
+            return None, None
+        return value, stored_at
+
+    def _write_disk(self, key, value, stored_at, group=None):
+        path = self._path(key, group)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"value": value, "created_at": stored_at}, f)
+            os.replace(tmp_path, path)  # Atomic: readers never see a half-written entry
+        except OSError as e:
+            print(f"AI Cache Error ({self.namespace}): {e}")
+
+    def _unlink(self, path, counter):
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            self._counters[counter] += 1
+
+
+# --- Shared cache instances ---
+transcription_cache = AICache(
+    "transcription",
+    max_memory_bytes=int(os.environ.get('TRANSCRIPTION_CACHE_MEMORY_MB', 16)) * 1024 * 1024,
+    ttl_seconds=float(os.environ.get('TRANSCRIPTION_CACHE_TTL_DAYS', 30)) * DAY,
+    max_disk_bytes=int(os.environ.get('TRANSCRIPTION_CACHE_DISK_MB', 512)) * 1024 * 1024,
+)
+
+answer_key_cache = AICache(
+    "answer_key",
+    max_memory_bytes=int(os.environ.get('ANSWER_KEY_CACHE_MEMORY_MB', 8)) * 1024 * 1024,
+    ttl_seconds=float(os.environ.get('ANSWER_KEY_CACHE_TTL_DAYS', 90)) * DAY,
+    max_disk_bytes=int(os.environ.get('ANSWER_KEY_CACHE_DISK_MB', 256)) * 1024 * 1024,
+)
+
+# Grading results, grouped by answer key so editing a key can drop its scores (see ai_evaluator).
+grading_cache = AICache(
+    "grading",
+    max_memory_bytes=int(os.environ.get('GRADING_CACHE_MEMORY_MB', 16)) * 1024 * 1024,
+    ttl_seconds=float(os.environ.get('GRADING_CACHE_TTL_DAYS', 30)) * DAY,
+    max_disk_bytes=int(os.environ.get('GRADING_CACHE_DISK_MB', 512)) * 1024 * 1024,
+)
+
+
+def all_cache_stats():
+    return {cache.namespace: cache.stats() for cache in (transcription_cache, answer_key_cache, grading_cache)}
@@ -0,0 +1,260 @@
+"""
+Process-wide Groq client.
+
+Every AI call in the app goes through chat_completion(), which:
+  - reuses one Groq client (and its keep-alive HTTP connection pool),
+  - caps the number of in-flight requests per worker process (AI_MAX_INFLIGHT);
+    extra callers queue for a slot instead of piling onto the API,
+  - retries 429 / 5xx / connection errors with jittered exponential backoff,
+    honouring the Retry-After header when the API sends one.
+
+stream_chat_completion() is the streaming variant used by the chat widget.
+
+chat_completion_async() is the awaitable variant for async views. All async
+calls run on one shared AI event loop (a daemon thread) with one AsyncGroq
+client, whichever event loop awaits them, so the upstream requests are
+multiplexed on that loop instead of each getting its own client. The views
+themselves still don't free their thread: under gunicorn gthread, Flask runs
+an async view to completion on its request thread, so each in-flight view
+holds one of the GUNICORN_THREADS threads while it waits. Concurrent AI views
+are therefore capped at GUNICORN_THREADS x gunicorn workers (16 x 1 with the
+Dockerfile defaults), less whatever those threads are serving otherwise.
+
+AI_MAX_INFLIGHT is the one per-process limit on upstream calls: blocking,
+streaming and async calls all take their slot from the same budget, so a
+worker never has more than AI_MAX_INFLIGHT requests open against the API.
+Async callers poll for a free slot (AI_SLOT_POLL_SECONDS) instead of blocking
+the AI loop on the semaphore.
+
+The groq SDK (and httpx under it) is imported when the first client is built,
+not when this module is, so worker boot doesn't pay for it.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+from app.metrics import span, carry_trace, AI_IN_FLIGHT, AI_WAITING, AI_ERRORS
+
+AI_MAX_INFLIGHT = int(os.environ.get("AI_MAX_INFLIGHT", 8))
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", 4))
+AI_QUEUE_TIMEOUT = float(os.environ.get("AI_QUEUE_TIMEOUT", 120))  # Max wait for a free slot
+AI_REQUEST_TIMEOUT = float(os.environ.get("AI_REQUEST_TIMEOUT", 60))
+AI_BACKOFF_BASE = float(os.environ.get("AI_BACKOFF_BASE", 1.0))
+AI_BACKOFF_CAP = float(os.environ.get("AI_BACKOFF_CAP", 30.0))
+AI_SLOT_POLL_SECONDS = 0.02
+
+_client = None
+_client_lock = threading.Lock()
+_inflight = threading.BoundedSemaphore(AI_MAX_INFLIGHT)  # Shared by the sync and async paths
+
+_async_client = None
+_ai_loop = None
+_ai_loop_lock = threading.Lock()
+
+
+class AIUnavailableError(Exception):
+    """The AI API could not be reached (no key, queue timeout, or retries exhausted)."""
+
+
+def get_client():
+    """Returns the shared Groq client, or None if GROQ_API_KEY is not configured."""
+    global _client
+    if _client is None:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            return None
+        with _client_lock:
+            if _client is None:
+                import groq
+                import httpx
+
+                http_client = groq.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=AI_MAX_INFLIGHT * 2,
+                                        max_keepalive_connections=AI_MAX_INFLIGHT),
+                    timeout=AI_REQUEST_TIMEOUT,
+                )
+                # Retries are handled below so they respect the in-flight limit.
+                _client = groq.Groq(api_key=api_key, max_retries=0, http_client=http_client)
+    return _client
+
+
+def _retryable_errors():
+    """429 / 5xx / connection errors: worth another attempt."""
+    import groq
+    return (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+
+def _retry_delay(attempt, error):
+    """Full-jitter exponential backoff, or the server's Retry-After if it asked for longer."""
+    delay = random.uniform(0, min(AI_BACKOFF_CAP, AI_BACKOFF_BASE * (2 ** attempt)))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, min(float(response.headers.get("retry-after", 0)), AI_BACKOFF_CAP))
+        except ValueError:
+            pass
+    return delay
+
+
+def _acquire_slot():
+    AI_WAITING.inc(mode="sync")
+    try:
+        if not _inflight.acquire(timeout=AI_QUEUE_TIMEOUT):
+            AI_ERRORS.inc(error="QueueTimeout")
+            raise AIUnavailableError(f"Timed out waiting for one of {AI_MAX_INFLIGHT} AI slots.")
+    finally:
+        AI_WAITING.dec(mode="sync")
+    AI_IN_FLIGHT.inc(mode="sync")
+
+
+def _release_slot():
+    AI_IN_FLIGHT.dec(mode="sync")
+    _inflight.release()
+
+
+def chat_completion(**kwargs):
+    """Drop-in for client.chat.completions.create() with pooling, queueing and retries."""
+    client = get_client()
+    if client is None:
+        raise AIUnavailableError("GROQ_API_KEY is not configured.")
+    retryable = _retryable_errors()
+
+    for attempt in range(AI_MAX_RETRIES + 1):
+        _acquire_slot()
+        try:
+            with span("groq.chat_completion"):
+                return client.chat.completions.create(**kwargs)
+        except retryable as e:
+            AI_ERRORS.inc(error=type(e).__name__)
+            if attempt == AI_MAX_RETRIES:
+                raise AIUnavailableError(f"AI request failed after {attempt + 1} attempts: {e}") from e
+            delay = _retry_delay(attempt, e)
+            print(f"AI Retry ({type(e).__name__}, attempt {attempt + 1}): sleeping {delay:.1f}s")
+        finally:
+            _release_slot()
+        time.sleep(delay)  # Outside the slot, so waiting callers can use it
+
+
+def stream_chat_completion(**kwargs):
+    """
+    Generator over the text deltas of a streamed completion.
+
+    Connecting (up to the first chunk) is retried like chat_completion(); once
+    tokens have been sent a failure is raised to the caller. The in-flight slot
+    is held until the stream ends. Closing the generator early, which the WSGI
+    server does when the client disconnects, closes the upstream HTTP response
+    so the API stops generating.
+    """
+    client = get_client()
+    if client is None:
+        raise AIUnavailableError("GROQ_API_KEY is not configured.")
+    retryable = _retryable_errors()
+
+    for attempt in range(AI_MAX_RETRIES + 1):
+        _acquire_slot()
+        stream = None
+        started = False
+        try:
+            stream = client.chat.completions.create(stream=True, **kwargs)
+            for chunk in stream:
+                started = True
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+            return
+        except retryable as e:
+            AI_ERRORS.inc(error=type(e).__name__)
+            if started or attempt == AI_MAX_RETRIES:
+                raise AIUnavailableError(f"AI stream failed after {attempt + 1} attempts: {e}") from e
+            delay = _retry_delay(attempt, e)
+            print(f"AI Retry ({type(e).__name__}, attempt {attempt + 1}): sleeping {delay:.1f}s")
+        finally:
+            if stream is not None:
+                stream.close()
+            _release_slot()
+        time.sleep(delay)
+
+
+# --- ASYNC ---
+def get_async_client():
+    """The shared AsyncGroq client (used only on the AI loop), or None without GROQ_API_KEY."""
+    global _async_client
+    if _async_client is None:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            return None
+        with _client_lock:
+            if _async_client is None:
+                import groq
+                import httpx
+
+                http_client = groq.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=AI_MAX_INFLIGHT * 2,
+                                        max_keepalive_connections=AI_MAX_INFLIGHT),
+                    timeout=AI_REQUEST_TIMEOUT,
+                )
+                _async_client = groq.AsyncGroq(api_key=api_key, max_retries=0, http_client=http_client)
+    return _async_client
+
+
+def _get_ai_loop():
+    """The process-wide AI event loop, running on a daemon thread; started on first use."""
+    global _ai_loop
+    if _ai_loop is None:
+        with _ai_loop_lock:
+            if _ai_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ai-event-loop", daemon=True).start()
+                _ai_loop = loop
+    return _ai_loop
+
+
+async def _acquire_slot_async():
+    """_acquire_slot() for the AI loop: the same semaphore, polled so the loop keeps running."""
+    AI_WAITING.inc(mode="async")
+    try:
+        deadline = time.monotonic() + AI_QUEUE_TIMEOUT
+        while not _inflight.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                AI_ERRORS.inc(error="QueueTimeout")
+                raise AIUnavailableError(f"Timed out waiting for one of {AI_MAX_INFLIGHT} AI slots.")
+            await asyncio.sleep(AI_SLOT_POLL_SECONDS)
+    finally:
+        AI_WAITING.dec(mode="async")
+    AI_IN_FLIGHT.inc(mode="async")
+
+
+async def _chat_on_ai_loop(client, kwargs):
+    retryable = _retryable_errors()
+
+    for attempt in range(AI_MAX_RETRIES + 1):
+        await _acquire_slot_async()
+        try:
+            with span("groq.chat_completion"):
+                return await client.chat.completions.create(**kwargs)
+        except retryable as e:
+            AI_ERRORS.inc(error=type(e).__name__)
+            if attempt == AI_MAX_RETRIES:
+                raise AIUnavailableError(f"AI request failed after {attempt + 1} attempts: {e}") from e
+            delay = _retry_delay(attempt, e)
+            print(f"AI Retry ({type(e).__name__}, attempt {attempt + 1}): sleeping {delay:.1f}s")
+        finally:
+            AI_IN_FLIGHT.dec(mode="async")
+            _inflight.release()
+        await asyncio.sleep(delay)  # Outside the slot, so waiting callers can use it
+
+
+async def chat_completion_async(**kwargs):
+    """
+    Awaitable chat_completion(), with the same queueing and retries. Can be
+    awaited from any event loop (a Flask async view runs each request in its
+    own); the call itself is scheduled on the shared AI loop. Cancelling the
+    await cancels the upstream call.
+    """
+    client = get_async_client()
+    if client is None:
+        raise AIUnavailableError("GROQ_API_KEY is not configured.")
+    future = asyncio.run_coroutine_threadsafe(carry_trace(_chat_on_ai_loop(client, kwargs)), _get_ai_loop())
+    return await asyncio.wrap_future(future)
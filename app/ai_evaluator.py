@@ -1,86 +1,219 @@
-import os
 import json
 import base64
-from groq import Groq
+import math
+import time
+from app.ai_cache import make_key, normalize_text, transcription_cache, answer_key_cache, grading_cache
+from app.ai_client import get_client, chat_completion, chat_completion_async, AIUnavailableError
+from app.metrics import timed
+
+
+class GradingError(Exception):
+    """The grading model call failed; the grading queue retries these."""
 
 
 def get_groq_client():
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key: return None
-    return Groq(api_key=api_key)
+    # Shared, pooled client (see app/ai_client.py); None when no API key is set.
+    return get_client()
 
 
+# Grading and transcription run on the grading workers and stay blocking; answer-key
+# generation is only called from an async view, so it only has the `_async` form.
+
 # --- 1. VISION ENGINE (Uses Llama 4 Scout) ---
-def extract_text_from_image(image_bytes):
-    client = get_groq_client()
-    if not client: return ""
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+TRANSCRIBE_PROMPT = "Transcribe the text in this image exactly. Do not add commentary."
+TRANSCRIBE_PROMPT_VERSION = "1"  # Bump to invalidate cached transcriptions
 
+
+def _transcription_request(image_bytes):
     # Encode image to base64
     base64_image = base64.b64encode(image_bytes).decode('utf-8')
+    return dict(
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": TRANSCRIBE_PROMPT},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            # Llama 4 standard format
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ],
+        # FAST MODEL for Vision
+        model=VISION_MODEL,
+    )
+
+
+def _transcription_key(image_bytes):
+    # Identical bytes + model + prompt always give the same transcription: serve from cache.
+    return make_key(image_bytes, VISION_MODEL, TRANSCRIBE_PROMPT_VERSION, TRANSCRIBE_PROMPT)
+
+
+def _store_transcription(cache_key, completion):
+    text = completion.choices[0].message.content or ""
+    if text.strip():
+        transcription_cache.set(cache_key, text)
+    return text
+
+
+@timed("extract_text_from_image")
+def extract_text_from_image(image_bytes):
+    cache_key = _transcription_key(image_bytes)
+    cached = transcription_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    client = get_groq_client()
+    if not client: return ""
 
     try:
-        completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Transcribe the text in this image exactly. Do not add commentary."},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                # Llama 4 standard format
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            # FAST MODEL for Vision
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-        )
-        return completion.choices[0].message.content
+        return _store_transcription(cache_key, chat_completion(**_transcription_request(image_bytes)))
+    except AIUnavailableError:
+        # Rate limited / API down even after retries: let the grading queue retry later.
+        raise
     except Exception as e:
         print(f"Vision Error: {e}")
         return ""
 
 
 # --- 2. REASONING ENGINE (Uses Llama 4 Maverick) ---
-def generate_answer_key(question_text):
-    client = get_groq_client()
-    if not client: return "Error: Server AI is not configured."
+REASONING_MODEL = "llama-3.3-70b-versatile"
+ANSWER_KEY_PROMPT_VERSION = "1"  # Bump when the answer-key prompt changes
+SCORE_PROMPT_VERSION = "1"  # Bump when the grading prompt or its JSON shape changes
+
+# Answer keys and scores are memoized on the normalized inputs + model + prompt
+# version (app/ai_cache.py), so resubmissions, regrades and retried jobs don't
+# pay for the same completion twice. Error results are never cached.
+
+
+def _answer_key_request(question_text):
     prompt = f"Solve and create an Answer Key for:\n{question_text}"
-    try:
-        completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            # SMART MODEL for Logic
-            model="llama-3.3-70b-versatile",
-        )
-        return completion.choices[0].message.content
-    except Exception as e:
-        return f"Error: {str(e)}"
+    return dict(
+        messages=[{"role": "user", "content": prompt}],
+        # SMART MODEL for Logic
+        model=REASONING_MODEL,
+    )
 
 
-def compute_score(student_text, answer_key):
-    client = get_groq_client()
-    if not client: return 0, {"Error": "AI unavailable"}
+def _answer_key_cache_key(question_text):
+    return make_key(REASONING_MODEL, ANSWER_KEY_PROMPT_VERSION, normalize_text(question_text))
 
-    if not student_text or not student_text.strip():
-        return 0, {"Error": "Empty text. Could not read file."}
 
+def _store_answer_key(cache_key, completion, started):
+    answer_key_cache.observe_call(time.perf_counter() - started)
+    text = completion.choices[0].message.content
+    if text and text.strip():
+        answer_key_cache.set(cache_key, text)
+    return text
+
+
+@timed("generate_answer_key")
+async def generate_answer_key_async(question_text):
+    cache_key = _answer_key_cache_key(question_text)
+    cached = answer_key_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Failures raise (AIUnavailableError when there is no key or the API is down) rather than
+    # returning an error string, so singleflight never hands one out as an answer key.
+    started = time.perf_counter()
+    return _store_answer_key(cache_key, await chat_completion_async(**_answer_key_request(question_text)), started)
+
+
+def answer_key_group(answer_key):
+    """grading_cache group for every score computed against this answer key."""
+    return make_key(normalize_text(answer_key))[:16]
+
+
+def invalidate_scores(answer_key):
+    """Drops cached scores for an answer key that is no longer in use (see models.Assignment)."""
+    if answer_key:
+        grading_cache.invalidate(answer_key_group(answer_key))
+
+
+def _score_request(student_text, answer_key):
     prompt = f"""
     Compare Student Answer to Answer Key.
     Key: {answer_key}
     Student: {student_text}
     Return STRICT JSON: {{"score": 0-100, "feedback": {{"Accuracy": "...", "Clarity": "..."}}}}
     """
+    return dict(
+        messages=[{"role": "user", "content": prompt}],
+        # SMART MODEL for Grading
+        model=REASONING_MODEL,
+        response_format={"type": "json_object"}
+    )
+
+
+def _clean_score(score):
+    """The model's score as a float in 0-100; it sometimes sends "85" or 105. Unreadable scores raise ValueError."""
+    value = float(score)
+    if not math.isfinite(value):
+        raise ValueError(f"Score is not a number: {score!r}")
+    return min(max(value, 0.0), 100.0)
+
+
+def _parse_score(completion):
+    data = json.loads(completion.choices[0].message.content)
+    return _clean_score(data.get("score", 0)), data.get("feedback", {})
+
+
+def _score_cache_key(student_text, answer_key):
+    return make_key(REASONING_MODEL, SCORE_PROMPT_VERSION, normalize_text(answer_key), normalize_text(student_text))
+
+
+def _cached_score(student_text, answer_key):
+    cached = grading_cache.get(_score_cache_key(student_text, answer_key), group=answer_key_group(answer_key))
+    if cached is None:
+        return None
+    score, feedback = cached
+    return _clean_score(score), feedback  # Entries cached before scores were cleaned
+
+
+def _store_score(student_text, answer_key, result, started):
+    grading_cache.observe_call(time.perf_counter() - started)
+    grading_cache.set(_score_cache_key(student_text, answer_key), list(result), group=answer_key_group(answer_key))
+    return result
+
+
+def _lexical_decision(student_text, answer_key):
+    """(score, feedback) from the local pre-scorer for clear-cut answers, else None (see app/lexical_scorer.py)."""
+    from app.lexical_scorer import decide  # Loads NumPy: only paid once something is graded
+    return decide(student_text, answer_key)
+
+
+def _score_without_llm(student_text, answer_key):
+    """
+    compute_score's answer when no completion is needed, else None. Empty text,
+    clear-cut lexical grades and cached scores don't need the API, so they are
+    settled before checking for a client.
+    """
+    if not student_text or not student_text.strip():
+        return 0, {"Error": "Empty text. Could not read file."}
+    decided = _lexical_decision(student_text, answer_key)
+    if decided is not None:
+        return decided
+    cached = _cached_score(student_text, answer_key)
+    if cached is not None:
+        return cached
+    if not get_groq_client(): return 0, {"Error": "AI unavailable"}
+    return None
+
+
+@timed("compute_score")
+def compute_score(student_text, answer_key):
+    early = _score_without_llm(student_text, answer_key)
+    if early is not None:
+        return early
     try:
-        completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            # SMART MODEL for Grading
-            model="llama-3.3-70b-versatile",
-            response_format={"type": "json_object"}
-        )
-        data = json.loads(completion.choices[0].message.content)
-        return data.get("score", 0), data.get("feedback", {})
-    except:
-        return 0, {"Error": "Grading failed"}
+        started = time.perf_counter()
+        result = _parse_score(chat_completion(**_score_request(student_text, answer_key)))
+    except Exception as e:
+        raise GradingError(f"Grading failed: {e}") from e
+    return _store_score(student_text, answer_key, result, started)
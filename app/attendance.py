@@ -0,0 +1,237 @@
+"""
+Bulk attendance writes.
+
+A register is written as one INSERT ... ON CONFLICT (student_id, date,
+lecture_subject) DO UPDATE, so re-submitting the same lecture updates the
+existing rows instead of duplicating them.
+
+The same call keeps the analytics rollups (AttendanceDaily per class, subject
+and day; AttendanceMonthly per student, subject and month) in step. After the
+write it recomputes every rollup row the register touches from Attendance
+itself (INSERT ... SELECT ... GROUP BY), so a double-submitted or concurrently
+saved register can't be counted twice. On PostgreSQL the recompute holds a
+transaction-level advisory lock per subject and month, so two registers saved
+at once can't overwrite each other's counts with a stale snapshot; SQLite
+already serialises writers. rebuild_attendance.py recomputes the rollups from
+scratch if they ever drift.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+
+from sqlalchemy import case, func, insert as generic_insert, literal, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.models import Attendance, AttendanceDaily, AttendanceMonthly, User
+
+UPSERT_CHUNK = 500  # Rows per statement (keeps SQLite under its bound-parameter limit)
+VALID_STATUSES = ('Present', 'Absent')
+CONFLICT_COLUMNS = ['student_id', 'date', 'lecture_subject']
+UPDATE_COLUMNS = ['status', 'teacher_id', 'class_name', 'division']
+DAILY_KEY = ['class_name', 'division', 'lecture_subject', 'date']
+MONTHLY_KEY = ['class_name', 'division', 'student_id', 'lecture_subject', 'month']
+
+
+class AttendanceImportError(Exception):
+    pass
+
+
+def _insert_for_dialect():
+    name = db.engine.dialect.name
+    if name == 'postgresql':
+        return postgresql.insert
+    if name == 'sqlite':
+        return sqlite.insert
+    return None
+
+
+# --- ROLLUPS ---
+def rollup_keys(row):
+    """(AttendanceDaily key, AttendanceMonthly key) an attendance row counts towards."""
+    class_name, division = row['class_name'] or '', row['division'] or ''
+    return ((class_name, division, row['lecture_subject'], row['date']),
+            (class_name, division, row['student_id'], row['lecture_subject'], row['date'].replace(day=1)))
+
+
+def count_into(daily, monthly, row, sign=1):
+    """Adds (or with sign=-1 removes) one row's [present, total] in the daily/monthly accumulators."""
+    present = sign if row['status'] == 'Present' else 0
+    for acc, key in zip((daily, monthly), rollup_keys(row)):
+        entry = acc.setdefault(key, [0, 0])
+        entry[0] += present
+        entry[1] += sign
+
+
+def _next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def _lock_rollups(keys):
+    """Serialises rollup recomputes per (subject, month) until the transaction ends (PostgreSQL only)."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for subject, month in sorted(keys):  # A fixed order, so two registers can't deadlock
+        lock_id = zlib.crc32(f"attendance_rollup:{subject}:{month.isoformat()}".encode())
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": lock_id})
+
+
+def _replace_rollup(model, key_columns, scope, source):
+    """Deletes the rollup rows matching `scope` and re-inserts them from the grouped `source` select."""
+    db.session.execute(model.__table__.delete().where(*scope))
+    insert = _insert_for_dialect()
+    columns = key_columns + ['present', 'total']
+    if insert is None:
+        db.session.execute(generic_insert(model.__table__).from_select(columns, source))
+        return
+    stmt = insert(model.__table__).from_select(columns, source)
+    # Idempotent: recomputing twice leaves the same counts, never the sum of both.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns, set_={'present': stmt.excluded.present, 'total': stmt.excluded.total})
+    db.session.execute(stmt)
+
+
+def _update_rollups(rows):
+    """Recomputes the daily rows of every lecture in `rows` and the monthly rows of its students. Run after the write."""
+    lectures, monthly_students = set(), {}
+    for r in rows:
+        lectures.add((r['date'], r['lecture_subject']))
+        monthly_students.setdefault((r['lecture_subject'], r['date'].replace(day=1)), set()).add(r['student_id'])
+    _lock_rollups(monthly_students)
+
+    present = func.sum(case((Attendance.status == 'Present', 1), else_=0))
+    class_name, division = func.coalesce(Attendance.class_name, ''), func.coalesce(Attendance.division, '')
+    # Every class's row for the lecture, so a mark that moved class also leaves its old class's count.
+    for date, subject in lectures:
+        source = db.session.query(
+            class_name, division, Attendance.lecture_subject, Attendance.date, present, func.count()
+        ).filter(Attendance.date == date, Attendance.lecture_subject == subject).group_by(
+            class_name, division, Attendance.lecture_subject, Attendance.date)
+        _replace_rollup(AttendanceDaily, DAILY_KEY,
+                        (AttendanceDaily.date == date, AttendanceDaily.lecture_subject == subject), source.statement)
+
+    for (subject, month), student_ids in monthly_students.items():
+        student_ids = sorted(student_ids)
+        for start in range(0, len(student_ids), UPSERT_CHUNK):
+            chunk = student_ids[start:start + UPSERT_CHUNK]
+            source = db.session.query(
+                class_name, division, Attendance.student_id, Attendance.lecture_subject, literal(month, Attendance.date.type),
+                present, func.count()
+            ).filter(Attendance.student_id.in_(chunk), Attendance.lecture_subject == subject,
+                     Attendance.date >= month, Attendance.date < _next_month(month)
+                     ).group_by(class_name, division, Attendance.student_id, Attendance.lecture_subject)
+            _replace_rollup(AttendanceMonthly, MONTHLY_KEY,
+                            (AttendanceMonthly.student_id.in_(chunk), AttendanceMonthly.lecture_subject == subject,
+                             AttendanceMonthly.month == month), source.statement)
+
+
+# --- WRITES ---
+def upsert_attendance(rows):
+    """
+    Writes attendance rows (dicts with date, lecture_subject, status, student_id,
+    teacher_id, class_name, division) in as few statements as possible, and
+    updates the rollups to match. Caller commits. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    # Last write wins for duplicates inside one batch (ON CONFLICT can't touch a row twice).
+    deduped = {(r['student_id'], r['date'], r['lecture_subject']): r for r in rows}
+    rows = list(deduped.values())
+
+    insert = _insert_for_dialect()
+    if insert is None:
+        # Generic fallback: one lookup + write per row.
+        for r in rows:
+            existing = Attendance.query.filter_by(student_id=r['student_id'], date=r['date'],
+                                                  lecture_subject=r['lecture_subject']).first()
+            if existing:
+                for column in UPDATE_COLUMNS:
+                    setattr(existing, column, r[column])
+            else:
+                db.session.add(Attendance(**r))
+        db.session.flush()
+        _update_rollups(rows)
+        return len(rows)
+
+    table = Attendance.__table__
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = insert(table).values(rows[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=CONFLICT_COLUMNS,
+            set_={column: stmt.excluded[column] for column in UPDATE_COLUMNS}
+        )
+        db.session.execute(stmt)
+    _update_rollups(rows)
+    return len(rows)
+
+
+def register_rows(students, form, date, subject, teacher_id, class_name, division):
+    """Rows for one submitted register form (status_<student id> radio buttons)."""
+    rows = []
+    for student in students:
+        status = form.get(f"status_{student.id}")
+        if status in VALID_STATUSES:
+            rows.append({"date": date, "lecture_subject": subject, "status": status, "student_id": student.id,
+                         "teacher_id": teacher_id, "class_name": class_name, "division": division})
+    return rows
+
+
+# --- CSV IMPORT ---
+def import_attendance_csv(file_storage, teacher_id, batch_size=2000):
+    """
+    Streams a CSV of registers into the database.
+
+    Columns: date (YYYY-MM-DD), subject, class_name, division, roll_no or username, status.
+    Students are resolved per class with one query each; rows are upserted in
+    batches so a whole term loads in a handful of statements.
+    Returns (written, skipped_lines). Caller commits.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline=''))
+    fields = {f.strip().lower() for f in (reader.fieldnames or [])}
+    required = {'date', 'subject', 'class_name', 'division', 'status'}
+    if not required <= fields or not ({'roll_no', 'username'} & fields):
+        raise AttendanceImportError(
+            "CSV needs columns: date, subject, class_name, division, status and roll_no or username.")
+
+    class_cache = {}  # (class, div) -> {roll_no/username: student id}
+
+    def student_lookup(class_name, division):
+        key = (class_name, division)
+        if key not in class_cache:
+            students = db.session.query(User.id, User.roll_no, User.username).filter_by(
+                role='student', class_name=class_name, division=division).all()
+            lookup = {}
+            for sid, roll_no, username in students:
+                if roll_no:
+                    lookup[('roll_no', roll_no.strip().upper())] = sid
+                lookup[('username', username.strip().lower())] = sid
+            class_cache[key] = lookup
+        return class_cache[key]
+
+    written, skipped, batch = 0, [], []
+    for line_no, raw in enumerate(reader, start=2):
+        row = {k.strip().lower(): (v or '').strip() for k, v in raw.items() if k}
+        try:
+            date = datetime.strptime(row['date'], '%Y-%m-%d').date()
+        except ValueError:
+            skipped.append(line_no)
+            continue
+        class_name, division = row['class_name'].upper(), row['division'].upper()
+        status = row['status'].capitalize()
+        lookup = student_lookup(class_name, division)
+        student_id = (lookup.get(('roll_no', row.get('roll_no', '').upper())) if row.get('roll_no') else None) \
+            or lookup.get(('username', row.get('username', '').lower()))
+        if not student_id or status not in VALID_STATUSES or not row['subject']:
+            skipped.append(line_no)
+            continue
+
+        batch.append({"date": date, "lecture_subject": row['subject'], "status": status,
+                      "student_id": student_id, "teacher_id": teacher_id,
+                      "class_name": class_name, "division": division})
+        if len(batch) >= batch_size:
+            written += upsert_attendance(batch)
+            batch = []
+
+    written += upsert_attendance(batch)
+    return written, skipped
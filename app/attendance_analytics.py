@@ -0,0 +1,140 @@
+"""
+Attendance analytics for teachers, read from the rollup tables.
+
+  - AttendanceDaily   (class, division, subject, day):      class percentages and heatmaps
+  - AttendanceMonthly (class, division, student, subject, month): per-student figures and alerts
+
+Both are maintained by upsert_attendance (app/attendance.py), so a year of
+registers is read as a few hundred rollup rows instead of every attendance
+row. There is one mark per student, subject and day, so per-student figures
+are kept by month (a per-student daily rollup would be as big as the raw
+table); student-level date ranges are therefore whole months.
+"""
+from sqlalchemy import func
+
+from app import db
+from app.attendance import count_into, DAILY_KEY, MONTHLY_KEY
+from app.models import Attendance, AttendanceDaily, AttendanceMonthly, User
+
+LOW_ATTENDANCE_PERCENT = 75  # Alert threshold
+MIN_LECTURES_FOR_ALERT = 5  # Don't flag a student after one missed lecture
+
+
+def _pct(present, total):
+    return round(present * 100.0 / total, 1) if total else None
+
+
+def _month(day):
+    return day.replace(day=1) if day else None
+
+
+def _class_filter(query, model, class_name, division):
+    return query.filter(model.class_name == (class_name or ''), model.division == (division or ''))
+
+
+# --- 1. CLASS LEVEL (AttendanceDaily) ---
+def subject_percentages(class_name, division, date_from=None, date_to=None):
+    """[{subject, present, total, pct}] for the class, best-attended subject first."""
+    query = _class_filter(db.session.query(
+        AttendanceDaily.lecture_subject, func.sum(AttendanceDaily.present), func.sum(AttendanceDaily.total)
+    ), AttendanceDaily, class_name, division)
+    if date_from:
+        query = query.filter(AttendanceDaily.date >= date_from)
+    if date_to:
+        query = query.filter(AttendanceDaily.date <= date_to)
+    rows = [{"subject": subject, "present": int(present or 0), "total": int(total or 0),
+             "pct": _pct(present or 0, total or 0)}
+            for subject, present, total in query.group_by(AttendanceDaily.lecture_subject)]
+    return sorted(rows, key=lambda r: -(r["pct"] or 0))
+
+
+def heatmap(class_name, division, date_from, date_to):
+    """
+    Class attendance % per day and subject between two dates:
+    {"dates": [...], "subjects": [...], "cells": {subject: [pct or None per date]}, "daily": [pct or None per date]}
+    Only days with at least one register appear.
+    """
+    query = _class_filter(db.session.query(
+        AttendanceDaily.date, AttendanceDaily.lecture_subject, AttendanceDaily.present, AttendanceDaily.total
+    ), AttendanceDaily, class_name, division).filter(
+        AttendanceDaily.date >= date_from, AttendanceDaily.date <= date_to, AttendanceDaily.total > 0
+    ).order_by(AttendanceDaily.date)
+
+    cells, per_day = {}, {}
+    for day, subject, present, total in query:
+        cells.setdefault(subject, {})[day] = _pct(present, total)
+        day_total = per_day.setdefault(day, [0, 0])
+        day_total[0] += present
+        day_total[1] += total
+    dates = sorted(per_day)
+    subjects = sorted(cells)
+    return {
+        "dates": dates,
+        "subjects": subjects,
+        "cells": {subject: [cells[subject].get(day) for day in dates] for subject in subjects},
+        "daily": [_pct(*per_day[day]) for day in dates],
+    }
+
+
+# --- 2. STUDENT LEVEL (AttendanceMonthly) ---
+def _student_rows(query, month_from, month_to):
+    if month_from:
+        query = query.filter(AttendanceMonthly.month >= _month(month_from))
+    if month_to:
+        query = query.filter(AttendanceMonthly.month <= _month(month_to))
+    return query
+
+
+def low_attendance(class_name, division, month_from=None, month_to=None,
+                   threshold=LOW_ATTENDANCE_PERCENT, min_lectures=MIN_LECTURES_FOR_ALERT):
+    """
+    Students whose overall attendance, or attendance in any one subject, is
+    below `threshold` %. Lowest overall first:
+    [{student_id, roll_no, username, present, total, pct, low_subjects: [{subject, pct}]}]
+    """
+    query = _class_filter(db.session.query(
+        AttendanceMonthly.student_id, User.roll_no, User.username, AttendanceMonthly.lecture_subject,
+        func.sum(AttendanceMonthly.present), func.sum(AttendanceMonthly.total)
+    ).join(User, AttendanceMonthly.student_id == User.id), AttendanceMonthly, class_name, division)
+    query = _student_rows(query, month_from, month_to).group_by(
+        AttendanceMonthly.student_id, User.roll_no, User.username, AttendanceMonthly.lecture_subject)
+
+    students = {}
+    for student_id, roll_no, username, subject, present, total in query:
+        entry = students.setdefault(student_id, {"student_id": student_id, "roll_no": roll_no, "username": username,
+                                                 "present": 0, "total": 0, "low_subjects": []})
+        entry["present"] += int(present or 0)
+        entry["total"] += int(total or 0)
+        if total and total >= min_lectures and _pct(present or 0, total) < threshold:
+            entry["low_subjects"].append({"subject": subject, "pct": _pct(present or 0, total)})
+
+    alerts = []
+    for entry in students.values():
+        if entry["total"] < min_lectures:
+            continue
+        entry["pct"] = _pct(entry["present"], entry["total"])
+        if entry["pct"] < threshold or entry["low_subjects"]:
+            entry["low_subjects"].sort(key=lambda s: s["pct"])
+            alerts.append(entry)
+    return sorted(alerts, key=lambda e: (e["pct"], e["roll_no"] or ""))
+
+
+# --- 3. REBUILD (rebuild_attendance.py, upgrade_schema) ---
+def rebuild_attendance_rollups(batch_size=5000):
+    """Recomputes both rollup tables from Attendance, streaming rows in batches. Returns (daily, monthly) row counts."""
+    daily, monthly = {}, {}
+    rows = db.session.query(
+        Attendance.student_id, Attendance.date, Attendance.lecture_subject, Attendance.status,
+        Attendance.class_name, Attendance.division
+    ).execution_options(yield_per=batch_size)
+    for row in rows:
+        count_into(daily, monthly, row._asdict())
+
+    AttendanceDaily.query.delete(synchronize_session=False)
+    AttendanceMonthly.query.delete(synchronize_session=False)
+    for model, key_columns, acc in ((AttendanceDaily, DAILY_KEY, daily), (AttendanceMonthly, MONTHLY_KEY, monthly)):
+        values = [dict(zip(key_columns, key), present=present, total=total) for key, (present, total) in acc.items()]
+        for start in range(0, len(values), batch_size):
+            db.session.execute(model.__table__.insert(), values[start:start + batch_size])
+    db.session.commit()
+    return len(daily), len(monthly)
@@ -0,0 +1,75 @@
+"""
+Content-addressed blob store for uploaded files.
+
+Rows keep only the sha256, size and mime type; the bytes live on disk at
+BLOB_STORE_DIR/<ab>/<cd>/<sha256>. Identical uploads are stored once.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from io import BytesIO
+
+DEFAULT_BLOB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'blobs')
+CHUNK_SIZE = 64 * 1024
+
+
+class LocalBlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put_stream(self, stream):
+        """
+        Copies `stream` into the store in fixed-size chunks, hashing as it goes,
+        so large uploads never sit in memory. Returns (sha256, size).
+        """
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            sha256 = digest.hexdigest()
+            final_path = self.path(sha256)
+            if os.path.exists(final_path):
+                os.remove(tmp_path)  # Already stored (same content)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return sha256, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, data):
+        return self.put_stream(BytesIO(data))
+
+    def open(self, sha256):
+        """The stored file, opened for reading; raises FileNotFoundError if it isn't there."""
+        return open(self.path(sha256), 'rb')
+
+
+blob_store = LocalBlobStore(os.environ.get('BLOB_STORE_DIR', DEFAULT_BLOB_DIR))
+
+
+def guess_mimetype(filename, fallback=None):
+    return mimetypes.guess_type(filename or "")[0] or fallback or 'application/octet-stream'
+
+
+def store_upload(file_storage):
+    """Streams a werkzeug FileStorage into the blob store. Returns (sha256, size, mimetype)."""
+    sha256, size = blob_store.put_stream(file_storage.stream)
+    mimetype = file_storage.mimetype if file_storage.mimetype not in (None, '', 'application/octet-stream') else None
+    return sha256, size, mimetype or guess_mimetype(file_storage.filename)
@@ -0,0 +1,159 @@
+"""
+Query helpers for the dashboards.
+
+Everything here is bounded: lists are keyset-paginated (WHERE id < cursor
+ORDER BY id DESC LIMIT n) and per-class numbers come from grouped SQL, so page
+cost does not grow with the size of the user table.
+"""
+from sqlalchemy import func, case, and_
+
+from app import db
+from app.models import User, Assignment, Submission, Attendance, TeacherClass
+
+ADMIN_PAGE_SIZE = 50
+
+
+def keyset_page(query, id_column, after=None, page_size=ADMIN_PAGE_SIZE):
+    """
+    Newest-first page of `query`, starting below id `after`.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if after:
+        query = query.filter(id_column < after)
+    rows = query.order_by(id_column.desc()).limit(page_size + 1).all()
+    if len(rows) > page_size:
+        return rows[:page_size], rows[page_size - 1].id
+    return rows, None
+
+
+def _cursor(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+# --- ADMIN DASHBOARD ---
+def admin_user_pages(args):
+    """One keyset page per role section; each section has its own ?<role>s_after= cursor."""
+    pages = {}
+    for role in ('admin', 'teacher', 'student'):
+        rows, next_cursor = keyset_page(User.query.filter(User.role == role), User.id,
+                                        _cursor(args.get(f'{role}s_after')))
+        pages[role] = {"rows": rows, "next": next_cursor, "paged": bool(args.get(f'{role}s_after'))}
+    return pages
+
+
+def admin_assignment_page(args):
+    rows, next_cursor = keyset_page(Assignment.query, Assignment.id, _cursor(args.get('assignments_after')))
+    return {"rows": rows, "next": next_cursor, "paged": bool(args.get('assignments_after'))}
+
+
+def admin_counts():
+    """Headline counts, one grouped query for users."""
+    by_role = dict(db.session.query(User.role, func.count(User.id)).group_by(User.role).all())
+    return {
+        "users": sum(by_role.values()),
+        "by_role": by_role,
+        "assignments": db.session.query(func.count(Assignment.id)).scalar() or 0,
+    }
+
+
+def class_summaries():
+    """
+    [{class_name, division, key, students, teachers}] built from two GROUP BY
+    queries instead of walking every user in Python.
+    """
+    student_counts = db.session.query(
+        User.class_name, User.division, func.count(User.id)
+    ).filter(
+        User.role == 'student', User.class_name.isnot(None), User.division.isnot(None)
+    ).group_by(User.class_name, User.division).all()
+
+    teacher_counts = db.session.query(
+        TeacherClass.class_name, TeacherClass.division, func.count(func.distinct(TeacherClass.teacher_id))
+    ).group_by(TeacherClass.class_name, TeacherClass.division).all()
+
+    summary = {}
+    for class_name, division, count in student_counts:
+        summary[(class_name, division)] = {"students": count, "teachers": 0}
+    for class_name, division, count in teacher_counts:
+        summary.setdefault((class_name, division), {"students": 0, "teachers": 0})["teachers"] = count
+
+    return [
+        {"class_name": c, "division": d, "key": f"{c} - {d}", **counts}
+        for (c, d), counts in sorted(summary.items())
+    ]
+
+
+def class_roster(class_name, division, after=None, page_size=ADMIN_PAGE_SIZE):
+    """Teachers of a class plus one keyset page of its students."""
+    teachers = User.query.join(TeacherClass, TeacherClass.teacher_id == User.id).filter(
+        TeacherClass.class_name == class_name, TeacherClass.division == division
+    ).order_by(User.username).all()
+    students, next_cursor = keyset_page(
+        User.query.filter_by(role='student', class_name=class_name, division=division),
+        User.id, _cursor(after), page_size
+    )
+    return teachers, students, next_cursor
+
+
+# --- STUDENT DASHBOARD ---
+def attendance_totals_columns(student_id):
+    """(total, present) as correlated scalar subqueries using conditional aggregation."""
+    total = db.session.query(func.count(Attendance.id)).filter(Attendance.student_id == student_id).scalar_subquery()
+    present = db.session.query(
+        func.coalesce(func.sum(case((Attendance.status == 'Present', 1), else_=0)), 0)
+    ).filter(Attendance.student_id == student_id).scalar_subquery()
+    return total, present
+
+
+def student_dashboard_data(student_id):
+    """
+    Everything the student dashboard needs in two queries:
+      1. the student row plus attendance totals (scalar subqueries, one round trip)
+      2. the class's assignments LEFT JOINed to this student's submissions
+    Both are served by the composite indexes declared in app/models.py.
+    """
+    total_col, present_col = attendance_totals_columns(student_id)
+    row = db.session.query(User, total_col, present_col).filter(User.id == student_id).first()
+    if row is None:
+        return None
+    student, total, present = row
+
+    rows = db.session.query(Assignment, Submission).outerjoin(
+        Submission, and_(Submission.assignment_id == Assignment.id, Submission.student_id == student_id)
+    ).filter(
+        Assignment.class_name == student.class_name, Assignment.division == student.division
+    ).order_by(Assignment.id, Submission.id).all()
+
+    assignments, submitted_map = [], {}
+    for assignment, submission in rows:
+        if not assignments or assignments[-1].id != assignment.id:
+            assignments.append(assignment)
+        if submission is not None:
+            submitted_map[assignment.id] = submission  # Latest submission wins
+
+    total = total or 0
+    present = present or 0
+    return {
+        "student": student,
+        "assignments": assignments,
+        "submitted_map": submitted_map,
+        "att_pct": int((present / total) * 100) if total > 0 else 0,
+        "present_days": present,
+        "total_days": total,
+    }
+
+
+# --- ROSTER SYNC ---
+def sync_teacher_classes(teacher):
+    """Mirrors teacher.assigned_classes into TeacherClass rows (caller commits)."""
+    desired = {(c['class_name'], c['division']) for c in (teacher.assigned_classes or [])
+               if c.get('class_name') and c.get('division')}
+    existing = {(tc.class_name, tc.division): tc for tc in TeacherClass.query.filter_by(teacher_id=teacher.id)}
+
+    for key in desired - existing.keys():
+        db.session.add(TeacherClass(teacher_id=teacher.id, class_name=key[0], division=key[1]))
+    for key in existing.keys() - desired:
+        db.session.delete(existing[key])
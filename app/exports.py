@@ -0,0 +1,245 @@
+"""
+Streaming CSV / XLSX exports (gradebook, test results, attendance).
+
+    rows = attendance_rows(teacher_id, date_from=..., date_to=...)
+    return export_response("attendance", ATTENDANCE_COLUMNS, rows, "xlsx")
+
+Rows are read with yield_per (a server-side cursor on PostgreSQL) as plain
+column tuples, so no ORM objects pile up in the session, and each chunk is
+encoded and sent before the next one is fetched. Memory stays flat however
+many rows there are, and the download starts with the first chunk.
+
+XLSX files are written directly as a zip stream (inline strings, no styles)
+instead of through a spreadsheet library, which would build the whole
+workbook before sending a byte.
+"""
+import codecs
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+from app import db
+from app.metrics import span
+from app.models import Attendance, Submission, TestResult, User
+
+EXPORT_BATCH_ROWS = 1000  # Rows fetched per round trip and encoded per chunk
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Same columns the attendance CSV import reads, so an export can be re-imported.
+ATTENDANCE_COLUMNS = ["date", "subject", "class_name", "division", "roll_no", "username", "status"]
+GRADEBOOK_COLUMNS = ["roll_no", "username", "class_name", "division", "submitted_at", "status", "score",
+                     "accuracy", "clarity"]
+TEST_RESULT_COLUMNS = ["roll_no", "username", "class_name", "division", "score", "total_questions",
+                       "percentage", "completed_at"]
+
+
+class ExportError(Exception):
+    pass
+
+
+# --- 1. ROW SOURCES (generators of tuples) ---
+def _stream(statement):
+    """Yields result rows in EXPORT_BATCH_ROWS batches from a server-side cursor."""
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+    partitions = result.partitions()
+    try:
+        while True:
+            with span("export.fetch"):
+                batch = next(partitions, None)
+            if batch is None:
+                return
+            yield from batch
+    finally:
+        result.close()
+
+
+def attendance_rows(teacher_id, class_name=None, division=None, date_from=None, date_to=None):
+    statement = (
+        db.select(Attendance.date, Attendance.lecture_subject, Attendance.class_name, Attendance.division,
+                  User.roll_no, User.username, Attendance.status)
+        .join(User, Attendance.student_id == User.id)
+        .where(Attendance.teacher_id == teacher_id)
+        .order_by(Attendance.date, Attendance.lecture_subject, User.roll_no, Attendance.id)
+    )
+    if class_name:
+        statement = statement.where(Attendance.class_name == class_name)
+    if division:
+        statement = statement.where(Attendance.division == division)
+    if date_from:
+        statement = statement.where(Attendance.date >= date_from)
+    if date_to:
+        statement = statement.where(Attendance.date <= date_to)
+    return _stream(statement)
+
+
+def gradebook_rows(assignment_id):
+    statement = (
+        db.select(User.roll_no, User.username, User.class_name, User.division, Submission.submission_date,
+                  Submission.status, Submission.score, Submission.detailed_feedback)
+        .join(User, Submission.student_id == User.id)
+        .where(Submission.assignment_id == assignment_id)
+        .order_by(User.roll_no, User.username, Submission.id)
+    )
+    for *row, feedback in _stream(statement):
+        feedback = feedback if isinstance(feedback, dict) else {}
+        yield (*row, feedback.get("Accuracy"), feedback.get("Clarity"))
+
+
+def test_result_rows(test_id):
+    statement = (
+        db.select(User.roll_no, User.username, User.class_name, User.division, TestResult.score,
+                  TestResult.total_questions, TestResult.completed_at)
+        .join(User, TestResult.student_id == User.id)
+        .where(TestResult.test_id == test_id)
+        .order_by(User.roll_no, User.username, TestResult.id)
+    )
+    for *row, score, total, completed_at in _stream(statement):
+        percentage = round(score * 100 / total, 1) if score is not None and total else None
+        yield (*row, score, total, percentage, completed_at)
+
+
+# --- 2. ENCODERS (generators of bytes) ---
+def _chunks(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Excel/LibreOffice run a cell that starts with one of these as a formula. Usernames and
+# LLM feedback (which student text can steer) are untrusted, so such strings get a leading '.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str):
+        return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+    return str(value)  # Numbers stay numbers, including negative ones
+
+
+def csv_stream(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8')  # BOM so Excel reads UTF-8
+    for batch in _chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([[_text(v) for v in row] for row in batch])
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ZipSink:
+    """Write-only, unseekable file for zipfile; the bytes written so far are collected with drain()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+
+def _workbook_xml(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>')
+
+
+def _cell(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        text = escape(_XML_ILLEGAL.sub('', _text(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    return f'<c><v>{value}</v></c>'
+
+
+def _sheet_rows(rows):
+    return "".join("<row>" + "".join(_cell(v) for v in row) + "</row>" for row in rows)
+
+
+def xlsx_stream(sheet_name, columns, rows):
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in XLSX_PARTS.items():
+            archive.writestr(name, xml)
+        archive.writestr("xl/workbook.xml", _workbook_xml(sheet_name))
+        with archive.open("xl/worksheets/sheet1.xml", 'w', force_zip64=True) as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetData>' + _sheet_rows([columns])).encode('utf-8'))
+            yield sink.drain()
+            for batch in _chunks(rows):
+                sheet.write(_sheet_rows(batch).encode('utf-8'))
+                yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+# --- 3. RESPONSE ---
+def export_response(name, columns, rows, fmt):
+    """A chunked download of `rows`; raises ExportError for an unknown format."""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}'. Use csv or xlsx.")
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'export'  # Safe as a filename and sheet name
+    body = csv_stream(columns, rows) if fmt == "csv" else xlsx_stream(name, columns, rows)
+    # stream_with_context keeps the request (and its DB session) alive while the generator runs.
+    return Response(stream_with_context(body), mimetype=FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"',
+                             "X-Accel-Buffering": "no"})
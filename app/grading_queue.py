@@ -0,0 +1,317 @@
+"""
+Background grading queue.
+
+A student upload is stored as a 'pending' Submission plus a GradingJob row and
+the request returns immediately. A small pool of worker threads claims jobs
+from the database, runs OCR + scoring and writes the result back. Because the
+queue lives in the database it is shared by every gunicorn worker and survives
+restarts: jobs left 'running' by a dead process are re-queued once their lease
+expires (or failed, if that was their last attempt). A run only writes its
+result while it still owns the job, so a slow run whose lease expired can't
+grade the submission a second time alongside the worker that re-claimed it.
+
+A bulk regrade is the same kind of job tagged with a batch_id. The text
+extracted on first grading is stored on the Submission, so a regrade is one
+scoring call per submission and no OCR. Fan-out is bounded by the worker pool
+and by ai_client's in-flight limit.
+"""
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from flask import current_app
+from sqlalchemy import func
+from werkzeug.datastructures import FileStorage
+
+from app import db
+from app.blob_store import blob_store
+from app.ingestion import extract_text, IngestionError
+from app.metrics import trace, JOB_LATENCY, SLOW_JOB_SECONDS
+from app.models import GradingJob, Submission
+from app.stats import record_submission_score
+
+
+class QueueFullError(Exception):
+    """Raised when the number of waiting jobs has reached GRADING_QUEUE_LIMIT."""
+
+
+# --- 1. PRODUCER SIDE (called from request handlers) ---
+def enqueue_submission(submission):
+    """
+    Adds a GradingJob for `submission` to the current session. The caller commits
+    and then calls notify_workers() so a local worker picks it up straight away.
+    """
+    _check_capacity(1)
+    submission.status = 'pending'
+    job = GradingJob(submission=submission, max_attempts=current_app.config['GRADING_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+def enqueue_regrade(assignment):
+    """
+    Queues one batch of jobs that regrade every submission of `assignment`
+    (skipping any that already have a job waiting). Submissions keep their
+    current score until the new one is written. Returns (batch_id, count);
+    the caller commits and then calls notify_workers().
+    """
+    active = db.session.query(GradingJob.submission_id).filter(GradingJob.status.in_(('queued', 'running')))
+    submission_ids = [sid for (sid,) in db.session.query(Submission.id).filter(
+        Submission.assignment_id == assignment.id, Submission.id.notin_(active)
+    ).order_by(Submission.id)]
+    _check_capacity(len(submission_ids))
+
+    batch_id = uuid.uuid4().hex
+    max_attempts = current_app.config['GRADING_MAX_ATTEMPTS']
+    db.session.add_all([GradingJob(submission_id=sid, batch_id=batch_id, max_attempts=max_attempts)
+                        for sid in submission_ids])
+    return batch_id, len(submission_ids)
+
+
+def _check_capacity(new_jobs):
+    limit = current_app.config['GRADING_QUEUE_LIMIT']
+    backlog = GradingJob.query.filter(GradingJob.status.in_(('queued', 'running'))).count()
+    if backlog + new_jobs > limit:
+        raise QueueFullError(f"{backlog} grading jobs are already waiting.")
+
+
+def notify_workers():
+    pool = current_app.extensions.get('grading_queue')
+    if pool:
+        pool.notify()
+
+
+def submission_status(submission):
+    """Small JSON-friendly view of a submission used by the status/poll endpoint."""
+    job = GradingJob.query.filter_by(submission_id=submission.id).order_by(GradingJob.id.desc()).first()
+    return {
+        "id": submission.id,
+        "status": submission.status,
+        "score": submission.score if submission.status == 'graded' else None,
+        "feedback": submission.detailed_feedback if submission.status != 'pending' else None,
+        "attempts": job.attempts if job else 0,
+        "max_attempts": job.max_attempts if job else 0,
+    }
+
+
+def regrade_progress(assignment_id, batch_id):
+    """Job counts per status for one regrade batch, plus the errors of failed jobs."""
+    batch = db.session.query(GradingJob.status, func.count(GradingJob.id)).join(
+        Submission, GradingJob.submission_id == Submission.id
+    ).filter(GradingJob.batch_id == batch_id, Submission.assignment_id == assignment_id).group_by(GradingJob.status)
+    counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+    counts.update(dict(batch.all()))
+
+    failures = db.session.query(GradingJob.submission_id, GradingJob.last_error).filter(
+        GradingJob.batch_id == batch_id, GradingJob.status == 'failed'
+    ).order_by(GradingJob.id).limit(20).all()
+    total = sum(counts.values())
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        **counts,
+        "finished": counts["queued"] + counts["running"] == 0,  # An empty or unknown batch has nothing to wait for
+        "failures": [{"submission_id": sid, "error": error} for sid, error in failures],
+    }
+
+
+# --- 2. CONSUMER SIDE (worker threads) ---
+def _backoff_seconds(attempts):
+    """Exponential backoff with jitter: ~5s, ~10s, ~20s ... capped at 5 minutes."""
+    base = current_app.config['GRADING_RETRY_BASE_SECONDS']
+    delay = min(base * (2 ** max(attempts - 1, 0)), 300)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def requeue_stale_jobs():
+    """
+    Puts 'running' jobs whose lease expired (worker crashed, was killed or hung)
+    back in the queue. Jobs that have already used all their attempts are failed
+    instead, so a submission that kills its worker isn't claimed forever.
+    """
+    lease = timedelta(seconds=current_app.config['GRADING_JOB_LEASE_SECONDS'])
+    stale = (GradingJob.status == 'running', GradingJob.locked_at < datetime.utcnow() - lease)
+
+    for job in GradingJob.query.filter(*stale, GradingJob.attempts >= GradingJob.max_attempts).all():
+        failed = GradingJob.query.filter_by(id=job.id, status='running', attempts=job.attempts).update(
+            {"status": "failed", "locked_at": None,
+             "last_error": "Lease expired: the worker died or the job ran past GRADING_JOB_LEASE_SECONDS."},
+            synchronize_session=False
+        )
+        if failed:
+            _fail_submission(job.submission)
+            print(f"Grading Error (job {job.id}, giving up): lease expired on attempt {job.attempts}/{job.max_attempts}")
+    count = GradingJob.query.filter(*stale, GradingJob.attempts < GradingJob.max_attempts).update(
+        {"status": "queued", "locked_at": None}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def claim_next_job():
+    """
+    Atomically moves the oldest runnable job from 'queued' to 'running'.
+    The conditional UPDATE means two workers (threads or processes) can never
+    claim the same job.
+    """
+    now = datetime.utcnow()
+    # New submissions go ahead of bulk regrades so students aren't stuck behind a batch.
+    candidates = db.session.query(GradingJob.id).filter(
+        GradingJob.status == 'queued',
+        GradingJob.run_after <= now
+    ).order_by(GradingJob.batch_id.isnot(None), GradingJob.id).limit(5).all()
+
+    for (job_id,) in candidates:
+        claimed = GradingJob.query.filter_by(id=job_id, status='queued').update(
+            {"status": "running", "locked_at": now, "attempts": GradingJob.attempts + 1},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(GradingJob, job_id)
+    return None
+
+
+def _extract_submission_text(submission):
+    filename = submission.submitted_filename or "answer.txt"
+    if submission.submitted_sha256:
+        with blob_store.open(submission.submitted_sha256) as stream:  # Streamed from disk, not read whole
+            return extract_text(FileStorage(stream=stream, filename=filename))
+    data = submission.submitted_file or b""  # Not yet moved by migrate_blobs.py
+    return extract_text(FileStorage(stream=BytesIO(data), filename=filename))
+
+
+def run_job(job):
+    with trace(f"grading job {job.id} (submission {job.submission_id})", SLOW_JOB_SECONDS) as current:
+        _run_job(job)
+    JOB_LATENCY.observe(current.elapsed(), status=job.status)
+
+
+def _run_job(job):
+    from app.ai_evaluator import compute_score, get_groq_client
+    from app.ai_client import AIUnavailableError
+
+    submission = job.submission
+    attempt = job.attempts  # Ownership token: a re-claim after an expired lease increments it
+    previous_score = submission.score if submission.status == 'graded' else None
+    try:
+        if previous_score is not None and get_groq_client() is None:
+            # Don't replace a real grade with compute_score's "AI unavailable" zero.
+            raise AIUnavailableError("GROQ_API_KEY is not configured.")
+
+        student_text = submission.extracted_text
+        if student_text is None:
+            student_text = _extract_submission_text(submission)
+            if student_text.strip():
+                submission.extracted_text = student_text
+        score, feedback = compute_score(student_text, submission.assignment.answer_key_content)
+
+        # Only the current owner may write the result. If this run was slow enough for its lease
+        # to expire, another worker has the job now and counting both scores would skew the rollups.
+        if not _finish_job(job.id, attempt):
+            db.session.rollback()
+            print(f"Grading Error (job {job.id}): lease lost on attempt {attempt}, result discarded")
+            return
+        submission.score = score
+        submission.detailed_feedback = feedback
+        submission.status = 'graded'
+        record_submission_score(submission, previous_score)
+        db.session.commit()
+    except IngestionError as e:
+        db.session.rollback()
+        _record_failure(job.id, attempt, e, permanent=True)  # Over a size/page limit: retrying won't help
+    except Exception as e:
+        db.session.rollback()
+        _record_failure(job.id, attempt, e)
+
+
+def _finish_job(job_id, attempt):
+    """Marks the job done if this attempt still owns it (the row stays locked until commit)."""
+    return GradingJob.query.filter_by(id=job_id, status='running', attempts=attempt).update(
+        {"status": "done", "locked_at": None, "last_error": None}, synchronize_session=False
+    ) == 1
+
+
+def _fail_submission(submission):
+    if submission.status != 'graded':  # A failed regrade keeps the previous grade
+        submission.status = 'failed'
+        submission.score = 0
+        submission.detailed_feedback = {"Error": "Grading failed. Please resubmit."}
+
+
+def _record_failure(job_id, attempt, error, permanent=False):
+    job = db.session.get(GradingJob, job_id)
+    if job.status != 'running' or job.attempts != attempt:
+        return  # The lease expired and the job was re-queued, re-claimed or failed meanwhile
+    submission = job.submission
+    job.last_error = f"{type(error).__name__}: {error}"
+    job.locked_at = None
+
+    if permanent or job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        _fail_submission(submission)
+        print(f"Grading Error (job {job.id}, giving up): {job.last_error}")
+    else:
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=_backoff_seconds(job.attempts))
+        print(f"Grading Error (job {job.id}, attempt {job.attempts}/{job.max_attempts}): {job.last_error}")
+    db.session.commit()
+
+
+class GradingWorkerPool:
+    def __init__(self, app, size, poll_interval):
+        self.app = app
+        self.size = size
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._worker_loop, name=f"grading-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _worker_loop(self):
+        last_reap = None
+        while not self._stop.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    now = datetime.utcnow()
+                    if last_reap is None or (now - last_reap).total_seconds() > self.poll_interval * 10:
+                        requeue_stale_jobs()
+                        last_reap = now
+                    job = claim_next_job()
+                    if job:
+                        run_job(job)
+                except Exception as e:
+                    # Usually "no such table" before init_db.py has run; keep polling.
+                    db.session.rollback()
+                    print(f"Grading Worker Error: {e}")
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+
+def init_grading_queue(app):
+    size = app.config['GRADING_WORKERS']
+    if size <= 0:
+        return None
+    pool = GradingWorkerPool(app, size, app.config['GRADING_POLL_INTERVAL'])
+    app.extensions['grading_queue'] = pool
+    pool.start()
+    return pool
@@ -0,0 +1,167 @@
+"""
+Document ingestion: one place that turns an uploaded file into text.
+
+Extractors are registered per file extension and yield text in pieces
+(a page, a paragraph, a slide, a 64 KB block) rather than building one big
+string, so large uploads stream through with bounded memory. Every file is
+checked against INGEST_MAX_BYTES and, for paged formats, INGEST_MAX_PAGES
+before any parsing starts.
+
+Adding a format is one decorated function:
+
+    @extractor('.odt')
+    def extract_odt(stream, max_pages):
+        yield ...
+"""
+import codecs
+import os
+
+from app.ai_client import AIUnavailableError
+from app.metrics import span
+from app.ocr_service import iter_ocr_scanned_pdf, extract_text_tiered, prepare_pages
+
+INGEST_MAX_BYTES = int(os.environ.get("INGEST_MAX_MB", 50)) * 1024 * 1024
+INGEST_MAX_PAGES = int(os.environ.get("INGEST_MAX_PAGES", 300))
+TEXT_BLOCK_BYTES = 64 * 1024
+SCANNED_PDF_MIN_CHARS = 10  # Less embedded text than this means the PDF is a scan
+
+EXTRACTORS = {}
+
+
+class IngestionError(Exception):
+    """The file breaks a size/page limit; shown to the user as-is."""
+
+
+def extractor(*extensions):
+    """Registers `fn(stream, max_pages) -> iterator of str` for the given extensions."""
+    def register(fn):
+        for extension in extensions:
+            EXTRACTORS[extension] = fn
+        return fn
+    return register
+
+
+def extractor_for(filename):
+    extension = os.path.splitext((filename or "").lower())[1]
+    return EXTRACTORS.get(extension, extract_plain_text)
+
+
+# --- 1. EXTRACTORS ---
+@extractor('.pdf')
+def extract_pdf(stream, max_pages):
+    import pypdf  # Parsers are imported on first use, not at worker boot
+
+    reader = pypdf.PdfReader(stream)
+    page_count = len(reader.pages)
+    _check_pages(page_count, max_pages)
+
+    # Hold the first pages back until we know the PDF has real text; a scan goes to OCR instead.
+    pending, found = [], 0
+    for page in reader.pages:
+        with span("pypdf.extract_text"):
+            text = page.extract_text()
+        if not text:
+            continue
+        if found >= SCANNED_PDF_MIN_CHARS:
+            yield text + "\n"
+            continue
+        pending.append(text + "\n")
+        found += len(text.strip())
+        if found >= SCANNED_PDF_MIN_CHARS:
+            yield from pending
+            pending = []
+
+    if found < SCANNED_PDF_MIN_CHARS:
+        # Scanned PDF: render + OCR in bounded, concurrent page windows
+        stream.seek(0)
+        for text in iter_ocr_scanned_pdf(stream.read(), page_count, extract_text_tiered):
+            yield text + "\n"
+
+
+@extractor('.docx')
+def extract_docx(stream, max_pages):
+    from docx import Document
+
+    for paragraph in Document(stream).paragraphs:
+        if paragraph.text:
+            yield paragraph.text + "\n"
+
+
+@extractor('.pptx')
+def extract_pptx(stream, max_pages):
+    from pptx import Presentation
+
+    presentation = Presentation(stream)
+    _check_pages(len(presentation.slides), max_pages)
+    for slide in presentation.slides:
+        texts = [shape.text for shape in slide.shapes if getattr(shape, "text", "")]
+        if texts:
+            yield " ".join(texts) + "\n"
+
+
+@extractor('.png', '.jpg', '.jpeg')
+def extract_image(stream, max_pages):
+    yield extract_text_tiered(prepare_pages([stream.read()])[0])
+
+
+@extractor('.txt')
+def extract_plain_text(stream, max_pages):
+    """Also the fallback for unknown extensions. Decodes block by block."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    while True:
+        block = stream.read(TEXT_BLOCK_BYTES)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+# --- 2. LIMITS ---
+def _check_pages(page_count, max_pages):
+    if page_count > max_pages:
+        raise IngestionError(f"File has {page_count} pages; the limit is {max_pages}.")
+
+
+def _stream_size(stream):
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def check_upload(file_storage, max_bytes=INGEST_MAX_BYTES):
+    """Raises IngestionError if the upload is over the size limit. Leaves the stream at the start."""
+    size = _stream_size(file_storage.stream)
+    if size is not None and size > max_bytes:
+        raise IngestionError(f"File is {size / 1048576:.1f} MB; the limit is {max_bytes // 1048576} MB.")
+    file_storage.stream.seek(0)
+    return size
+
+
+# --- 3. ENTRY POINTS ---
+def iter_text(file_storage, max_bytes=INGEST_MAX_BYTES, max_pages=INGEST_MAX_PAGES):
+    """Text of an uploaded file (werkzeug FileStorage), piece by piece."""
+    check_upload(file_storage, max_bytes)
+    yield from extractor_for(file_storage.filename)(file_storage.stream, max_pages)
+
+
+def extract_text(file_storage, max_bytes=INGEST_MAX_BYTES, max_pages=INGEST_MAX_PAGES):
+    """
+    Whole-file text. Limit violations raise IngestionError and AI outages raise
+    AIUnavailableError; an unreadable/corrupt file gives "".
+    """
+    try:
+        return "".join(iter_text(file_storage, max_bytes, max_pages))
+    except (IngestionError, AIUnavailableError):
+        raise
+    except Exception as e:
+        print(f"Ingestion Error ({file_storage.filename}): {e}")
+        return ""
@@ -0,0 +1,206 @@
+"""
+Local lexical pre-scorer for written answers.
+
+    result = prescore(student_text, answer_key)
+    # {"similarity": 0.93, "score": 93, "decision": "accept", "word_cosine": 0.95, ...}
+
+Compares the student text with the answer key using three NumPy signals:
+  1. TF-IDF cosine over word unigrams + bigrams (IDF fitted on the key's
+     sentences, so words the whole key repeats count for less),
+  2. cosine over character trigrams, which tolerates OCR and spelling slips,
+  3. keyword coverage: the share of the key's top TF-IDF terms the student used.
+Their weighted mix is the similarity (0-1), and round(100 * similarity) is the
+provisional score. It takes a few milliseconds and no API call.
+
+Only clear-cut cases are decided locally (decision != "escalate"):
+  - "blank":  fewer than LEXICAL_BLANK_CHARS letters or digits in the raw text (blank page) -> 0
+  - "accept": similarity >= LEXICAL_ACCEPT_ABOVE (near-verbatim key)
+  - "reject": similarity <= LEXICAL_REJECT_BELOW (nothing in common with the key), only for
+              answers of at least LEXICAL_MIN_TOKENS words written in the key's script
+Everything in between goes to the LLM, and so do short answers and answers that
+share no character trigram with the key (another language or script), where
+word overlap says little about correctness. Tokens are Unicode words, so
+non-Latin and accented text is compared like any other. LEXICAL_PRESCORE=shadow computes and
+counts decisions but always escalates (to gather data before trusting it);
+=off disables it. Tune the thresholds with benchmarks/eval_lexical_scorer.py.
+"""
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from app.metrics import Counter, span
+
+LEXICAL_PRESCORE = os.environ.get("LEXICAL_PRESCORE", "on")  # on | shadow | off
+LEXICAL_ACCEPT_ABOVE = float(os.environ.get("LEXICAL_ACCEPT_ABOVE", 0.9))
+LEXICAL_REJECT_BELOW = float(os.environ.get("LEXICAL_REJECT_BELOW", 0.05))
+LEXICAL_MIN_TOKENS = int(os.environ.get("LEXICAL_MIN_TOKENS", 5))  # Shorter answers are never rejected locally
+LEXICAL_BLANK_CHARS = int(os.environ.get("LEXICAL_BLANK_CHARS", 2))
+
+WEIGHTS = {"word_cosine": 0.5, "char_cosine": 0.2, "keyword_coverage": 0.3}
+KEYWORDS = 20  # Top key terms checked for coverage
+METHOD = "lexical"  # detailed_feedback["Method"] on grades decided here
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can do does for from has have he her his how i if in into is it its
+of on or our she so such than that the their them then there these they this to was we were what when
+which who will with you your
+""".split())
+
+LEXICAL_DECISIONS = Counter("lexical_prescore_total", "Lexical pre-scorer decisions (accept/reject/blank/escalate) "
+                                                      "by mode.")
+
+
+def _combining_marks():
+    """Character-class ranges for the BMP's combining marks (Unicode M*), which \\w doesn't match."""
+    ranges, start, prev = [], None, None
+    for code in range(0x300, 0x10000):
+        if unicodedata.category(chr(code)).startswith("M"):
+            if start is None or code != prev + 1:
+                if start is not None:
+                    ranges.append((start, prev))
+                start = code
+            prev = code
+    ranges.append((start, prev))
+    return "".join(f"\\u{lo:04x}-\\u{hi:04x}" for lo, hi in ranges)
+
+
+# Unicode letters and digits plus the marks attached to them, so Indic vowel signs
+# and viramas don't split a word ("प्रकाश" is one token).
+_WORD = re.compile(rf"[^\W_](?:[^\W_]|[{_combining_marks()}])*")
+_SENTENCE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+# --- 1. FEATURES ---
+def tokenize(text):
+    return [t for t in _WORD.findall(unicodedata.normalize("NFC", text or "").lower()) if t not in STOPWORDS]
+
+
+def readable_chars(text):
+    """Letters and digits in the raw text, before tokenizing or dropping stopwords."""
+    return sum(map(len, _WORD.findall(text or "")))
+
+
+def _word_terms(tokens):
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def _char_terms(tokens):
+    joined = f" {' '.join(tokens)} "
+    return [joined[i:i + 3] for i in range(len(joined) - 2)]
+
+
+def _count_matrix(docs):
+    """(document x term count matrix, vocabulary) for lists of terms."""
+    vocab = {}
+    ids = [np.fromiter((vocab.setdefault(t, len(vocab)) for t in terms), dtype=np.int64, count=len(terms))
+           for terms in docs]
+    counts = np.zeros((len(docs), max(len(vocab), 1)))
+    for row, idx in enumerate(ids):
+        if idx.size:
+            counts[row] = np.bincount(idx, minlength=counts.shape[1])
+    return counts, vocab
+
+
+def _cosine(a, b):
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+def _tfidf(key_text, key_tokens, student_tokens):
+    """(key vector, student vector, vocabulary) of TF-IDF weights over word 1-2 grams; IDF from the key's sentences."""
+    sentences = [tokenize(s) for s in _SENTENCE.split(key_text or "")]
+    sentences = [s for s in sentences if s] or [key_tokens]
+    docs = [_word_terms(key_tokens), _word_terms(student_tokens)] + [_word_terms(s) for s in sentences]
+    counts, vocab = _count_matrix(docs)
+    df = (counts[2:] > 0).sum(axis=0)
+    idf = np.log((1 + len(sentences)) / (1 + df)) + 1  # Smoothed: terms absent from the key still count
+    tf = np.where(counts[:2] > 0, 1 + np.log(np.maximum(counts[:2], 1)), 0)  # Sublinear term frequency
+    return tf[0] * idf, tf[1] * idf, vocab
+
+
+def features(student_text, answer_key):
+    """The three similarity signals (0-1 each) plus token counts."""
+    key_tokens, student_tokens = tokenize(answer_key), tokenize(student_text)
+    result = {"student_chars": readable_chars(student_text),
+              "student_tokens": len(student_tokens), "key_tokens": len(key_tokens),
+              "word_cosine": 0.0, "char_cosine": 0.0, "keyword_coverage": 0.0}
+    if not key_tokens or not student_tokens:
+        return result
+
+    key_vec, student_vec, vocab = _tfidf(answer_key, key_tokens, student_tokens)
+    result["word_cosine"] = _cosine(key_vec, student_vec)
+
+    chars, _ = _count_matrix([_char_terms(key_tokens), _char_terms(student_tokens)])
+    result["char_cosine"] = _cosine(chars[0], chars[1])
+
+    # Coverage of the key's heaviest single words (bigrams and short tokens left out).
+    unigram = np.array([" " not in term and len(term) > 2 for term in vocab])
+    weights = np.where(unigram, key_vec, 0)
+    top = np.argsort(weights)[::-1][:KEYWORDS]
+    top = top[weights[top] > 0]
+    if top.size:
+        result["keyword_coverage"] = float(weights[top][student_vec[top] > 0].sum() / weights[top].sum())
+    return result
+
+
+# --- 2. DECISION ---
+def prescore(student_text, answer_key, accept_above=None, reject_below=None, min_tokens=None):
+    """
+    Provisional score and whether it can stand on its own. Thresholds default
+    to the LEXICAL_* settings; the evaluation harness passes its own.
+    """
+    accept_above = LEXICAL_ACCEPT_ABOVE if accept_above is None else accept_above
+    reject_below = LEXICAL_REJECT_BELOW if reject_below is None else reject_below
+    min_tokens = LEXICAL_MIN_TOKENS if min_tokens is None else min_tokens
+
+    with span("lexical_prescore"):
+        result = features(student_text, answer_key)
+    similarity = sum(result[name] * weight for name, weight in WEIGHTS.items())
+    result["similarity"] = round(similarity, 4)
+    result["score"] = int(round(100 * min(max(similarity, 0.0), 1.0)))
+    result["decision"] = classify(result, accept_above, reject_below, min_tokens)
+    if result["decision"] == "blank":
+        result["score"] = 0
+    return result
+
+
+def classify(result, accept_above, reject_below, min_tokens):
+    """The decision for a features() + similarity result under the given thresholds."""
+    if result["student_chars"] < LEXICAL_BLANK_CHARS:
+        return "blank"
+    if not result["key_tokens"]:
+        return "escalate"  # Nothing to compare against: the LLM grades it on its own merits
+    if result["similarity"] >= accept_above:
+        return "accept"
+    # A short answer ("Chlorophyll") or one in another script can be right with no overlap at all.
+    if result["similarity"] <= reject_below and result["student_tokens"] >= min_tokens and result["char_cosine"] > 0:
+        return "reject"
+    return "escalate"
+
+
+def feedback_for(result):
+    """detailed_feedback for a grade decided locally, in the same shape as the LLM's."""
+    if result["decision"] == "blank":
+        accuracy = "Little or no readable text was found in the submission."
+    elif result["decision"] == "accept":
+        accuracy = "The answer closely matches the answer key."
+    else:
+        accuracy = "The answer has almost nothing in common with the answer key."
+    return {
+        "Accuracy": accuracy,
+        "Clarity": f"Graded automatically by text similarity to the key ({result['similarity']:.2f}).",
+        "Method": METHOD,
+    }
+
+
+def decide(student_text, answer_key):
+    """(score, feedback) when the pre-scorer settles the grade, else None. Honours LEXICAL_PRESCORE."""
+    if LEXICAL_PRESCORE == "off":
+        return None
+    result = prescore(student_text, answer_key)
+    LEXICAL_DECISIONS.inc(decision=result["decision"], mode=LEXICAL_PRESCORE)
+    if LEXICAL_PRESCORE != "on" or result["decision"] == "escalate":
+        return None
+    return result["score"], feedback_for(result)
@@ -0,0 +1,198 @@
+"""
+Map-reduce MCQ generation for online tests.
+
+The whole document is used, not just its opening pages:
+  1. map:    split the text into token-budgeted sections and ask the model for
+             a few candidate questions per section, all sections concurrently
+             (ai_client caps how many calls are in flight),
+  2. reduce: drop malformed and near-duplicate questions, then sample down to
+             the requested number, spreading picks across sections.
+Wall-clock time stays close to one call because the section calls overlap:
+generate_mcqs_async() awaits them as coroutines on the shared AI loop.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+
+from app.ai_client import chat_completion_async, AIUnavailableError
+
+MCQ_MODEL = "llama-3.3-70b-versatile"
+MCQ_SECTION_TOKENS = int(os.environ.get("MCQ_SECTION_TOKENS", 3000))
+MCQ_MAX_SECTIONS = int(os.environ.get("MCQ_MAX_SECTIONS", 12))  # LLM calls per test, at most
+MCQ_OVERSAMPLE = 1.5  # Candidates generated per question kept, to survive de-duplication
+DUPLICATE_SIMILARITY = 0.75  # Jaccard similarity (question + answer words) at which two questions are "the same"
+CHARS_PER_TOKEN = 4  # Rough estimate for English text; no tokenizer dependency
+
+PROMPT = """
+Generate exactly {count} MCQ questions based on the provided text.
+Return ONLY a JSON object with a single key "questions" containing a list of objects.
+Each object must have: "question", "options" (list of 4 strings), and "correct_index" (0-3).
+
+Example format:
+{{
+  "questions": [
+    {{
+      "question": "Example?",
+      "options": ["A", "B", "C", "D"],
+      "correct_index": 0
+    }}
+  ]
+}}
+
+TEXT: {text}
+"""
+
+
+class MCQGenerationError(Exception):
+    pass
+
+
+# --- 1. SPLIT ---
+def split_sections(text, budget_tokens=MCQ_SECTION_TOKENS):
+    """Packs paragraphs into sections of at most `budget_tokens`; huge paragraphs are cut on sentences."""
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= budget_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            while len(sentence) > budget_chars:  # No sentence breaks at all (e.g. OCR soup)
+                pieces.append(sentence[:budget_chars])
+                sentence = sentence[budget_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    sections, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + len(piece) + 1 > budget_chars:
+            sections.append("\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        sections.append("\n".join(current))
+    return sections
+
+
+def spread(items, limit):
+    """At most `limit` items, evenly spaced so the whole document is represented."""
+    if len(items) <= limit:
+        return list(items)
+    step = len(items) / limit
+    return [items[int(i * step)] for i in range(limit)]
+
+
+# --- 2. MAP ---
+def _valid(q):
+    return (isinstance(q, dict) and isinstance(q.get("question"), str) and q["question"].strip()
+            and isinstance(q.get("options"), list) and len(q["options"]) == 4
+            and all(isinstance(o, (str, int, float)) for o in q["options"])
+            and isinstance(q.get("correct_index"), int) and 0 <= q["correct_index"] <= 3)
+
+
+def _section_request(section, count):
+    return dict(
+        messages=[{"role": "user", "content": PROMPT.format(count=count, text=section)}],
+        model=MCQ_MODEL,  # Using a high-reasoning model for quality MCQs
+        response_format={"type": "json_object"}
+    )
+
+
+def _parse_questions(completion):
+    data = json.loads(completion.choices[0].message.content)
+    questions = data.get("questions", []) if isinstance(data, dict) else data
+    return [
+        {"question": q["question"].strip(), "options": [str(o) for o in q["options"]],
+         "correct_index": q["correct_index"]}
+        for q in (questions if isinstance(questions, list) else []) if _valid(q)
+    ]
+
+
+async def generate_for_section_async(section, count):
+    return _parse_questions(await chat_completion_async(**_section_request(section, count)))
+
+
+# --- 3. REDUCE ---
+def _words(q):
+    # The correct answer is included so "capital of France?" and "capital of Spain?" stay distinct.
+    answer = q["options"][q["correct_index"]]
+    return frozenset(re.findall(r'[a-z0-9]+', f"{q['question']} {answer}".lower()))
+
+
+def remove_near_duplicates(candidates, threshold=DUPLICATE_SIMILARITY):
+    """Keeps the first of any group of questions whose word sets overlap by >= threshold (Jaccard)."""
+    kept, kept_words = [], []
+    for candidate in candidates:
+        words = _words(candidate)
+        if any(len(words & other) / (len(words | other) or 1) >= threshold for other in kept_words):
+            continue
+        kept.append(candidate)
+        kept_words.append(words)
+    return kept
+
+
+def sample_questions(by_section, num_questions, rng=None):
+    """Round-robin across sections (random pick within each), returned in document order."""
+    rng = rng or random.Random()
+    pools = [rng.sample(list(enumerate(qs)), len(qs)) for qs in by_section]
+    chosen = []
+    while len(chosen) < num_questions and any(pools):
+        for section_index, pool in enumerate(pools):
+            if pool and len(chosen) < num_questions:
+                position, question = pool.pop()
+                chosen.append((section_index, position, question))
+    chosen.sort(key=lambda item: item[:2])
+    return [question for _, _, question in chosen]
+
+
+def _plan(text, num_questions):
+    """(sections, questions to ask per section)."""
+    sections = spread(split_sections(text), MCQ_MAX_SECTIONS)
+    if not sections:
+        raise MCQGenerationError("No text to generate questions from.")
+    return sections, max(1, math.ceil(num_questions * MCQ_OVERSAMPLE / len(sections)))
+
+
+def _section_failed(e):
+    # One bad section (invalid JSON, refusal) shouldn't sink the whole test.
+    print(f"MCQ Section Error: {e}")
+    return []
+
+
+def _reduce(results, num_questions):
+    # De-duplicate across the whole document, then regroup by section for sampling.
+    tagged = [(i, q) for i, qs in enumerate(results) for q in qs]
+    unique = remove_near_duplicates([q for _, q in tagged])
+    unique_ids = {id(q) for q in unique}
+    by_section = [[q for i, q in tagged if i == s and id(q) in unique_ids] for s in range(len(results))]
+
+    questions = sample_questions(by_section, num_questions)
+    if not questions:
+        raise MCQGenerationError("The AI did not return any usable questions.")
+    return questions
+
+
+async def generate_mcqs_async(text, num_questions):
+    """
+    Questions drawn from the whole of `text`. Raises MCQGenerationError if nothing usable came back.
+    The section calls are awaited together; ai_client's AI_MAX_INFLIGHT bounds how many are open.
+    """
+    sections, per_section = _plan(text, num_questions)
+
+    async def run(section):
+        try:
+            return await generate_for_section_async(section, per_section)
+        except AIUnavailableError:
+            raise
+        except Exception as e:
+            return _section_failed(e)
+
+    results = await asyncio.gather(*(run(section) for section in sections))
+    return _reduce(results, num_questions)
@@ -0,0 +1,357 @@
+"""
+Request timing, named spans and a Prometheus /metrics endpoint.
+
+    with span("convert_from_bytes"):   # or @timed("compute_score")
+        ...
+
+Every span feeds a latency histogram and an error counter. Spans that run
+inside a trace (each HTTP request, each grading job) are also added to that
+trace, and a trace slower than its threshold is logged with its breakdown:
+
+    Slow request: POST /teacher/generate-key 200 in 4.81s | compute_score 1x 4.52s, db.query 6x 0.03s
+
+Metrics are kept per process and rendered in the Prometheus text format
+without extra dependencies; with several gunicorn workers each scrape sees the
+worker that served it.
+"""
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 2.0))
+SLOW_JOB_SECONDS = float(os.environ.get("SLOW_JOB_SECONDS", 30.0))
+# /metrics needs "Authorization: Bearer <METRICS_TOKEN>" when a token is set. Without one it only
+# answers direct loopback requests, unless METRICS_PUBLIC=1 opens it to everyone.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0") == "1"
+LOOPBACK_ADDRS = ("127.0.0.1", "::1")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+# --- 1. METRIC TYPES ---
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value set by the code, or read from `callback() -> {label tuple: value}` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback=None):
+        super().__init__(name, help_text)
+        self._values = {}
+        self.callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.callback:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"Metrics Error ({self.name}): {e}")
+                values = {}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(k)} {v}" for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., count, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {round(values[-1], 6)}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by endpoint and status.")
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency (time to response).")
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled.")
+SPAN_LATENCY = Histogram("span_duration_seconds", "Duration of named hot-path spans.")
+SPAN_ERRORS = Counter("span_errors_total", "Exceptions raised inside named spans.")
+AI_IN_FLIGHT = Gauge("ai_calls_in_flight", "Groq API calls holding an in-flight slot, by mode (sync/async).")
+AI_WAITING = Gauge("ai_calls_waiting", "Callers queued for an in-flight slot, by mode (sync/async).")
+AI_ERRORS = Counter("ai_errors_total", "Groq API errors (retried or final) by exception type.")
+JOB_LATENCY = Histogram("grading_job_duration_seconds", "Time to run one grading job.")
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- 2. TRACES AND SPANS ---
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Span totals for one request or job (spans may be added from worker threads)."""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1][1])
+        return ", ".join(f"{name} {count}x {seconds:.2f}s" for name, (count, seconds) in spans) or "no spans"
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        SPAN_ERRORS.inc(span=name, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SPAN_LATENCY.observe(elapsed, span=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, elapsed)
+
+
+def timed(name):
+    """Decorator form of span(); works on plain and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(label, slow_seconds):
+    """Collects the spans run inside the block and logs the breakdown if it took longer than slow_seconds."""
+    current = Trace(label)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        elapsed = current.elapsed()
+        if elapsed >= slow_seconds:
+            print(f"Slow {label} in {elapsed:.2f}s | {current.breakdown()}")
+
+
+def propagate(fn):
+    """Wraps `fn` for a thread pool so its spans land in the caller's trace."""
+    caller_trace = _current_trace.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_trace.set(caller_trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+    return wrapper
+
+
+def carry_trace(coro):
+    """Wraps a coroutine bound for another event loop so its spans land in the caller's trace."""
+    caller_trace = _current_trace.get()
+
+    async def run():
+        _current_trace.set(caller_trace)  # Task-local: each task runs in its own context copy
+        return await coro
+    return run()
+
+
+# --- 3. FLASK + SQLALCHEMY WIRING ---
+def _endpoint_label():
+    # The URL rule, not the raw path, so /student/download/<int:id> is one series.
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _start_request_trace():
+    g._metrics_trace = Trace(f"request: {request.method} {request.path}")
+    g._metrics_token = _current_trace.set(g._metrics_trace)
+    HTTP_IN_FLIGHT.inc()
+
+
+def _record_response(response):
+    current = g.get("_metrics_trace")
+    if current is not None:
+        g._metrics_status = response.status_code
+    return response
+
+
+def _finish_request_trace(error=None):
+    current = g.pop("_metrics_trace", None)
+    if current is None:
+        return
+    _current_trace.reset(g.pop("_metrics_token"))
+    HTTP_IN_FLIGHT.dec()
+    status = g.pop("_metrics_status", 500 if error else 200)
+    elapsed = current.elapsed()
+    endpoint = _endpoint_label()
+    HTTP_LATENCY.observe(elapsed, method=request.method, endpoint=endpoint)
+    HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=status)
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        print(f"Slow request: {request.method} {request.path} {status} in {elapsed:.2f}s | {current.breakdown()}")
+
+
+def _install_query_timing():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(_install_query_timing, "done", False):
+        return
+    _install_query_timing.done = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        elapsed = time.perf_counter() - started
+        SPAN_LATENCY.observe(elapsed, span="db.query")
+        current = _current_trace.get()
+        if current is not None:
+            current.add("db.query", elapsed)
+
+    @event.listens_for(Engine, "handle_error")
+    def on_error(context):
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        SPAN_ERRORS.inc(span="db.query", error=type(context.original_exception).__name__)
+
+
+def _grading_jobs_by_status():
+    from app import db
+    from app.models import GradingJob
+    rows = db.session.query(GradingJob.status, db.func.count(GradingJob.id)).group_by(GradingJob.status).all()
+    return {(("status", status),): count for status, count in rows}
+
+
+GRADING_JOBS = Gauge("grading_jobs", "Grading jobs by status (read from the database at scrape time).",
+                     callback=_grading_jobs_by_status)
+
+
+def _metrics_allowed():
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
+    if METRICS_PUBLIC:
+        return True
+    # A local reverse proxy also connects from loopback; its forwarded requests don't count as local.
+    return request.remote_addr in LOOPBACK_ADDRS and "X-Forwarded-For" not in request.headers
+
+
+def metrics_view():
+    if not _metrics_allowed():
+        return "Unauthorized\n", 401
+    return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def init_metrics(app):
+    app.before_request(_start_request_trace)
+    app.after_request(_record_response)
+    app.teardown_request(_finish_request_trace)
+    _install_query_timing()
+    app.add_url_rule("/metrics", "metrics", metrics_view)
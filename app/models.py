@@ -1,8 +1,14 @@
 from app import db
+from sqlalchemy import event
+from sqlalchemy.orm import deferred
 from datetime import datetime
 
 
 class User(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_role_class', 'role', 'class_name', 'division'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
@@ -29,9 +35,28 @@ class User(db.Model):
 
     assignments = db.relationship('Assignment', backref='teacher', lazy=True)
     submissions = db.relationship('Submission', backref='student', lazy=True)
+    teacher_classes = db.relationship('TeacherClass', backref='teacher', lazy=True, cascade="all, delete-orphan")
+
+
+class TeacherClass(db.Model):
+    # Relational copy of User.assigned_classes so rosters can be grouped/joined in SQL.
+    # Kept in sync by app.dashboards.sync_teacher_classes().
+    __table_args__ = (
+        db.UniqueConstraint('teacher_id', 'class_name', 'division', name='uq_teacher_class'),
+        db.Index('ix_teacher_class_class', 'class_name', 'division'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    class_name = db.Column(db.String(50), nullable=False)
+    division = db.Column(db.String(10), nullable=False)
 
 
 class Assignment(db.Model):
+    __table_args__ = (
+        db.Index('ix_assignment_class', 'class_name', 'division'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     class_name = db.Column(db.String(50), nullable=False)
@@ -39,23 +64,73 @@ class Assignment(db.Model):
     subject_name = db.Column(db.String(100), nullable=False)
     teacher_name = db.Column(db.String(100), nullable=False)
     answer_key_content = db.Column(db.Text, nullable=True)
-    questionnaire_file = db.Column(db.LargeBinary, nullable=True)
+    # File bytes live in the blob store (app/blob_store.py); the row keeps hash/size/type.
+    # questionnaire_file is the legacy in-row copy, deferred so list queries never load it.
+    questionnaire_file = deferred(db.Column(db.LargeBinary, nullable=True))
     questionnaire_filename = db.Column(db.String(100))
+    questionnaire_sha256 = db.Column(db.String(64), nullable=True)
+    questionnaire_size = db.Column(db.Integer, nullable=True)
+    questionnaire_mimetype = db.Column(db.String(100), nullable=True)
     teacher_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     submissions = db.relationship('Submission', backref='assignment', lazy=True, cascade="all, delete-orphan")
 
 
+@event.listens_for(Assignment.answer_key_content, 'set', active_history=True)
+def _answer_key_changed(assignment, value, oldvalue, initiator):
+    # Drop scores cached against the old key (app/ai_evaluator.py) so edited keys don't pile up.
+    if isinstance(oldvalue, str) and oldvalue != value:
+        from app.ai_evaluator import invalidate_scores
+        invalidate_scores(oldvalue)
+
+
 class Submission(db.Model):
+    __table_args__ = (
+        db.Index('ix_submission_student_assignment', 'student_id', 'assignment_id'),
+        db.Index('ix_submission_assignment', 'assignment_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    submitted_file = db.Column(db.LargeBinary, nullable=True)
+    submitted_file = deferred(db.Column(db.LargeBinary, nullable=True))  # Legacy in-row copy
+    submitted_filename = db.Column(db.String(255))
+    submitted_sha256 = db.Column(db.String(64), nullable=True)
+    submitted_size = db.Column(db.Integer, nullable=True)
+    submitted_mimetype = db.Column(db.String(100), nullable=True)
+    # OCR/plain text of the upload, saved on first grading so regrades skip OCR
+    extracted_text = deferred(db.Column(db.Text, nullable=True))
     submission_date = db.Column(db.DateTime, default=datetime.utcnow)
     score = db.Column(db.Float, default=0.0)
     detailed_feedback = db.Column(db.JSON, nullable=True)
+    # Grading Status: 'pending' -> 'graded' or 'failed' (set by the background queue)
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='graded')
+    jobs = db.relationship('GradingJob', backref='submission', lazy=True, cascade="all, delete-orphan")
+
+
+class GradingJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # 'queued', 'running', 'done', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Retry backoff
+    locked_at = db.Column(db.DateTime, nullable=True)  # Lease start while 'running'
+    last_error = db.Column(db.Text, nullable=True)
+    batch_id = db.Column(db.String(32), nullable=True, index=True)  # Set for bulk regrades
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class Attendance(db.Model):
+    __table_args__ = (
+        # Covers the student dashboard's COUNT + conditional SUM over status
+        db.Index('ix_attendance_student_status', 'student_id', 'status'),
+        # One mark per student per lecture; the register upsert targets this (app/attendance.py)
+        db.Index('uq_attendance_student_date_subject', 'student_id', 'date', 'lecture_subject', unique=True),
+        # One lecture across classes; the rollup recompute after each register reads through this
+        db.Index('ix_attendance_date_subject', 'date', 'lecture_subject'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
 
@@ -68,7 +143,46 @@ class Attendance(db.Model):
     class_name = db.Column(db.String(50))
     division = db.Column(db.String(10))
 
+class AttendanceDaily(db.Model):
+    # Class-wide present/total per lecture subject and day, kept in step with Attendance
+    # by upsert_attendance (app/attendance.py); read by app/attendance_analytics.py.
+    __table_args__ = (
+        db.Index('uq_attendance_daily', 'class_name', 'division', 'lecture_subject', 'date', unique=True),
+        db.Index('ix_attendance_daily_class_date', 'class_name', 'division', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    class_name = db.Column(db.String(50), nullable=False, default='')  # '' when the register had none
+    division = db.Column(db.String(10), nullable=False, default='')
+    lecture_subject = db.Column(db.String(100), nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AttendanceMonthly(db.Model):
+    # Per-student present/total per lecture subject and month (month = first day of the month).
+    __table_args__ = (
+        db.Index('uq_attendance_monthly', 'class_name', 'division', 'student_id', 'lecture_subject', 'month',
+                 unique=True),
+        db.Index('ix_attendance_monthly_student', 'student_id', 'month'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, nullable=False)
+    class_name = db.Column(db.String(50), nullable=False, default='')
+    division = db.Column(db.String(10), nullable=False, default='')
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    lecture_subject = db.Column(db.String(100), nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Test(db.Model):
+    __table_args__ = (
+        db.Index('ix_test_class', 'class_name', 'division'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     subject = db.Column(db.String(100))
@@ -80,9 +194,41 @@ class Test(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class TestResult(db.Model):
+    __table_args__ = (
+        db.Index('ix_test_result_test_student', 'test_id', 'student_id'),
+        db.Index('ix_test_result_student', 'student_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     test_id = db.Column(db.Integer, db.ForeignKey('test.id'))
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     score = db.Column(db.Integer)
     total_questions = db.Column(db.Integer)
-    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ScoreRollup(db.Model):
+    # Precomputed count/sum/histogram per scope, updated in the same transaction as the
+    # graded Submission / TestResult (see app/stats.py). Rebuild with rebuild_stats.py.
+    # scope: 'submissions' | 'assignment' | 'class_submissions' | 'tests' | 'test' | 'class_tests'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', name='uq_score_rollup_scope'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(30), nullable=False)
+    scope_key = db.Column(db.String(120), nullable=False, default='')  # '' for global scopes
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)  # Sum of raw scores
+    # Histogram of percentage scores in 10-point buckets (100% falls in bucket_9)
+    bucket_0 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_1 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_2 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_3 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_4 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_5 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_6 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_7 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_8 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_9 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
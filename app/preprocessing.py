@@ -0,0 +1,197 @@
+"""
+NumPy image preprocessing for OCR and the vision API.
+
+Uploaded pages (phone photos, scans, rendered PDF pages) go through a small
+configurable pipeline before any OCR:
+
+    downscale -> grayscale -> crop borders -> deskew [-> adaptive threshold]
+
+Downscaling happens while the JPEG is decoded (PIL draft mode), so a
+12-megapixel photo is never fully decoded just to be shrunk. The remaining
+steps are vectorised NumPy on the grayscale array. preprocess_batch() runs a
+batch of pages on a thread pool (NumPy releases the GIL for the heavy work)
+and reports the payload size before and after.
+"""
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", 2048))  # Longest side in pixels after downscaling
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", 200))  # Used when the image carries real DPI metadata
+OCR_JPEG_QUALITY = int(os.environ.get("OCR_JPEG_QUALITY", 85))
+OCR_PREPROCESS_STEPS = tuple(s.strip() for s in os.environ.get("OCR_PREPROCESS_STEPS", "crop,deskew").split(",") if s.strip())
+OCR_PREPROCESS_THREADS = int(os.environ.get("OCR_PREPROCESS_THREADS", 4))
+
+THRESHOLD_BLOCK = 31  # Neighbourhood (pixels) for the adaptive threshold
+THRESHOLD_OFFSET = 10  # How much darker than its neighbourhood a pixel must be to count as ink
+DESKEW_MAX_ANGLE = 10.0
+DESKEW_STEP = 0.5
+DESKEW_SAMPLE = 40000  # Ink pixels sampled when estimating skew
+INK_LEVEL = 128
+
+
+# --- 1. STEPS (grayscale uint8 arrays in, arrays out) ---
+def adaptive_threshold(gray, block=THRESHOLD_BLOCK, offset=THRESHOLD_OFFSET):
+    """
+    Local-mean binarisation: a pixel is ink if it is `offset` darker than the
+    mean of its block x block neighbourhood. Uneven lighting in photos defeats a
+    single global threshold. Window sums come from an integral image, so the cost
+    does not depend on the block size.
+    """
+    block = block | 1  # Odd, so the window is centred
+    r = block // 2
+    padded = np.pad(gray, r, mode='edge').astype(np.int64)
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int64)
+    np.cumsum(padded, axis=0, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    sums = (integral[block:, block:] - integral[:-block, block:]
+            - integral[block:, :-block] + integral[:-block, :-block])
+    # gray > mean - offset, in integers: gray * n > sums - offset * n
+    n = block * block
+    return np.where(gray.astype(np.int64) * n > sums - offset * n, 255, 0).astype(np.uint8)
+
+
+def estimate_skew(gray, max_angle=DESKEW_MAX_ANGLE, step=DESKEW_STEP, sample=DESKEW_SAMPLE):
+    """
+    Text-line angle in degrees by projection profile: for every candidate angle
+    the ink pixels are projected onto the vertical axis, and the angle whose row
+    histogram is the most peaked (lines of text line up) wins. All candidate
+    angles are scored in one vectorised pass over a sample of ink pixels.
+    """
+    ys, xs = np.nonzero(gray < INK_LEVEL)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > sample:
+        pick = np.linspace(0, len(ys) - 1, sample).astype(np.int64)
+        ys, xs = ys[pick], xs[pick]
+
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    theta = np.deg2rad(angles)[:, None]
+    rows = np.rint(ys[None, :] * np.cos(theta) + xs[None, :] * np.sin(theta)).astype(np.int64)
+    rows -= rows.min(axis=1, keepdims=True)
+    height = int(rows.max()) + 1
+    flat = rows + (np.arange(len(angles)) * height)[:, None]
+    profile = np.bincount(flat.ravel(), minlength=len(angles) * height).reshape(len(angles), height)
+    score = (profile.astype(np.float64) ** 2).sum(axis=1)
+    return float(angles[int(np.argmax(score))])
+
+
+def deskew(gray, angle=None):
+    """Rotates the page so text lines are horizontal. Returns (array, angle applied)."""
+    angle = estimate_skew(gray) if angle is None else angle
+    if abs(angle) < DESKEW_STEP / 2:
+        return gray, 0.0
+    rotated = Image.fromarray(gray).rotate(-angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return np.asarray(rotated), angle
+
+
+def crop_borders(gray, margin=12, min_ink=0.002, solid=0.9):
+    """
+    Trims empty margins and the dark edges scanners and phone photos leave
+    around a page. Rows/columns count as content if they have some ink but are
+    not almost entirely dark.
+    """
+    ink = gray < INK_LEVEL
+    rows, cols = ink.mean(axis=1), ink.mean(axis=0)
+    content_rows = np.nonzero((rows > min_ink) & (rows < solid))[0]
+    content_cols = np.nonzero((cols > min_ink) & (cols < solid))[0]
+    if len(content_rows) == 0 or len(content_cols) == 0:
+        return gray
+    top, bottom = max(content_rows[0] - margin, 0), min(content_rows[-1] + margin + 1, gray.shape[0])
+    left, right = max(content_cols[0] - margin, 0), min(content_cols[-1] + margin + 1, gray.shape[1])
+    return gray[top:bottom, left:right]
+
+
+# --- 2. PAGE PIPELINE ---
+def _scale_for(image, max_side, target_dpi):
+    scale = min(1.0, max_side / max(image.size))
+    dpi = image.info.get('dpi')
+    # Phones stamp 72 DPI on everything; only trust values that look like a scan.
+    if dpi and target_dpi and float(dpi[0]) > max(target_dpi, 100):
+        scale = min(scale, target_dpi / float(dpi[0]))
+    return scale
+
+
+def load_gray(image_bytes, max_side=OCR_MAX_SIDE, target_dpi=OCR_TARGET_DPI):
+    """Decodes straight to a downscaled, upright grayscale array."""
+    image = Image.open(io.BytesIO(image_bytes))
+    scale = _scale_for(image, max_side, target_dpi)
+    longest = max(1, round(max(image.size) * scale))
+    if scale < 1.0:
+        image.draft('L', (longest, longest))  # JPEG: decode at 1/2, 1/4 or 1/8 resolution directly
+    image = ImageOps.exif_transpose(image).convert('L')
+    if max(image.size) > longest:
+        image.thumbnail((longest, longest), Image.LANCZOS, reducing_gap=2.0)
+    return np.asarray(image)
+
+
+def encode_jpeg(gray, quality=OCR_JPEG_QUALITY):
+    buf = io.BytesIO()
+    Image.fromarray(gray).save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def preprocess_array(gray, steps=OCR_PREPROCESS_STEPS):
+    """Applies the array steps in pipeline order. Returns (array, skew angle applied)."""
+    angle = 0.0
+    if 'crop' in steps:
+        gray = crop_borders(gray)
+    if 'deskew' in steps:
+        gray, angle = deskew(gray)
+    if 'threshold' in steps:
+        gray = adaptive_threshold(gray)
+    return gray, angle
+
+
+def preprocess_page(image_bytes, steps=OCR_PREPROCESS_STEPS, max_side=OCR_MAX_SIDE):
+    """
+    One page through the pipeline, re-encoded as a grayscale JPEG.
+    Returns (jpeg_bytes, info). Undecodable input is passed through unchanged.
+    """
+    try:
+        gray = load_gray(image_bytes, max_side)
+        before = gray.shape
+        gray, angle = preprocess_array(gray, steps)
+        output = encode_jpeg(gray)
+    except Exception as e:
+        print(f"Preprocess Error: {e}")
+        return image_bytes, {"bytes_in": len(image_bytes), "bytes_out": len(image_bytes), "error": str(e)}
+    if len(output) >= len(image_bytes) and 'threshold' not in steps:
+        output = image_bytes  # Already small (e.g. a clean rendered page): keep the original
+    return output, {
+        "bytes_in": len(image_bytes),
+        "bytes_out": len(output),
+        "decoded_size": [before[1], before[0]],
+        "final_size": [gray.shape[1], gray.shape[0]],
+        "skew": angle,
+    }
+
+
+def preprocess_batch(payloads, steps=OCR_PREPROCESS_STEPS, max_side=OCR_MAX_SIDE, workers=None):
+    """
+    Runs a batch of pages through the pipeline concurrently.
+    Returns (pages, report); report has the total payload before/after.
+    """
+    started = time.perf_counter()
+    workers = max(1, min(workers or OCR_PREPROCESS_THREADS, len(payloads) or 1))
+    if workers == 1:
+        results = [preprocess_page(p, steps, max_side) for p in payloads]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda p: preprocess_page(p, steps, max_side), payloads))
+
+    bytes_in = sum(info["bytes_in"] for _, info in results)
+    bytes_out = sum(info["bytes_out"] for _, info in results)
+    report = {
+        "pages": len(results),
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "saved_pct": round(100 * (1 - bytes_out / bytes_in), 1) if bytes_in else 0.0,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+        "details": [info for _, info in results],
+    }
+    return [page for page, _ in results], report
@@ -1,21 +1,36 @@
-from flask import Blueprint, render_template, request, redirect, session, flash, url_for, send_file, current_app # <--- ADDED current_app
+from flask import Blueprint, render_template, request, redirect, session, flash, url_for, send_file, current_app, abort, Response # <--- ADDED current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy.sql import func
 from io import BytesIO
-import pypdf
-from pdf2image import convert_from_bytes
 import uuid
 import random # <--- Added for OTP generation
 from datetime import datetime, timedelta # <--- Added timedelta for OTP expiry
 from functools import wraps
+import asyncio
+import inspect
 
 # --- IMPORTS ---
 from app.models import db, User, Assignment, Submission, Attendance, Test, TestResult
-from app.ai_evaluator import compute_score, generate_answer_key, extract_text_from_image
+from app.ai_evaluator import generate_answer_key_async
+from app.ocr_service import ocr_metrics
+from app.ingestion import extract_text, check_upload, IngestionError
+from app.ai_cache import all_cache_stats
+from app.singleflight import answer_key_flights, test_preview_flights, upload_key, all_singleflight_stats
+from app.admission import admission_controlled
+from app.ai_client import chat_completion_async, stream_chat_completion, AIUnavailableError
+from app.blob_store import blob_store, store_upload
+from app.attendance import upsert_attendance, register_rows, import_attendance_csv, AttendanceImportError
+from app.attendance_analytics import subject_percentages, heatmap, low_attendance, LOW_ATTENDANCE_PERCENT
+from app.exports import (export_response, attendance_rows, gradebook_rows, test_result_rows, ExportError,
+                         ATTENDANCE_COLUMNS, GRADEBOOK_COLUMNS, TEST_RESULT_COLUMNS)
+from app.stats import get_rollup, record_test_result, forget_assignment, move_assignment_class
+from app.mcq_generator import generate_mcqs_async
+from app.dashboards import (admin_user_pages, admin_assignment_page, admin_counts, class_summaries, class_roster,
+                            sync_teacher_classes, student_dashboard_data)
+from app.grading_queue import (enqueue_submission, enqueue_regrade, notify_workers, submission_status,
+                               regrade_progress, QueueFullError)
 
-import requests
 import json
 
 routes = Blueprint('routes', __name__)
@@ -27,60 +42,35 @@ def role_required(role):
     Middleware to ensure the user is logged in and possesses the correct role.
     """
 
+    def denied():
+        if 'user_id' not in session:
+            flash("Please log in to access this page.", "danger")
+            return redirect('/login')
+
+        if session.get('role') != role:
+            flash(f"Access Denied: You do not have {role} permissions.", "danger")
+            # Redirect user to their appropriate home based on their actual role
+            return redirect(url_for(f'routes.{session.get("role")}_dashboard'))
+        return None
+
     def decorator(f):
+        # Async views need an async wrapper, or Flask won't run them in an event loop.
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def decorated_coroutine(*args, **kwargs):
+                return denied() or await f(*args, **kwargs)
+
+            return decorated_coroutine
+
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if 'user_id' not in session:
-                flash("Please log in to access this page.", "danger")
-                return redirect('/login')
-
-            if session.get('role') != role:
-                flash(f"Access Denied: You do not have {role} permissions.", "danger")
-                # Redirect user to their appropriate home based on their actual role
-                return redirect(url_for(f'routes.{session.get("role")}_dashboard'))
-            return f(*args, **kwargs)
+            return denied() or f(*args, **kwargs)
 
         return decorated_function
 
     return decorator
 
 
-# --- HELPER: Extract Text ---
-def extract_text_from_file(file_storage):
-    filename = file_storage.filename.lower()
-    if filename.endswith('.pdf'):
-        try:
-            pdf_reader = pypdf.PdfReader(file_storage)
-            text = ""
-            for page in pdf_reader.pages:
-                extracted = page.extract_text()
-                if extracted: text += extracted + "\n"
-            if len(text.strip()) < 10:
-                file_storage.seek(0)
-                images = convert_from_bytes(file_storage.read())
-                for img in images:
-                    img_byte_arr = BytesIO()
-                    img.save(img_byte_arr, format='JPEG')
-                    text += extract_text_from_image(img_byte_arr.getvalue()) + "\n"
-            file_storage.seek(0)
-            return text
-        except:
-            return ""
-    elif filename.endswith(('.png', '.jpg', '.jpeg')):
-        try:
-            file_bytes = file_storage.read()
-            text = extract_text_from_image(file_bytes)
-            file_storage.seek(0)
-            return text
-        except:
-            return ""
-    else:
-        try:
-            return file_storage.read().decode('utf-8', errors='ignore')
-        except:
-            return ""
-
-
 # --- AUTH ROUTES ---
 @routes.route('/')
 def home():
@@ -190,6 +180,8 @@ def register():
 
 
 def send_verification_email(user_email, otp):
+    import requests  # Only needed at registration; kept out of worker boot
+
     api_key = current_app.config.get('MAIL_PASSWORD')
     sender_email = current_app.config.get('MAIL_USERNAME')
 
@@ -280,40 +272,50 @@ def reset_password(token):
 @routes.route('/admin/dashboard')
 @role_required('admin')
 def admin_dashboard():
-    users = User.query.order_by(User.id.desc()).all()
-    assignments = Assignment.query.order_by(Assignment.id.desc()).all()
-    class_map = {}
-
-    for u in users:
-        if u.role == 'student' and u.class_name and u.division:
-            key = f"{u.class_name} - {u.division}"
-            if key not in class_map: class_map[key] = {"students": [], "teachers": []}
-            class_map[key]["students"].append(u)
-
-        if u.role == 'teacher' and u.assigned_classes:
-            for cls in u.assigned_classes:
-                key = f"{cls['class_name']} - {cls['division']}"
-                if key not in class_map: class_map[key] = {"students": [], "teachers": []}
-                if u not in class_map[key]["teachers"]:
-                    class_map[key]["teachers"].append(u)
-
-    total_users = len(users)
-    total_assignments = len(assignments)
-    total_submissions = Submission.query.count()
-    avg_score = db.session.query(func.avg(Submission.score)).scalar() or 0
+    # Keyset-paginated sections + grouped counts; nothing here loads the whole user table.
+    counts = admin_counts()
+    submission_stats = get_rollup('submissions')  # Precomputed, see app/stats.py
 
     return render_template('admin_dashboard.html',
-                           users=users,
-                           assignments=assignments,
-                           class_map=class_map,
+                           user_pages=admin_user_pages(request.args),
+                           assignment_page=admin_assignment_page(request.args),
+                           class_summaries=class_summaries(),
+                           active_tab=request.args.get('tab', 'users'),
                            stats={
-                               "users": total_users,
-                               "assignments": total_assignments,
-                               "submissions": total_submissions,
-                               "avg_score": round(avg_score, 1)
+                               "users": counts["users"],
+                               "assignments": counts["assignments"],
+                               "submissions": submission_stats["count"],
+                               "avg_score": submission_stats["avg"]
                            })
 
 
+@routes.route('/admin/classes/roster')
+@role_required('admin')
+def admin_class_roster():
+    teachers, students, next_cursor = class_roster(request.args.get('class_name'), request.args.get('division'),
+                                                   after=request.args.get('after'))
+    return {
+        "teachers": [{"id": t.id, "username": t.username, "subject": t.subject} for t in teachers],
+        "students": [{"id": u.id, "username": u.username, "class_name": u.class_name, "division": u.division}
+                     for u in students],
+        "next": next_cursor
+    }
+
+
+@routes.route('/admin/ai-cache-stats')
+@role_required('admin')
+def admin_ai_cache_stats():
+    # Counters are per worker process; the disk tier itself is shared.
+    return {**all_cache_stats(), "singleflight": all_singleflight_stats()}
+
+
+@routes.route('/admin/ocr-stats')
+@role_required('admin')
+def admin_ocr_stats():
+    # Per worker process: latency per OCR tier and how often Tesseract had to escalate.
+    return ocr_metrics.stats()
+
+
 @routes.route('/admin/create-user', methods=['POST'])
 @role_required('admin')
 def admin_create_user():
@@ -348,6 +350,8 @@ def admin_create_user():
     )
 
     db.session.add(new_user)
+    db.session.flush()
+    sync_teacher_classes(new_user)
     db.session.commit()
     flash(f"User {username} created successfully!", "success")
     return redirect('/admin/dashboard')
@@ -386,6 +390,7 @@ def edit_user(id):
 @role_required('admin')
 def admin_delete_assignment(id):
     assign = Assignment.query.get_or_404(id)
+    forget_assignment(assign)
     db.session.delete(assign)
     db.session.commit()
     flash("Assignment force-deleted.", "success")
@@ -416,6 +421,7 @@ def update_teacher_profile():
         current_list.append(cls_obj)
         teacher.assigned_classes = current_list
         flag_modified(teacher, "assigned_classes")
+        sync_teacher_classes(teacher)
     db.session.commit()
     return redirect('/teacher/dashboard')
 
@@ -428,6 +434,7 @@ def create_assignment():
         try:
             file = request.files.get('questionnaire_file')
             key_text = request.form.get('ai_generated_key')
+            sha256, size, mimetype = store_upload(file) if file and file.filename else (None, None, None)
             new_assign = Assignment(
                 title=request.form.get('title'),
                 class_name=request.form.get('class_name').strip().upper(),
@@ -436,7 +443,9 @@ def create_assignment():
                 teacher_name=teacher.username,
                 teacher_id=teacher.id,
                 answer_key_content=key_text,
-                questionnaire_file=file.read() if file else None,
+                questionnaire_sha256=sha256,
+                questionnaire_size=size,
+                questionnaire_mimetype=mimetype,
                 questionnaire_filename=secure_filename(file.filename) if file else "unknown.txt"
             )
             db.session.add(new_assign)
@@ -448,13 +457,42 @@ def create_assignment():
     return render_template('create_assignment.html')
 
 
+def _upload_error():
+    """A 400 for a missing, empty or oversized upload. Runs before admission, so it costs no rate tokens."""
+    file = request.files.get('file')
+    if not file:
+        return {"error": "No file uploaded"}, 400
+    try:
+        if check_upload(file) == 0:
+            return {"error": "The uploaded file is empty."}, 400
+    except IngestionError as e:
+        return {"error": str(e)}, 400
+    return None
+
+
 @routes.route('/teacher/generate-key', methods=['POST'])
 @role_required('teacher')
-def generate_key_api():
+@admission_controlled(precheck=_upload_error)
+async def generate_key_api():
     file = request.files.get('file')
     if not file: return {"error": "No file"}, 400
-    text = extract_text_from_file(file)
-    return {"key": generate_answer_key(text)}
+
+    async def build_key():
+        # Extraction blocks (parsers, OCR, the vision API for images): run it off the event loop.
+        return await generate_answer_key_async(await asyncio.to_thread(extract_text, file))
+
+    try:
+        check_upload(file)
+        # Repeat clicks and co-teachers uploading the same file share one extraction + model call.
+        key = await answer_key_flights.do_async(upload_key(file, "answer_key"), build_key)
+    except IngestionError as e:
+        return {"error": str(e)}, 400
+    except AIUnavailableError:
+        return {"error": "The AI service is busy. Please try again in a minute."}, 503
+    except Exception as e:
+        print(f"Answer Key Error: {e}")
+        return {"error": str(e)}, 500
+    return {"key": key}
 
 
 @routes.route('/teacher/assignments')
@@ -470,11 +508,19 @@ def edit_assignment(id):
     assignment = Assignment.query.get_or_404(id)
     if request.method == 'POST':
         assignment.title = request.form.get('title')
+        old_class = (assignment.class_name, assignment.division)
         assignment.class_name = request.form.get('class_name')
         assignment.division = request.form.get('division')
+        move_assignment_class(assignment, *old_class)  # Class score rollups follow the assignment
         assignment.subject_name = request.form.get('subject_name')
+        new_key = request.form.get('answer_key_content')
+        key_changed = new_key is not None and new_key.strip() != (assignment.answer_key_content or '').strip()
+        if key_changed:
+            assignment.answer_key_content = new_key
         db.session.commit()
         flash("Updated!", "success")
+        if key_changed and db.session.query(Submission.id).filter_by(assignment_id=id).first():
+            flash("Answer key changed. Use 'Regrade All' on the submissions page to rescore existing work.", "success")
         return redirect('/teacher/assignments')
     return render_template('edit_assignment.html', assignment=assignment)
 
@@ -484,7 +530,51 @@ def edit_assignment(id):
 def view_submissions(id):
     assignment = Assignment.query.get_or_404(id)
     submissions = Submission.query.filter_by(assignment_id=id).all()
-    return render_template('view_submissions.html', assignment=assignment, submissions=submissions)
+    return render_template('view_submissions.html', assignment=assignment, submissions=submissions,
+                           batch_id=request.args.get('batch'))
+
+
+@routes.route('/teacher/assignments/<int:id>/export')
+@role_required('teacher')
+def export_gradebook(id):
+    assignment = Assignment.query.get_or_404(id)
+    if assignment.teacher_id != session['user_id']:
+        abort(403)
+    try:
+        return export_response(f"gradebook_{assignment.title}", GRADEBOOK_COLUMNS, gradebook_rows(id),
+                               request.args.get('format', 'csv'))
+    except ExportError as e:
+        return str(e), 400
+
+
+@routes.route('/teacher/assignments/<int:id>/regrade', methods=['POST'])
+@role_required('teacher')
+def regrade_assignment(id):
+    assignment = Assignment.query.get_or_404(id)
+    if assignment.teacher_id != session['user_id']:
+        abort(403)
+    try:
+        batch_id, count = enqueue_regrade(assignment)
+        db.session.commit()
+    except QueueFullError:
+        db.session.rollback()
+        flash("The grading queue is full right now. Please try again in a few minutes.", "danger")
+        return redirect(f'/teacher/assignments/{id}/submissions')
+    if not count:
+        flash("Every submission already has a grading job waiting; nothing new to regrade.", "success")
+        return redirect(f'/teacher/assignments/{id}/submissions')
+    notify_workers()
+    flash(f"Regrading {count} submission(s) with the current answer key.", "success")
+    return redirect(f'/teacher/assignments/{id}/submissions?batch={batch_id}')
+
+
+@routes.route('/teacher/assignments/<int:id>/regrade/<batch_id>')
+@role_required('teacher')
+def regrade_status(id, batch_id):
+    assignment = Assignment.query.get_or_404(id)
+    if assignment.teacher_id != session['user_id']:
+        abort(403)
+    return regrade_progress(id, batch_id)
 
 
 @routes.route('/teacher/delete-assignment/<int:id>', methods=['POST'])
@@ -492,6 +582,7 @@ def view_submissions(id):
 def delete_assignment(id):
     assign = Assignment.query.get_or_404(id)
     if assign.teacher_id == session['user_id']:
+        forget_assignment(assign)
         db.session.delete(assign)
         db.session.commit()
     return redirect('/teacher/assignments')
@@ -513,12 +604,9 @@ def teacher_attendance():
             flash("Error: Date and Subject required.", "danger")
             return redirect(f"/teacher/attendance?class_name={cls}&div={div}")
         date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        for student in students:
-            status = request.form.get(f"status_{student.id}")
-            if status:
-                rec = Attendance(date=date, lecture_subject=subject_name, status=status, student_id=student.id,
-                                 teacher_id=teacher.id, class_name=cls, division=div)
-                db.session.add(rec)
+        # One upsert for the whole register; re-submitting updates instead of duplicating
+        rows = register_rows(students, request.form, date, subject_name, teacher.id, cls, div)
+        upsert_attendance(rows)
         db.session.commit()
         flash(f"Attendance for {subject_name} Saved!", "success")
         return redirect(f"/teacher/attendance?class_name={cls}&div={div}")
@@ -526,43 +614,173 @@ def teacher_attendance():
                            selected_div=div, now=datetime.now())
 
 
+@routes.route('/teacher/attendance/import', methods=['POST'])
+@role_required('teacher')
+def import_attendance():
+    file = request.files.get('registers')
+    if not file or not file.filename.lower().endswith('.csv'):
+        flash("Please upload a .csv file.", "danger")
+        return redirect('/teacher/attendance')
+    try:
+        written, skipped = import_attendance_csv(file, session['user_id'])
+        db.session.commit()
+    except (AttendanceImportError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        flash(f"Import failed: {e}", "danger")
+        return redirect('/teacher/attendance')
+
+    flash(f"Imported {written} attendance record(s).", "success")
+    if skipped:
+        lines = ", ".join(str(n) for n in skipped[:10]) + (" ..." if len(skipped) > 10 else "")
+        flash(f"Skipped {len(skipped)} line(s) with unknown students or bad values: {lines}", "danger")
+    return redirect('/teacher/attendance')
+
+
+@routes.route('/teacher/attendance/analytics')
+@role_required('teacher')
+def attendance_analytics():
+    teacher = User.query.get(session['user_id'])
+    cls = request.args.get('class_name')
+    div = request.args.get('div')
+    try:
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else datetime.now().date()
+        date_from = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+                     else date_to - timedelta(days=29))
+        threshold = float(request.args.get('threshold', LOW_ATTENDANCE_PERCENT))
+    except ValueError:
+        flash("Dates must be YYYY-MM-DD and the threshold a number.", "danger")
+        return redirect(f"/teacher/attendance/analytics?class_name={cls}&div={div}")
+
+    report = None
+    if cls and div:
+        # All served from the rollup tables (app/attendance_analytics.py), not raw attendance rows.
+        report = {
+            "subjects": subject_percentages(cls, div, date_from, date_to),
+            "heatmap": heatmap(cls, div, date_from, date_to),
+            "alerts": low_attendance(cls, div, date_from, date_to, threshold=threshold),
+        }
+    return render_template('teacher_attendance_analytics.html', teacher=teacher, selected_class=cls,
+                           selected_div=div, date_from=date_from, date_to=date_to, threshold=threshold,
+                           report=report)
+
+
+@routes.route('/teacher/attendance/export')
+@role_required('teacher')
+def export_attendance():
+    # Everything this teacher has marked, optionally narrowed to a class and a date range (YYYY-MM-DD).
+    try:
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return "Dates must be YYYY-MM-DD.", 400
+    rows = attendance_rows(session['user_id'], class_name=request.args.get('class_name'),
+                           division=request.args.get('div'), date_from=date_from, date_to=date_to)
+    name = "_".join(filter(None, ["attendance", request.args.get('class_name'), request.args.get('div')]))
+    try:
+        return export_response(name, ATTENDANCE_COLUMNS, rows, request.args.get('format', 'csv'))
+    except ExportError as e:
+        return str(e), 400
+
+
 # --- STUDENT ROUTES ---
 @routes.route('/student/dashboard', methods=['GET', 'POST'])
 @role_required('student')
 def student_dashboard():
-    student = User.query.get(session['user_id'])
     if request.method == 'POST':
+        student = User.query.get(session['user_id'])
         aid = request.form.get('assignment_id')
         file = request.files.get('student_answer')
         assign = Assignment.query.get(aid)
-        student_text = extract_text_from_file(file)
-        score, feedback = compute_score(student_text, assign.answer_key_content)
-        sub = Submission(assignment_id=aid, student_id=student.id, submitted_file=file.read(), score=score,
-                         detailed_feedback=feedback)
+        if not assign or not file or not file.filename:
+            flash("Please choose a file to upload.", "danger")
+            return redirect('/student/dashboard')
+
+        try:
+            check_upload(file)
+        except IngestionError as e:
+            flash(str(e), "danger")
+            return redirect('/student/dashboard')
+
+        # Store the upload and return right away; OCR + scoring run in the grading queue.
+        sha256, size, mimetype = store_upload(file)
+        sub = Submission(assignment_id=assign.id, student_id=student.id, submitted_sha256=sha256,
+                         submitted_size=size, submitted_mimetype=mimetype,
+                         submitted_filename=secure_filename(file.filename) or "answer.txt", status='pending')
         db.session.add(sub)
+        try:
+            enqueue_submission(sub)
+        except QueueFullError:
+            db.session.rollback()
+            flash("The grading queue is full right now. Please try again in a few minutes.", "danger")
+            return redirect('/student/dashboard')
         db.session.commit()
-        flash(f"Graded: {score}%", "success")
+        notify_workers()
+        flash("Submitted! Your answer is being graded.", "info")
         return redirect('/student/dashboard')
-    assigns = Assignment.query.filter_by(class_name=student.class_name, division=student.division).all()
-    my_subs = {s.assignment_id: s for s in Submission.query.filter_by(student_id=student.id).all()}
-    total = Attendance.query.filter_by(student_id=student.id).count()
-    present = Attendance.query.filter_by(student_id=student.id, status='Present').count()
-    pct = int((present / total) * 100) if total > 0 else 0
-    return render_template('student_dashboard.html', student=student, assignments=assigns, submitted_map=my_subs,
-                           att_pct=pct, present_days=present, total_days=total)
+    data = student_dashboard_data(session['user_id'])  # Two indexed queries, see app/dashboards.py
+    return render_template('student_dashboard.html', **data)
+
+
+@routes.route('/student/submissions/<int:id>/status')
+@role_required('student')
+def submission_status_api(id):
+    sub = Submission.query.get_or_404(id)
+    if sub.student_id != session['user_id']:
+        return {"error": "Unauthorized"}, 403
+    return submission_status(sub)
 
 
 @routes.route('/student/download/<int:id>')
 @role_required('student')
 def download_q(id):
     assign = Assignment.query.get_or_404(id)
+    if assign.questionnaire_sha256:
+        # Streamed from disk in chunks by send_file; the bytes never touch the database.
+        try:
+            return send_file(blob_store.path(assign.questionnaire_sha256), mimetype=assign.questionnaire_mimetype,
+                             download_name=assign.questionnaire_filename, as_attachment=True)
+        except FileNotFoundError:
+            abort(404)
+    if assign.questionnaire_file is None:  # Legacy row not yet moved by migrate_blobs.py
+        abort(404)
     return send_file(BytesIO(assign.questionnaire_file), download_name=assign.questionnaire_filename,
                      as_attachment=True)
 
 
 # --- PUBLIC/GENERAL API ---
+CHAT_SYSTEM_PROMPT = "You are a helpful teaching assistant."
+
+
+def _sse(data, event=None):
+    """One Server-Sent Events frame; data is JSON so newlines in tokens survive."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+
+def _chat_event_stream(user_message):
+    tokens = stream_chat_completion(
+        messages=[{"role": "system", "content": CHAT_SYSTEM_PROMPT},
+                  {"role": "user", "content": user_message}],
+        model="llama-3.3-70b-versatile",
+    )
+    try:
+        for delta in tokens:
+            yield _sse({"delta": delta})
+        yield _sse({}, event="done")
+    except AIUnavailableError:
+        yield _sse({"message": "AI Brain is busy, please try again."}, event="error")
+    except Exception as e:
+        print(f"Chat Stream Error: {e}")
+        yield _sse({"message": "Thinking error."}, event="error")
+    finally:
+        # Runs when the client disconnects too (the server closes this generator),
+        # which closes the upstream stream and frees the AI slot.
+        tokens.close()
+
+
 @routes.route('/api/chat', methods=['POST'])
-def chat_api():
+@admission_controlled()
+async def chat_api():
     # Minor update: Added a session check for chat security
     if 'user_id' not in session: return {"response": "Unauthorized."}, 401
 
@@ -572,9 +790,16 @@ def chat_api():
     from app.ai_evaluator import get_groq_client
     client = get_groq_client()
     if not client: return {"response": "Error: AI Brain is offline."}
+
+    # Streaming mode: tokens are forwarded as Server-Sent Events as they arrive
+    # (a sync generator: WSGI servers can't iterate async ones)
+    if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        return Response(_chat_event_stream(user_message), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
     try:
-        completion = client.chat.completions.create(
-            messages=[{"role": "system", "content": "You are a helpful teaching assistant."},
+        completion = await chat_completion_async(
+            messages=[{"role": "system", "content": CHAT_SYSTEM_PROMPT},
                       {"role": "user", "content": user_message}],
             model="llama-3.3-70b-versatile",
         )
@@ -583,84 +808,42 @@ def chat_api():
         return {"response": "Thinking error."}
 
 
-from docx import Document
-from pptx import Presentation
-
-
-def extract_text_from_any_file(file_storage):
-    filename = file_storage.filename.lower()
-
-    # Existing PDF Logic
-    if filename.endswith('.pdf'):
-        # ... (keep your existing pypdf + OCR fallback logic here)
-        return text
-
-    # New Word Logic
-    elif filename.endswith('.docx'):
-        doc = Document(file_storage)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
-
-    # New PPT Logic
-    elif filename.endswith('.pptx'):
-        prs = Presentation(file_storage)
-        text = ""
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + " "
-        return text
-
-    # Existing Plain Text Logic
-    else:
-        return file_storage.read().decode('utf-8', errors='ignore')
-
 @routes.route('/teacher/generate-test-preview', methods=['POST'])
 @role_required('teacher')
-def generate_test_preview():
+@admission_controlled(cost=3, precheck=_upload_error)  # Up to MCQ_MAX_SECTIONS model calls
+async def generate_test_preview():
     file = request.files.get('file')
     num_q = request.form.get('num_questions', 5)
     duration = request.form.get('duration', 30)
 
     if not file:
         return {"error": "No file uploaded"}, 400
-
-    # 1. Extract Text
-    context_text = extract_text_from_any_file(file)
-
-    # 2. Call AI
-    from app.ai_evaluator import get_groq_client
-    client = get_groq_client()
-
-    prompt = f"""
-    Generate exactly {num_q} MCQ questions based on the provided text.
-    Return ONLY a JSON object with a single key "questions" containing a list of objects.
-    Each object must have: "question", "options" (list of 4 strings), and "correct_index" (0-3).
-
-    Example format:
-    {{
-      "questions": [
-        {{
-          "question": "Example?",
-          "options": ["A", "B", "C", "D"],
-          "correct_index": 0
-        }}
-      ]
-    }}
-
-    TEXT: {context_text[:4000]}
-    """
+    try:
+        num_q = min(max(int(num_q), 1), 50)
+    except ValueError:
+        num_q = 5
+
+    async def build_questions():
+        # 1. Extract Text (app/ingestion.py)
+        context_text = await asyncio.to_thread(extract_text, file)
+        if not context_text or not context_text.strip():
+            return None
+        # 2. Map-reduce over the whole document (see app/mcq_generator.py)
+        return await generate_mcqs_async(context_text, num_q)
 
     try:
-        completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile",  # Using a high-reasoning model for quality MCQs
-            response_format={"type": "json_object"}
-        )
-        questions = json.loads(completion.choices[0].message.content)
-        return {"questions": questions, "duration": duration}
+        check_upload(file)
+        # Identical uploads with the same question count share one generation (app/singleflight.py).
+        questions = await test_preview_flights.do_async(upload_key(file, "mcq", num_q), build_questions)
+    except IngestionError as e:
+        return {"error": str(e)}, 400
+    except AIUnavailableError as e:
+        return {"error": f"AI is busy, please try again. ({e})"}, 503
     except Exception as e:
         return {"error": str(e)}, 500
+    if questions is None:
+        return {"error": "Could not read any text from this file."}, 400
+    return {"questions": questions, "duration": duration}
 
 
 @routes.route('/teacher/save-test', methods=['POST'])
@@ -754,6 +937,7 @@ def submit_test(test_id):
     )
 
     db.session.add(result)
+    record_test_result(result, test)
     db.session.commit()
 
     return {"score": score, "total": total}, 200
@@ -770,19 +954,32 @@ def view_test_results(test_id):
     # Join with User to get student names and roll numbers
     results = db.session.query(TestResult, User).join(User, TestResult.student_id == User.id).filter(TestResult.test_id == test_id).all()
 
-    # Calculate basic stats
-    total_attempts = len(results)
-    avg_score = db.session.query(func.avg(TestResult.score)).filter(TestResult.test_id == test_id).scalar() or 0
+    # Precomputed stats (app/stats.py) instead of a full AVG over the results
+    test_stats = get_rollup('test', test.id)
 
     return render_template('teacher_test_results.html',
                            test=test,
                            results=results,
                            stats={
-                               "total": total_attempts,
-                               "avg": round(avg_score, 1)
+                               "total": test_stats["count"],
+                               "avg": test_stats["avg"],
+                               "histogram": test_stats["histogram"]
                            })
 
 
+@routes.route('/teacher/test-results/<int:test_id>/export')
+@role_required('teacher')
+def export_test_results(test_id):
+    test = Test.query.get_or_404(test_id)
+    if test.teacher_id != session['user_id']:
+        abort(403)
+    try:
+        return export_response(f"results_{test.title}", TEST_RESULT_COLUMNS, test_result_rows(test_id),
+                               request.args.get('format', 'csv'))
+    except ExportError as e:
+        return str(e), 400
+
+
 @routes.route('/teacher/view-tests')
 @role_required('teacher')
 def view_mcq_tests(): # Renamed from view_assignments to avoid the crash
@@ -0,0 +1,111 @@
+"""
+Idempotent schema upgrades, run by init_db.py right after db.create_all().
+
+create_all() only creates tables that are missing, so columns and indexes added
+to an existing model are applied here on the next boot.
+"""
+from sqlalchemy import inspect, text
+from app import db
+
+# (table, column, column DDL)
+ADDED_COLUMNS = [
+    ("submission", "submitted_filename", "VARCHAR(255)"),
+    ("submission", "status", "VARCHAR(20) NOT NULL DEFAULT 'graded'"),
+    ("assignment", "questionnaire_sha256", "VARCHAR(64)"),
+    ("assignment", "questionnaire_size", "INTEGER"),
+    ("assignment", "questionnaire_mimetype", "VARCHAR(100)"),
+    ("submission", "submitted_sha256", "VARCHAR(64)"),
+    ("submission", "submitted_size", "INTEGER"),
+    ("submission", "submitted_mimetype", "VARCHAR(100)"),
+    ("submission", "extracted_text", "TEXT"),
+    ("grading_job", "batch_id", "VARCHAR(32)"),
+]
+
+
+def _add_columns(inspector, tables, applied):
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+                applied.append(f"{table}.{column}")
+
+
+def _create_indexes(inspector, tables, applied):
+    """Creates every index declared on the models (__table_args__ / index=True) that is missing."""
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        existing |= {uc['name'] for uc in inspector.get_unique_constraints(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                applied.append(f"index {index.name}")
+
+
+def _dedupe_attendance(inspector, tables, applied):
+    """Double-submitted registers must be collapsed (latest row wins) before the unique index can exist."""
+    if 'attendance' not in tables:
+        return
+    if 'uq_attendance_student_date_subject' in {ix['name'] for ix in inspector.get_indexes('attendance')}:
+        return
+    with db.engine.begin() as conn:
+        result = conn.execute(text(
+            "DELETE FROM attendance WHERE id NOT IN "
+            "(SELECT MAX(id) FROM attendance GROUP BY student_id, date, lecture_subject)"
+        ))
+    if result.rowcount:
+        applied.append(f"removed {result.rowcount} duplicate attendance row(s)")
+
+
+def _backfill_teacher_classes(applied):
+    from app.models import TeacherClass, User
+    from app.dashboards import sync_teacher_classes
+
+    if TeacherClass.query.first() is not None:
+        return
+    teachers = User.query.filter(User.role == 'teacher', User.assigned_classes.isnot(None)).all()
+    for teacher in teachers:
+        sync_teacher_classes(teacher)
+    db.session.commit()
+    if teachers:
+        applied.append(f"teacher_class rows for {len(teachers)} teacher(s)")
+
+
+def _backfill_score_rollups(applied):
+    from app.models import ScoreRollup, Submission, TestResult
+    from app.stats import rebuild_rollups
+
+    if ScoreRollup.query.first() is not None:
+        return
+    if Submission.query.first() is None and TestResult.query.first() is None:
+        return
+    applied.append(f"{rebuild_rollups()} score rollup row(s)")
+
+
+def _backfill_attendance_rollups(applied):
+    from app.models import Attendance, AttendanceDaily
+    from app.attendance_analytics import rebuild_attendance_rollups
+
+    if AttendanceDaily.query.first() is not None or Attendance.query.first() is None:
+        return
+    daily, monthly = rebuild_attendance_rollups()
+    applied.append(f"{daily} daily and {monthly} monthly attendance rollup row(s)")
+
+
+def upgrade_schema():
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    applied = []
+
+    _add_columns(inspector, tables, applied)
+    _dedupe_attendance(inspector, tables, applied)
+    _create_indexes(inspect(db.engine), tables, applied)
+    _backfill_teacher_classes(applied)
+    _backfill_score_rollups(applied)
+    _backfill_attendance_rollups(applied)
+
+    return applied
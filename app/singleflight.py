@@ -0,0 +1,239 @@
+"""
+Singleflight: concurrent identical calls share one execution.
+
+    key = upload_key(file, "answer_key")
+    answer = await answer_key_flights.do_async(key, lambda: build_answer_key(file))
+
+Within a process, the first caller for a key (the leader) runs the call, and
+every caller that arrives while it runs gets the same result (or exception).
+Across gunicorn workers, each leader takes an exclusive file lock for the key
+(SINGLEFLIGHT_DIR/<group>/<key>.lock). A leader that finds the lock held waits
+for it, then picks up the result the holder wrote next to it (<key>.json)
+instead of calling the AI again. Only results that finished while the caller
+was waiting are reused: this is coalescing, not a cache. If the holder failed,
+or the wait passes SINGLEFLIGHT_WAIT_SECONDS, the caller runs the call itself.
+
+Only successful results are shared: if the call raises, the callers already
+waiting on it in this process get the exception, nothing is written for other
+processes, and the next caller runs the call again. Functions used here must
+raise on failure rather than return an error value. Results must be
+JSON-serialisable. Without fcntl (Windows dev machines) only
+in-process coalescing is done.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from app.ai_cache import make_key, DEFAULT_CACHE_DIR
+from app.metrics import Counter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SINGLEFLIGHT_DIR = os.environ.get("SINGLEFLIGHT_DIR", os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'singleflight'))
+SINGLEFLIGHT_WAIT_SECONDS = float(os.environ.get("SINGLEFLIGHT_WAIT_SECONDS", 180))
+LOCK_POLL_SECONDS = 0.05
+PRUNE_EVERY = 100  # Publishes between sweeps of old lock/result files
+PRUNE_AGE_SECONDS = 3600
+
+SINGLEFLIGHT_CALLS = Counter("singleflight_calls_total", "Coalesced calls by group and outcome "
+                                                         "(executed, shared_in_process, shared_across_processes).")
+
+_MISSING = object()
+
+
+def upload_key(file_storage, *params):
+    """Key for an upload: sha256 of its bytes (streamed), its extension and the given parameters."""
+    digest = hashlib.sha256()
+    stream = file_storage.stream
+    stream.seek(0)
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+    stream.seek(0)
+    extension = os.path.splitext((file_storage.filename or "").lower())[1]
+    return make_key(digest.hexdigest(), extension, *(str(p) for p in params))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = os.path.join(directory or SINGLEFLIGHT_DIR, name)
+        self._flights = {}  # key -> _Flight, while the leader runs
+        self._lock = threading.Lock()
+        self._publishes = 0
+        self._counters = {"calls": 0, "executed": 0, "shared_in_process": 0, "shared_across_processes": 0}
+
+    # --- Public API ---
+    def do(self, key, fn):
+        """Runs fn() once for all concurrent callers with this key and returns its result."""
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.result()
+        try:
+            fd, started, contended = self._acquire(key)
+            try:
+                value = self._shared_result(key, started) if contended else _MISSING
+                if value is _MISSING:
+                    value = fn()
+                    self._executed(key, value)
+            finally:
+                self._unlock(fd)
+            flight.value = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.value
+
+    async def do_async(self, key, fn):
+        """do() for a coroutine function; waiting happens off the event loop."""
+        flight, leader = self._join(key)
+        if not leader:
+            return await asyncio.to_thread(flight.result)
+        try:
+            fd, started, contended = await asyncio.to_thread(self._acquire, key)
+            try:
+                value = self._shared_result(key, started) if contended else _MISSING
+                if value is _MISSING:
+                    value = await fn()
+                    self._executed(key, value)
+            finally:
+                self._unlock(fd)
+            flight.value = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._flights)
+        stats["calls_saved"] = stats["shared_in_process"] + stats["shared_across_processes"]
+        return stats
+
+    # --- In-process coalescing ---
+    def _count(self, outcome):
+        with self._lock:
+            self._counters[outcome] += 1
+        SINGLEFLIGHT_CALLS.inc(group=self.name, outcome=outcome)
+
+    def _join(self, key):
+        with self._lock:
+            self._counters["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count("shared_in_process")
+        return flight, leader
+
+    def _land(self, key, flight):
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    # --- Cross-process coalescing (file lock + result file) ---
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def _acquire(self, key):
+        """(lock fd or None, wait start time, whether another process held the lock)."""
+        started = time.time()
+        if fcntl is None:
+            return None, started, False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self._path(key, ".lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        except OSError as e:
+            print(f"Singleflight Error ({self.name}): {e}")
+            return None, started, False
+
+        contended = False
+        deadline = time.monotonic() + SINGLEFLIGHT_WAIT_SECONDS
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd, started, contended
+            except BlockingIOError:
+                contended = True
+                if time.monotonic() >= deadline:
+                    os.close(fd)  # Waited long enough: run the call ourselves
+                    return None, started, False
+                time.sleep(LOCK_POLL_SECONDS)
+
+    @staticmethod
+    def _unlock(fd):
+        if fd is not None:
+            os.close(fd)  # Closing the descriptor releases the flock
+
+    def _shared_result(self, key, since):
+        """The result another process finished after `since`, else _MISSING."""
+        try:
+            with open(self._path(key, ".json"), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return _MISSING
+        if entry.get("finished_at", 0) < since:
+            return _MISSING
+        self._count("shared_across_processes")
+        return entry["value"]
+
+    def _executed(self, key, value):
+        self._count("executed")
+        if fcntl is None:
+            return
+        path = self._path(key, ".json")
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"value": value, "finished_at": time.time()}, f)
+            os.replace(tmp_path, path)  # Atomic: waiters never read a half-written result
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Singleflight Error ({self.name}): {e}")
+        with self._lock:
+            self._publishes += 1
+            prune = self._publishes % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        cutoff = time.time() - PRUNE_AGE_SECONDS
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+        except OSError as e:
+            print(f"Singleflight Error ({self.name}): {e}")
+
+
+# --- Shared groups ---
+answer_key_flights = SingleFlight("answer_key")
+test_preview_flights = SingleFlight("test_preview")
+
+
+def all_singleflight_stats():
+    return {flights.name: flights.stats() for flights in (answer_key_flights, test_preview_flights)}
@@ -0,0 +1,167 @@
+"""
+Incrementally maintained score statistics.
+
+Every graded Submission and every TestResult bumps the matching ScoreRollup
+rows (global, per assignment/test, per class) inside the caller's transaction,
+so dashboards read count / average / histogram from one row instead of
+aggregating the whole table. Increments are atomic UPDATEs (col = col + n),
+which keeps concurrent grading workers from losing updates.
+"""
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import ScoreRollup, Submission, Assignment, TestResult, Test
+
+BUCKETS = 10
+
+
+def _bucket(percent):
+    return min(max(int((percent or 0) // 10), 0), BUCKETS - 1)
+
+
+def _class_key(class_name, division):
+    return f"{class_name}|{division}"
+
+
+def _bump(scope, scope_key, count, total, bucket_deltas):
+    """Adds the deltas to one rollup row, creating it on first use."""
+    values = {ScoreRollup.count: ScoreRollup.count + count, ScoreRollup.total: ScoreRollup.total + total}
+    for bucket, delta in bucket_deltas.items():
+        column = getattr(ScoreRollup, f"bucket_{bucket}")
+        values[column] = column + delta
+
+    match = ScoreRollup.query.filter_by(scope=scope, scope_key=scope_key)
+    if match.update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            row = ScoreRollup(scope=scope, scope_key=scope_key, count=count, total=total)
+            for bucket in range(BUCKETS):
+                setattr(row, f"bucket_{bucket}", bucket_deltas.get(bucket, 0))
+            db.session.add(row)
+    except IntegrityError:
+        # Another worker created the row first; apply our deltas to it.
+        match.update(values, synchronize_session=False)
+
+
+def _apply(scopes, raw_score, percent, sign):
+    for scope, scope_key in scopes:
+        _bump(scope, scope_key, sign, sign * (raw_score or 0), {_bucket(percent): sign})
+
+
+def _submission_scopes(assignment_id, class_name, division):
+    return [
+        ("submissions", ""),
+        ("assignment", str(assignment_id)),
+        ("class_submissions", _class_key(class_name, division)),
+    ]
+
+
+def _test_scopes(test_id, class_name, division):
+    return [
+        ("tests", ""),
+        ("test", str(test_id)),
+        ("class_tests", _class_key(class_name, division)),
+    ]
+
+
+def _test_percent(score, total_questions):
+    return (score or 0) * 100.0 / total_questions if total_questions else 0
+
+
+# --- 1. WRITE PATH (call before the caller's commit) ---
+def record_submission_score(submission, previous_score=None):
+    """
+    Counts a newly graded submission. For a regrade pass `previous_score` so the
+    old score is taken out of the rollups first.
+    """
+    assignment = submission.assignment
+    scopes = _submission_scopes(assignment.id, assignment.class_name, assignment.division)
+    if previous_score is not None:
+        _apply(scopes, previous_score, previous_score, -1)
+    _apply(scopes, submission.score, submission.score, +1)
+
+
+def record_test_result(result, test):
+    _apply(_test_scopes(test.id, test.class_name, test.division), result.score,
+           _test_percent(result.score, result.total_questions), +1)
+
+
+def _assignment_row(assignment):
+    return ScoreRollup.query.filter_by(scope="assignment", scope_key=str(assignment.id)).first()
+
+
+def forget_assignment(assignment):
+    """Removes a deleted assignment's contribution from the global and class rollups."""
+    row = _assignment_row(assignment)
+    if row is None:
+        return
+    deltas = {b: -getattr(row, f"bucket_{b}") for b in range(BUCKETS)}
+    for scope, scope_key in (("submissions", ""),
+                             ("class_submissions", _class_key(assignment.class_name, assignment.division))):
+        _bump(scope, scope_key, -row.count, -row.total, deltas)
+    db.session.delete(row)
+
+
+def move_assignment_class(assignment, old_class_name, old_division):
+    """
+    Moves an assignment's contribution from its old class rollup to its current
+    one, after edit_assignment changed class_name/division. Later regrades then
+    subtract from the class row that holds the original counts.
+    """
+    old_key, new_key = _class_key(old_class_name, old_division), _class_key(assignment.class_name, assignment.division)
+    row = _assignment_row(assignment)
+    if row is None or old_key == new_key:
+        return
+    buckets = {b: getattr(row, f"bucket_{b}") for b in range(BUCKETS)}
+    _bump("class_submissions", old_key, -row.count, -row.total, {b: -n for b, n in buckets.items()})
+    _bump("class_submissions", new_key, row.count, row.total, buckets)
+
+
+# --- 2. READ PATH ---
+def get_rollup(scope, scope_key=""):
+    row = ScoreRollup.query.filter_by(scope=scope, scope_key=str(scope_key)).first()
+    if row is None:
+        return {"count": 0, "total": 0.0, "avg": 0.0, "histogram": [0] * BUCKETS}
+    return {
+        "count": row.count,
+        "total": row.total,
+        "avg": round(row.total / row.count, 1) if row.count else 0.0,
+        "histogram": [getattr(row, f"bucket_{b}") for b in range(BUCKETS)],
+    }
+
+
+# --- 3. REBUILD (rebuild_stats.py) ---
+def rebuild_rollups(batch_size=1000):
+    """Recomputes every rollup from the source tables, streaming rows in batches."""
+    acc = {}
+
+    def add(scopes, raw_score, percent):
+        for key in scopes:
+            entry = acc.setdefault(key, {"count": 0, "total": 0.0, "buckets": [0] * BUCKETS})
+            entry["count"] += 1
+            entry["total"] += raw_score or 0
+            entry["buckets"][_bucket(percent)] += 1
+
+    submissions = db.session.query(
+        Submission.score, Assignment.id, Assignment.class_name, Assignment.division
+    ).join(Assignment, Submission.assignment_id == Assignment.id).filter(
+        Submission.status == 'graded'
+    ).execution_options(yield_per=batch_size)
+    for score, assignment_id, class_name, division in submissions:
+        add(_submission_scopes(assignment_id, class_name, division), score, score)
+
+    results = db.session.query(
+        TestResult.score, TestResult.total_questions, Test.id, Test.class_name, Test.division
+    ).join(Test, TestResult.test_id == Test.id).execution_options(yield_per=batch_size)
+    for score, total_questions, test_id, class_name, division in results:
+        add(_test_scopes(test_id, class_name, division), score, _test_percent(score, total_questions))
+
+    ScoreRollup.query.delete(synchronize_session=False)
+    for (scope, scope_key), entry in acc.items():
+        row = ScoreRollup(scope=scope, scope_key=scope_key, count=entry["count"], total=entry["total"])
+        for b, value in enumerate(entry["buckets"]):
+            setattr(row, f"bucket_{b}", value)
+        db.session.add(row)
+    db.session.commit()
+    return len(acc)
@@ -0,0 +1,222 @@
+"""
+Attendance analytics benchmark: rollup reads vs aggregating raw attendance rows.
+
+Fills a throwaway SQLite database with a synthetic attendance table (default
+one million rows), times the backfill (rebuild_attendance_rollups), then runs
+each teacher report twice: as a GROUP BY over Attendance, and from the rollup
+tables via app.attendance_analytics. Also measures what keeping the rollups
+costs on the write path (one register through upsert_attendance) and checks
+the rollups still agree with the raw rows afterwards.
+
+    python benchmarks/bench_attendance_analytics.py
+    python benchmarks/bench_attendance_analytics.py --rows 100000 --repeats 5 --json bench_attendance.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["GRADING_WORKERS"] = "0"
+
+CLASSES = [("FY", "A"), ("FY", "B"), ("SY", "A"), ("SY", "B")]
+STUDENTS_PER_CLASS = 50
+SUBJECTS = ["Maths", "Physics", "Chemistry", "English", "Biology", "History"]
+INSERT_CHUNK = 50000
+START = date(2025, 6, 1)
+
+
+def populate(db, models, rows):
+    """Registers in date order: every class has every subject every day, until `rows` marks exist."""
+    User, Attendance = models
+    rng = random.Random(42)
+    students = [{"username": f"s{c}_{i}", "password_hash": "x", "role": "student", "email": f"s{c}_{i}@example.com",
+                 "roll_no": f"R{i:03}", "class_name": cls, "division": div, "is_verified": True}
+                for c, (cls, div) in enumerate(CLASSES) for i in range(STUDENTS_PER_CLASS)]
+    db.session.execute(User.__table__.insert(), students + [
+        {"username": "teacher", "password_hash": "x", "role": "teacher", "email": "t@example.com",
+         "roll_no": None, "class_name": None, "division": None, "is_verified": True}])
+    teacher_id = len(students) + 1
+    # A few students per class skip a lot, so the alert report has something to find.
+    rate = {sid: (0.55 if sid % 17 == 0 else 0.88) for sid in range(1, len(students) + 1)}
+
+    per_day = len(students) * len(SUBJECTS)
+    batch, written = [], 0
+    day = 0
+    while written < rows:
+        for c, (cls, div) in enumerate(CLASSES):
+            for subject in SUBJECTS:
+                for i in range(STUDENTS_PER_CLASS):
+                    sid = c * STUDENTS_PER_CLASS + i + 1
+                    batch.append({"date": START + timedelta(days=day), "lecture_subject": subject,
+                                  "status": "Present" if rng.random() < rate[sid] else "Absent",
+                                  "student_id": sid, "teacher_id": teacher_id, "class_name": cls, "division": div})
+        written += per_day
+        day += 1
+        if len(batch) >= INSERT_CHUNK or written >= rows:
+            db.session.execute(Attendance.__table__.insert(), batch[:len(batch) - max(0, written - rows)])
+            batch = []
+    db.session.commit()
+    return teacher_id, START + timedelta(days=day - 1)
+
+
+# --- RAW BASELINES (what each report costs without rollups) ---
+def raw_subject_percentages(db, Attendance, cls, div, date_from, date_to):
+    from sqlalchemy import case, func
+    return db.session.query(
+        Attendance.lecture_subject, func.sum(case((Attendance.status == 'Present', 1), else_=0)), func.count()
+    ).filter(Attendance.class_name == cls, Attendance.division == div,
+             Attendance.date >= date_from, Attendance.date <= date_to).group_by(Attendance.lecture_subject).all()
+
+
+def raw_low_attendance(db, Attendance, cls, div, date_from, date_to):
+    from sqlalchemy import case, func
+    return db.session.query(
+        Attendance.student_id, Attendance.lecture_subject,
+        func.sum(case((Attendance.status == 'Present', 1), else_=0)), func.count()
+    ).filter(Attendance.class_name == cls, Attendance.division == div,
+             Attendance.date >= date_from, Attendance.date <= date_to
+             ).group_by(Attendance.student_id, Attendance.lecture_subject).all()
+
+
+def raw_heatmap(db, Attendance, cls, div, date_from, date_to):
+    from sqlalchemy import case, func
+    return db.session.query(
+        Attendance.date, Attendance.lecture_subject, func.sum(case((Attendance.status == 'Present', 1), else_=0)),
+        func.count()
+    ).filter(Attendance.class_name == cls, Attendance.division == div,
+             Attendance.date >= date_from, Attendance.date <= date_to
+             ).group_by(Attendance.date, Attendance.lecture_subject).all()
+
+
+def timed_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def register_write_cost(db, attendance_module, teacher_id, day, repeats):
+    """Median ms to save one register (one class, one subject) with and without the rollup upkeep."""
+    from app.models import User
+
+    cls, div = CLASSES[0]
+    students = User.query.filter_by(role='student', class_name=cls, division=div).all()
+    rng = random.Random(7)
+
+    def register(d):
+        return [{"date": d, "lecture_subject": "Maths", "status": rng.choice(["Present", "Absent"]),
+                 "student_id": s.id, "teacher_id": teacher_id, "class_name": cls, "division": div} for s in students]
+
+    def save(offset):
+        attendance_module.upsert_attendance(register(day + timedelta(days=offset)))
+        db.session.commit()
+
+    counter = iter(range(1, 10 ** 6))
+    with_rollups = timed_ms(lambda: save(next(counter) % 3), repeats)  # New registers and re-saves
+    update_rollups = attendance_module._update_rollups
+    attendance_module._update_rollups = lambda rows: None
+    try:
+        # Far-future dates, so the consistency check below never sees rows written without upkeep.
+        without = timed_ms(lambda: save(1000 + next(counter) % 3), repeats)
+    finally:
+        attendance_module._update_rollups = update_rollups
+    return with_rollups, without
+
+
+def run(rows, repeats):
+    from sqlalchemy import text
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_att_"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from app import create_app, db
+    from app import attendance as attendance_module
+    from app import attendance_analytics as analytics
+    from app.models import User, Attendance, AttendanceDaily, AttendanceMonthly
+
+    app = create_app()
+    result = {"rows": rows}
+    with app.app_context():
+        db.create_all()
+        t0 = time.perf_counter()
+        teacher_id, last_day = populate(db, (User, Attendance), rows)
+        result["populate_s"] = round(time.perf_counter() - t0, 1)
+
+        t0 = time.perf_counter()
+        daily, monthly = analytics.rebuild_attendance_rollups()
+        result["backfill_s"] = round(time.perf_counter() - t0, 1)
+        result["rollup_rows"] = {"daily": daily, "monthly": monthly}
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+        cls, div = CLASSES[0]
+        year = (START, last_day)
+        month = (last_day - timedelta(days=29), last_day)
+        reports = [
+            ("subject % (all dates)",
+             lambda: raw_subject_percentages(db, Attendance, cls, div, *year),
+             lambda: analytics.subject_percentages(cls, div, *year)),
+            ("low attendance (all dates)",
+             lambda: raw_low_attendance(db, Attendance, cls, div, *year),
+             lambda: analytics.low_attendance(cls, div, *year)),
+            ("heatmap (30 days)",
+             lambda: raw_heatmap(db, Attendance, cls, div, *month),
+             lambda: analytics.heatmap(cls, div, *month)),
+        ]
+        result["reports"] = {}
+        for name, raw, rollup in reports:
+            result["reports"][name] = {"raw_ms": timed_ms(raw, repeats), "rollup_ms": timed_ms(rollup, repeats)}
+
+        write_with, write_without = register_write_cost(db, attendance_module, teacher_id, last_day, repeats)
+        result["register_write_ms"] = {"with_rollups": write_with, "without_rollups": write_without}
+
+        # The per-register upkeep must leave the rollups equal to the raw rows.
+        raw = {subject: (int(present), total)
+               for subject, present, total in raw_subject_percentages(db, Attendance, cls, div, *year)}
+        rolled = {r["subject"]: (r["present"], r["total"]) for r in analytics.subject_percentages(cls, div, *year)}
+        result["consistent"] = raw == rolled
+        result["alerts"] = len(analytics.low_attendance(cls, div, *year))
+        result["attendance_rows"] = Attendance.query.count()
+        result["rollup_rows_after"] = {"daily": AttendanceDaily.query.count(),
+                                       "monthly": AttendanceMonthly.query.count()}
+        db.session.remove()
+        db.engine.dispose()
+    os.remove(db_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000, help="Synthetic attendance rows")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    result = run(args.rows, args.repeats)
+    print(f"attendance rows: {result['rows']:,} (populated in {result['populate_s']}s)")
+    print(f"backfill: {result['backfill_s']}s -> {result['rollup_rows']['daily']:,} daily + "
+          f"{result['rollup_rows']['monthly']:,} monthly rollup rows")
+    print(f"{'report':<28} | {'raw ms':>9} | {'rollup ms':>9} | speedup")
+    for name, r in result["reports"].items():
+        speedup = r["raw_ms"] / r["rollup_ms"] if r["rollup_ms"] else float("inf")
+        print(f"{name:<28} | {r['raw_ms']:>9} | {r['rollup_ms']:>9} | {speedup:.0f}x")
+    w = result["register_write_ms"]
+    print(f"register save ({STUDENTS_PER_CLASS} students): {w['with_rollups']} ms with rollups, "
+          f"{w['without_rollups']} ms without")
+    print(f"rollups match raw rows: {result['consistent']} | students flagged: {result['alerts']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "attendance_analytics", "result": result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
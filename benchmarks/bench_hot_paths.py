@@ -0,0 +1,339 @@
+"""
+Micro-benchmarks for the extraction, OCR and scoring hot paths.
+
+Builds a deterministic fixture corpus in memory (text PDFs, scanned PDFs,
+DOCX, PPTX, plain text and phone-sized photos) and times each hot function
+on each input size with a stubbed Groq client, so no network is involved and
+only our own code is measured. Peak memory is measured in a separate
+tracemalloc pass so it doesn't distort the timings.
+
+    python benchmarks/bench_hot_paths.py
+    python benchmarks/bench_hot_paths.py --quick --json bench_hot_paths.json
+    python benchmarks/bench_hot_paths.py --compare baseline.json  # exit 1 on regression
+
+Cases whose system dependency is missing (poppler for scanned PDFs, tesseract
+for the local OCR tier) are reported as skipped.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["GRADING_WORKERS"] = "0"
+os.environ.setdefault("OCR_LOCAL_WORKERS", "0")  # Local tier is benchmarked directly, not via the pool
+os.environ.setdefault("AI_CACHE_DIR", tempfile.mkdtemp(prefix="bench_cache_"))
+os.environ.setdefault("GROQ_API_KEY", "bench-stub")
+
+LOREM = ("the quick brown fox jumps over the lazy dog while students answer questions about "
+         "photosynthesis newton's laws the french revolution and basic algebra").split()
+
+
+# --- 1. FIXTURE CORPUS ---
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(LOREM) for _ in range(words)).capitalize() + "."
+
+
+def make_text_pdf(pages, lines_per_page=40, seed=1):
+    """A real text PDF (Helvetica text objects) written by hand, so pypdf has text to extract."""
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = "".join(f"({_sentence(rng)}) Tj 0 -16 Td " for _ in range(lines_per_page))
+        content = f"BT /F1 10 Tf 40 800 Td {lines}ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_scanned_pdf(pages):
+    """Image-only pages, as a scanner produces: forces the render + OCR path."""
+    from PIL import Image
+    images = [make_photo(1240, 1754, seed=i, as_image=True) for i in range(pages)]
+    out = io.BytesIO()
+    images[0].save(out, format="PDF", save_all=True, append_images=images[1:], resolution=150)
+    for image in images:
+        image.close()
+    return out.getvalue()
+
+
+def make_photo(width, height, seed=1, as_image=False):
+    """Phone-photo stand-in: grey paper, noise, a dark border, a slight tilt and rows of 'words'."""
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    rng = np.random.default_rng(seed)
+    page = Image.new("L", (width, height), 235)
+    draw = ImageDraw.Draw(page)
+    line_height = max(height // 40, 12)
+    for y in range(height // 10, height - height // 10, line_height):
+        x = width // 12
+        while x < width - width // 12:
+            w = int(rng.integers(line_height, line_height * 4))
+            draw.rectangle([x, y, x + w, y + line_height // 2], fill=40)
+            x += w + line_height // 2
+    page = page.rotate(2.5, expand=False, fillcolor=60)
+    pixels = np.asarray(page).astype(np.int16) + rng.integers(-18, 18, (height, width), dtype=np.int16)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert("RGB")
+    if as_image:
+        return image
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def make_docx(paragraphs, seed=1):
+    from docx import Document
+    rng = random.Random(seed)
+    document = Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(" ".join(_sentence(rng) for _ in range(4)))
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def make_pptx(slides, seed=1):
+    from pptx import Presentation
+    rng = random.Random(seed)
+    presentation = Presentation()
+    for _ in range(slides):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = _sentence(rng, 5)
+        slide.placeholders[1].text = "\n".join(_sentence(rng) for _ in range(5))
+    out = io.BytesIO()
+    presentation.save(out)
+    return out.getvalue()
+
+
+def make_text(kilobytes, seed=1):
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < kilobytes * 1024:
+        paragraph = " ".join(_sentence(rng) for _ in range(6)) + "\n\n"
+        parts.append(paragraph)
+        size += len(paragraph)
+    return "".join(parts).encode()
+
+
+# --- 2. STUBBED GROQ CLIENT ---
+def install_stub_client():
+    """Answers every call instantly with canned content shaped like the real API's."""
+    from app import ai_client, ai_evaluator
+
+    def create(**kwargs):
+        if kwargs.get("response_format"):
+            body = {"score": 72, "feedback": {"Accuracy": "Mostly correct.", "Clarity": "Clear."},
+                    "questions": [{"question": f"Question {i}?", "options": ["a", "b", "c", "d"], "correct_index": 1}
+                                  for i in range(5)]}
+            content = json.dumps(body)
+        else:
+            content = "Transcribed answer text. " * 40
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    ai_client._client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    # Every repeat should pay for the full path, not a hit in one of the AI result caches.
+    bypass = types.SimpleNamespace(get=lambda key, group=None: None, set=lambda key, value, group=None: None,
+                                   observe_call=lambda seconds: None)
+    ai_evaluator.transcription_cache = ai_evaluator.answer_key_cache = ai_evaluator.grading_cache = bypass
+
+
+# --- 3. CASES ---
+def _upload(data, filename):
+    from werkzeug.datastructures import FileStorage
+    return lambda: FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def build_cases(quick):
+    """[(name, size label, fn)]; fn is called once per repeat, or is a string saying why the case is skipped."""
+    from app.ingestion import extract_text
+    from app.ocr_service import ocr_with_confidence, _tesseract_available
+    from app.preprocessing import preprocess_batch
+    from app.ai_evaluator import compute_score
+    from app.lexical_scorer import prescore
+    from app.mcq_generator import split_sections, remove_near_duplicates
+
+    cases = []
+
+    def extraction(label, data, filename):
+        upload = _upload(data, filename)
+        cases.append(("ingestion.extract_text", label, lambda: extract_text(upload())))
+
+    for pages in ([1, 20] if quick else [1, 20, 200]):
+        extraction(f"pdf_text_{pages}p", make_text_pdf(pages), "doc.pdf")
+    for pages in ([2] if quick else [2, 10]):
+        if shutil.which("pdftoppm"):
+            extraction(f"pdf_scanned_{pages}p", make_scanned_pdf(pages), "scan.pdf")
+        else:
+            cases.append(("ingestion.extract_text", f"pdf_scanned_{pages}p", "poppler not installed"))
+    for paragraphs in ([50] if quick else [50, 2000]):
+        extraction(f"docx_{paragraphs}para", make_docx(paragraphs), "doc.docx")
+    for slides in ([10] if quick else [10, 100]):
+        extraction(f"pptx_{slides}slides", make_pptx(slides), "deck.pptx")
+    for kb in ([100] if quick else [100, 5000]):
+        extraction(f"txt_{kb}kb", make_text(kb), "notes.txt")
+
+    photos = {"3mp": make_photo(2016, 1512)} if quick else {"3mp": make_photo(2016, 1512), "12mp": make_photo(4032, 3024)}
+    for label, photo in photos.items():
+        extraction(f"photo_{label}", photo, "answer.jpg")
+        cases.append(("preprocessing.preprocess_batch", f"photo_{label}", lambda p=photo: preprocess_batch([p])))
+        if _tesseract_available():
+            # The local tier as it runs in the OCR pool: on a page prepare_pages() has already cleaned up.
+            page = preprocess_batch([photo])[0][0]
+            cases.append(("ocr_service.ocr_with_confidence", f"photo_{label}", lambda p=page: ocr_with_confidence(p)))
+        else:
+            cases.append(("ocr_service.ocr_with_confidence", f"photo_{label}", "tesseract not installed"))
+    cases.append(("preprocessing.preprocess_batch", "photo_3mp_x8", lambda p=photos["3mp"]: preprocess_batch([p] * 8)))
+
+    key = make_text(4).decode()
+    for kb in ([2] if quick else [2, 32]):
+        answer = make_text(kb, seed=7).decode()
+        cases.append(("ai_evaluator.compute_score", f"answer_{kb}kb", lambda a=answer: compute_score(a, key)))
+        cases.append(("lexical_scorer.prescore", f"answer_{kb}kb", lambda a=answer: prescore(a, key)))
+
+    book = make_text(200 if quick else 2000).decode()
+    cases.append(("mcq_generator.split_sections", f"text_{len(book) // 1024}kb", lambda: split_sections(book)))
+    candidates = [{"question": _sentence(random.Random(i), 10), "options": ["a", "b", "c", "d"], "correct_index": 0}
+                  for i in range(200)]
+    cases.append(("mcq_generator.remove_near_duplicates", "200_questions", lambda: remove_near_duplicates(candidates)))
+    return cases
+
+
+# --- 4. MEASUREMENT ---
+def _skipped(error):
+    return {"skipped": f"{type(error).__name__}: {error}"}
+
+
+def measure(fn, repeats, warmup=1):
+    try:
+        for _ in range(warmup):
+            fn()
+    except Exception as e:
+        return _skipped(e)
+
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 3),
+        "min_ms": round(timings[0], 3),
+        "peak_kb": round(peak / 1024, 1),
+        "repeats": repeats,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Cases whose median time or peak memory grew by more than `threshold` x the baseline."""
+    with open(baseline_path) as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = baseline.get((r["name"], r["size"]))
+        if not old or "median_ms" not in r or "median_ms" not in old:
+            continue
+        for metric in ("median_ms", "peak_kb"):
+            if old[metric] > 0 and r[metric] > old[metric] * threshold:
+                regressions.append(f"{r['name']} [{r['size']}] {metric}: {old[metric]} -> {r[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Smaller corpus, for CI")
+    parser.add_argument("--filter", help="Only run cases whose name contains this")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Allowed slowdown/growth factor (default 1.25)")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    install_stub_client()
+
+    results = []
+    print(f"{'function':<38} {'input':<18} {'median ms':>10} {'p95 ms':>10} {'peak KB':>10}")
+    with app.app_context():
+        for name, size, fn in build_cases(args.quick):
+            if args.filter and args.filter not in name:
+                continue
+            result = {"name": name, "size": size}
+            if isinstance(fn, str):
+                result["skipped"] = fn
+            else:
+                with contextlib.redirect_stdout(io.StringIO()):  # Silence the app's own progress logging
+                    result.update(measure(fn, args.repeats))
+            results.append(result)
+            if "skipped" in result:
+                print(f"{name:<38} {size:<18} skipped ({result['skipped']})")
+            else:
+                print(f"{name:<38} {size:<18} {result['median_ms']:>10} {result['p95_ms']:>10} {result['peak_kb']:>10}")
+
+    report = {
+        "benchmark": "hot_paths",
+        "meta": {"commit": _git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "timestamp": datetime.utcnow().isoformat() + "Z", "quick": args.quick, "repeats": args.repeats},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (threshold {args.threshold}x).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Worker cold-start benchmark: how long a fresh process takes to import the app,
+run create_app() and serve its first request, and which imports that time
+goes to.
+
+Each run is a new interpreter, like a gunicorn worker booting or restarting
+after a crash. One extra run under `python -X importtime` gives the per-package
+import breakdown and the list of heavy modules that were loaded at boot even
+though no request needed them yet.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --json bench_startup.json
+    python benchmarks/bench_startup.py --compare baseline.json  # exit 1 on regression
+    python benchmarks/bench_startup.py --strict                 # exit 1 if a lazy module loads at boot
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use (file parsing, OCR, AI calls, email), never at boot.
+LAZY_MODULES = ["groq", "httpx", "pypdf", "docx", "pptx", "pdf2image", "pytesseract", "numpy", "PIL", "requests"]
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "boot_ms": (created - started) * 1000,
+}))
+"""
+
+
+def _child_env(db_dir):
+    env = dict(os.environ)
+    env.update({
+        "GRADING_WORKERS": "0",
+        "DATABASE_URL": f"sqlite:///{os.path.join(db_dir, 'startup.db')}",
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+
+def time_boot(env):
+    """One cold start. Returns the in-process timings plus wall-clock time for the whole interpreter."""
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=ROOT, capture_output=True, text=True)
+    wall = (time.perf_counter() - started) * 1000
+    if out.returncode != 0:
+        sys.exit(f"Child process failed:\n{out.stderr}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["wall_ms"] = wall
+    return result
+
+
+def import_profile(env):
+    """Parses `-X importtime` output: (self time per top-level package in ms, set of module names)."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], env=env, cwd=ROOT,
+                         capture_output=True, text=True)
+    packages, modules = {}, set()
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules.add(name)
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000
+    return packages, modules
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(summary, baseline_path, threshold):
+    """Timings that grew by more than `threshold` x the baseline."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    return [f"{metric}: {baseline[metric]} -> {summary[metric]}"
+            for metric in ("boot_ms", "wall_ms")
+            if baseline.get(metric) and summary[metric] > baseline[metric] * threshold]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Packages to list in the import breakdown")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Allowed slowdown factor (default 1.25)")
+    parser.add_argument("--strict", action="store_true", help="Exit 1 if any lazy module is imported at boot")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as db_dir:
+        env = _child_env(db_dir)
+        time_boot(env)  # Warm the OS file cache and write .pyc files; not counted
+        runs = [time_boot(env) for _ in range(args.runs)]
+        packages, modules = import_profile(env)
+
+    summary = {metric: round(statistics.median(r[metric] for r in runs), 1)
+               for metric in ("import_ms", "create_app_ms", "boot_ms", "first_request_ms", "wall_ms")}
+    eager = [name for name in LAZY_MODULES if name in modules]
+    top = sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+
+    print(f"Cold start, median of {args.runs} runs:")
+    for metric, value in summary.items():
+        print(f"  {metric:<18} {value:>8} ms")
+    print(f"\nImport self-time by package (one -X importtime run, {len(modules)} modules):")
+    for package, ms in top:
+        print(f"  {package:<24} {ms:>8.1f} ms")
+    print(f"\nLazy modules loaded at boot: {', '.join(eager) or 'none'}")
+
+    report = {
+        "benchmark": "startup",
+        "meta": {"commit": _git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "timestamp": datetime.utcnow().isoformat() + "Z", "runs": args.runs},
+        "summary": summary,
+        "runs": [{k: round(v, 1) for k, v in r.items()} for r in runs],
+        "packages": {package: round(ms, 1) for package, ms in top},
+        "eager_lazy_modules": eager,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if args.compare:
+        regressions = compare(summary, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        failed = bool(regressions)
+        if not regressions:
+            print(f"No regressions against {args.compare} (threshold {args.threshold}x).")
+    if args.strict and eager:
+        print(f"FAIL lazy modules imported at boot: {', '.join(eager)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Student dashboard benchmark: query count, latency and query plan as the
+attendance table grows.
+
+Compares the legacy loader (five separate queries, as student_dashboard used to
+run) with app.dashboards.student_dashboard_data, with and without the composite
+indexes from app/models.py.
+
+    python benchmarks/bench_student_dashboard.py
+    python benchmarks/bench_student_dashboard.py --sizes 1000,100000 --json bench_dashboard.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["GRADING_WORKERS"] = "0"
+
+STUDENTS = 200
+ASSIGNMENTS = 30
+INSERT_CHUNK = 50000
+# Every secondary index on the tables the dashboard reads. The unique attendance index starts
+# with student_id too, so leaving it in place would make "no_index" an indexed run.
+INDEXES = ["ix_attendance_student_status", "uq_attendance_student_date_subject", "ix_attendance_date_subject",
+           "ix_assignment_class", "ix_submission_student_assignment", "ix_submission_assignment"]
+
+
+def legacy_loader(db, models, student_id):
+    """The five queries student_dashboard ran before the rewrite."""
+    User, Assignment, Submission, Attendance = models
+    student = db.session.get(User, student_id)
+    assigns = Assignment.query.filter_by(class_name=student.class_name, division=student.division).all()
+    subs = {s.assignment_id: s for s in Submission.query.filter_by(student_id=student.id).all()}
+    total = Attendance.query.filter_by(student_id=student.id).count()
+    present = Attendance.query.filter_by(student_id=student.id, status='Present').count()
+    return assigns, subs, total, present
+
+
+def populate(db, models, attendance_rows):
+    User, Assignment, Submission, Attendance = models
+    rng = random.Random(42)
+    db.session.execute(User.__table__.insert(), [
+        {"username": f"s{i}", "password_hash": "x", "role": "student", "email": f"s{i}@example.com",
+         "class_name": "FY", "division": "AB"[i % 2], "is_verified": True}
+        for i in range(STUDENTS)
+    ] + [{"username": "teacher", "password_hash": "x", "role": "teacher", "email": "t@example.com",
+           "class_name": None, "division": None, "is_verified": True}])
+    teacher_id = STUDENTS + 1
+    db.session.execute(Assignment.__table__.insert(), [
+        {"title": f"A{i}", "class_name": "FY", "division": "AB"[i % 2], "subject_name": "Maths",
+         "teacher_name": "teacher", "teacher_id": teacher_id}
+        for i in range(ASSIGNMENTS)
+    ])
+    db.session.execute(Submission.__table__.insert(), [
+        {"assignment_id": a, "student_id": s, "score": rng.randint(0, 100), "status": "graded"}
+        for s in range(1, STUDENTS + 1) for a in range(1, ASSIGNMENTS + 1) if (a % 2) == (s % 2)
+    ])
+
+    start = date(2025, 6, 1)
+    for offset in range(0, attendance_rows, INSERT_CHUNK):
+        batch = []
+        for i in range(offset, min(offset + INSERT_CHUNK, attendance_rows)):
+            batch.append({
+                "date": start + timedelta(days=(i // STUDENTS) % 365),
+                "lecture_subject": f"Subject{(i // (STUDENTS * 365)) % 8}",
+                "status": "Present" if rng.random() < 0.8 else "Absent",
+                "student_id": (i % STUDENTS) + 1,
+                "teacher_id": teacher_id,
+                "class_name": "FY",
+                "division": "AB"[i % 2],
+            })
+        db.session.execute(Attendance.__table__.insert(), batch)
+    db.session.commit()
+
+
+def measure(db, fn, repeats):
+    from sqlalchemy import event
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        timings = []
+        for _ in range(repeats):
+            db.session.expire_all()
+            statements.clear()
+            t0 = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - t0) * 1000)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return {"queries": len(statements), "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(sorted(timings)[int(len(timings) * 0.95) - 1], 3)}
+
+
+def query_plan(db, student_id):
+    from sqlalchemy import text
+
+    if db.engine.dialect.name != "sqlite":
+        return []
+    sql = ("SELECT count(id), sum(CASE WHEN status = 'Present' THEN 1 ELSE 0 END) "
+           "FROM attendance WHERE student_id = :sid")
+    return [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql), {"sid": student_id})]
+
+
+def run_size(attendance_rows, repeats):
+    from sqlalchemy import text
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_dash_"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from app import create_app, db
+    from app.models import User, Assignment, Submission, Attendance
+    from app.dashboards import student_dashboard_data
+
+    models = (User, Assignment, Submission, Attendance)
+    app = create_app()
+    result = {"attendance_rows": attendance_rows}
+    with app.app_context():
+        db.create_all()
+        t0 = time.perf_counter()
+        populate(db, models, attendance_rows)
+        result["populate_s"] = round(time.perf_counter() - t0, 2)
+        student_id = STUDENTS // 2
+
+        for name in INDEXES:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        db.session.commit()
+        result["no_index"] = {
+            "legacy": measure(db, lambda: legacy_loader(db, models, student_id), repeats),
+            "loader": measure(db, lambda: student_dashboard_data(student_id), repeats),
+            "plan": query_plan(db, student_id),
+        }
+
+        from app.schema import upgrade_schema
+        upgrade_schema()  # Recreates the declared indexes
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        # Fresh connections, so no statement prepared before the indexes existed is reused.
+        db.session.remove()
+        db.engine.dispose()
+        result["indexed"] = {
+            "legacy": measure(db, lambda: legacy_loader(db, models, student_id), repeats),
+            "loader": measure(db, lambda: student_dashboard_data(student_id), repeats),
+            "plan": query_plan(db, student_id),
+        }
+        db.session.remove()
+        db.engine.dispose()
+    os.remove(db_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="Comma-separated attendance row counts")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>9} | {'index':>8} | {'legacy q':>8} {'legacy ms':>10} | {'loader q':>8} {'loader ms':>10} | plan")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        result = run_size(size, args.repeats)
+        results.append(result)
+        for variant in ("no_index", "indexed"):
+            r = result[variant]
+            print(f"{size:>9} | {variant:>8} | {r['legacy']['queries']:>8} {r['legacy']['median_ms']:>10} | "
+                  f"{r['loader']['queries']:>8} {r['loader']['median_ms']:>10} | {'; '.join(r['plan'])}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "student_dashboard", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline evaluation of the lexical pre-scorer (app/lexical_scorer.py) against LLM grades.
+
+Scores every (answer key, student text, LLM score) example locally, then reports
+how fast that was, how well the provisional scores track the LLM's, and, for a
+grid of thresholds, how many grades would be decided without the LLM and how
+often those local grades land within --tolerance points of the LLM's.
+
+Examples come from the database (graded submissions with saved OCR text, not
+themselves graded by the pre-scorer), or from a JSONL file with one
+{"answer_key": ..., "student_text": ..., "score": ...} object per line.
+
+    python benchmarks/eval_lexical_scorer.py
+    python benchmarks/eval_lexical_scorer.py --jsonl graded.jsonl --tolerance 10 --target 0.95 --json eval.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["GRADING_WORKERS"] = "0"
+
+ACCEPT_GRID = [0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+REJECT_GRID = [0.0, 0.05, 0.1, 0.15, 0.2, 0.25]
+
+
+def load_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_database(limit):
+    from app import create_app, db
+    from app.models import Assignment, Submission
+    from app.lexical_scorer import METHOD
+
+    app = create_app()
+    examples = []
+    with app.app_context():
+        rows = db.session.query(
+            Assignment.answer_key_content, Submission.extracted_text, Submission.score, Submission.detailed_feedback
+        ).join(Assignment, Submission.assignment_id == Assignment.id).filter(
+            Submission.status == 'graded', Submission.extracted_text.isnot(None),
+            Assignment.answer_key_content.isnot(None)
+        ).order_by(Submission.id.desc()).limit(limit).execution_options(yield_per=500)
+        for key, text, score, feedback in rows:
+            if isinstance(feedback, dict) and (feedback.get("Method") == METHOD or "Error" in feedback):
+                continue  # Decided locally, or a failure placeholder: not an LLM grade
+            examples.append({"answer_key": key, "student_text": text, "score": score})
+    return examples
+
+
+def score_examples(examples):
+    from app.lexical_scorer import prescore
+
+    prescore("warm up the regex and numpy paths", "warm up the regex and numpy paths")
+    results, timings = [], []
+    for example in examples:
+        t0 = time.perf_counter()
+        results.append(prescore(example["student_text"], example["answer_key"]))
+        timings.append((time.perf_counter() - t0) * 1000)
+    return results, timings
+
+
+def evaluate(examples, results, accept_above, reject_below, min_tokens, tolerance):
+    """Coverage and agreement of the local decisions for one threshold setting."""
+    from app.lexical_scorer import classify
+
+    decided, errors = 0, []
+    for example, result in zip(examples, results):
+        decision = classify(result, accept_above, reject_below, min_tokens)
+        if decision == "escalate":
+            continue
+        local = 0 if decision == "blank" else result["score"]
+        decided += 1
+        errors.append(abs(local - float(example["score"] or 0)))
+    within = sum(1 for e in errors if e <= tolerance)
+    return {
+        "accept_above": accept_above, "reject_below": reject_below,
+        "decided": decided, "coverage": round(decided / len(examples), 3) if examples else 0.0,
+        "agreement": round(within / decided, 3) if decided else None,
+        "mae": round(statistics.mean(errors), 1) if errors else None,
+    }
+
+
+def pearson(xs, ys):
+    if len(xs) < 2 or statistics.pstdev(xs) == 0 or statistics.pstdev(ys) == 0:
+        return None
+    mx, my = statistics.mean(xs), statistics.mean(ys)
+    cov = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / len(xs)
+    return round(cov / (statistics.pstdev(xs) * statistics.pstdev(ys)), 3)
+
+
+def main():
+    from app import lexical_scorer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jsonl", help="Read examples from this file instead of the database")
+    parser.add_argument("--limit", type=int, default=5000, help="Most recent graded submissions to read")
+    parser.add_argument("--tolerance", type=float, default=15, help="Points a local grade may differ and still agree")
+    parser.add_argument("--target", type=float, default=0.9, help="Agreement a threshold setting must reach")
+    parser.add_argument("--min-tokens", type=int, default=lexical_scorer.LEXICAL_MIN_TOKENS)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    examples = load_jsonl(args.jsonl) if args.jsonl else load_database(args.limit)
+    if not examples:
+        print("No LLM-graded examples found.")
+        return
+    results, timings = score_examples(examples)
+
+    llm = [float(e["score"] or 0) for e in examples]
+    provisional = [r["score"] for r in results]  # "blank" results already score 0
+    report = {
+        "examples": len(examples),
+        "prescore_ms": {"median": round(statistics.median(timings), 2),
+                        "p95": round(sorted(timings)[max(0, int(len(timings) * 0.95) - 1)], 2)},
+        "pearson": pearson(provisional, llm),
+        "mae_all": round(statistics.mean(abs(p - s) for p, s in zip(provisional, llm)), 1),
+        "current": evaluate(examples, results, lexical_scorer.LEXICAL_ACCEPT_ABOVE,
+                            lexical_scorer.LEXICAL_REJECT_BELOW, args.min_tokens, args.tolerance),
+        "grid": [evaluate(examples, results, accept, reject, args.min_tokens, args.tolerance)
+                 for accept in ACCEPT_GRID for reject in REJECT_GRID if reject < accept],
+    }
+    passing = [r for r in report["grid"] if r["agreement"] is not None and r["agreement"] >= args.target]
+    report["recommended"] = max(passing, key=lambda r: (r["coverage"], -r["mae"])) if passing else None
+
+    print(f"examples: {report['examples']} | prescore median {report['prescore_ms']['median']} ms, "
+          f"p95 {report['prescore_ms']['p95']} ms")
+    print(f"provisional vs LLM score: pearson {report['pearson']}, mean abs error {report['mae_all']} points")
+    print(f"\n{'accept >=':>9} {'reject <=':>9} | {'decided':>7} {'coverage':>8} | "
+          f"{'agree (±' + str(int(args.tolerance)) + ')':>10} {'mae':>6}")
+    for row in [report["current"]] + report["grid"]:
+        marker = "  <- current" if row is report["current"] else ""
+        print(f"{row['accept_above']:>9} {row['reject_below']:>9} | {row['decided']:>7} {row['coverage']:>8} | "
+              f"{str(row['agreement']):>10} {str(row['mae']):>6}{marker}")
+    best = report["recommended"]
+    if best:
+        print(f"\nHighest coverage with agreement >= {args.target}: LEXICAL_ACCEPT_ABOVE={best['accept_above']} "
+              f"LEXICAL_REJECT_BELOW={best['reject_below']} ({best['coverage']:.0%} of grades without the LLM)")
+    else:
+        print(f"\nNo setting reaches agreement {args.target}; keep LEXICAL_PRESCORE=shadow and collect more grades.")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "lexical_scorer", "result": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 # File: init_db.py
-# File: init_db.py
+import os
+
+# Schema setup only: don't start background grading threads in this process.
+os.environ["GRADING_WORKERS"] = "0"
+
 from app import create_app, db
+from app.schema import upgrade_schema
+
 
 def init_database():
     app = create_app()
@@ -9,9 +15,11 @@ def init_database():
             # REMOVED db.drop_all()
             print("Checking database tables...")
             db.create_all() # This creates tables ONLY if they don't exist
+            for change in upgrade_schema():
+                print(f"  + added {change}")
             print("✅ Database is ready and persistent.")
         except Exception as e:
             print(f"⚠️ Database error: {e}")
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    init_database()
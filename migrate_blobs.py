@@ -0,0 +1,58 @@
+# File: migrate_blobs.py
+# Moves legacy in-row file bytes (Assignment.questionnaire_file, Submission.submitted_file)
+# into the blob store and clears the columns. Safe to re-run; rows already moved are skipped.
+import os
+import sys
+
+os.environ["GRADING_WORKERS"] = "0"
+
+from app import create_app, db
+from app.blob_store import blob_store, guess_mimetype
+from app.models import Assignment, Submission
+
+BATCH_SIZE = 50
+
+# (model, legacy bytes column, sha256 column, size column, mimetype column, filename column)
+TARGETS = [
+    (Assignment, "questionnaire_file", "questionnaire_sha256", "questionnaire_size",
+     "questionnaire_mimetype", "questionnaire_filename"),
+    (Submission, "submitted_file", "submitted_sha256", "submitted_size",
+     "submitted_mimetype", "submitted_filename"),
+]
+
+
+def migrate_model(model, data_col, sha_col, size_col, mime_col, name_col, keep_legacy=False):
+    pending = db.session.query(model.id).filter(
+        getattr(model, data_col).isnot(None),
+        getattr(model, sha_col).is_(None)
+    ).order_by(model.id).all()
+    ids = [row[0] for row in pending]
+
+    moved = 0
+    for start in range(0, len(ids), BATCH_SIZE):
+        for row in model.query.filter(model.id.in_(ids[start:start + BATCH_SIZE])).all():
+            data = getattr(row, data_col)  # Deferred column: loaded one row at a time
+            sha256, size = blob_store.put_bytes(data)
+            setattr(row, sha_col, sha256)
+            setattr(row, size_col, size)
+            setattr(row, mime_col, getattr(row, mime_col) or guess_mimetype(getattr(row, name_col)))
+            if not keep_legacy:
+                setattr(row, data_col, None)
+            moved += 1
+        db.session.commit()
+        db.session.expunge_all()  # Drop the loaded bytes before the next batch
+        print(f"  {model.__tablename__}: {moved}/{len(ids)}")
+    return moved
+
+
+def migrate_blobs(keep_legacy=False):
+    app = create_app()
+    with app.app_context():
+        for target in TARGETS:
+            moved = migrate_model(*target, keep_legacy=keep_legacy)
+            print(f"✅ {target[0].__tablename__}: moved {moved} file(s) to {blob_store.root}")
+
+
+if __name__ == "__main__":
+    # --keep-legacy leaves the old column populated (e.g. for a dry run before a backup).
+    migrate_blobs(keep_legacy="--keep-legacy" in sys.argv)
@@ -0,0 +1,21 @@
+# File: rebuild_attendance.py
+# Backfills / recomputes the attendance analytics rollups (AttendanceDaily, AttendanceMonthly)
+# from the Attendance table. Run once after upgrading, after a restore or a bulk SQL edit.
+import os
+
+os.environ["GRADING_WORKERS"] = "0"
+
+from app import create_app, db
+from app.attendance_analytics import rebuild_attendance_rollups
+
+
+def rebuild_attendance():
+    app = create_app()
+    with app.app_context():
+        db.create_all()  # The rollup tables are new: create them on first run
+        daily, monthly = rebuild_attendance_rollups()
+        print(f"✅ Rebuilt {daily} daily and {monthly} monthly attendance rollup row(s).")
+
+
+if __name__ == "__main__":
+    rebuild_attendance()
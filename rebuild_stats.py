@@ -0,0 +1,20 @@
+# File: rebuild_stats.py
+# Recomputes the ScoreRollup tables (dashboard counts, averages, histograms) from
+# Submission and TestResult. Run after a restore or if the rollups look off.
+import os
+
+os.environ["GRADING_WORKERS"] = "0"
+
+from app import create_app
+from app.stats import rebuild_rollups
+
+
+def rebuild_stats():
+    app = create_app()
+    with app.app_context():
+        rows = rebuild_rollups()
+        print(f"✅ Rebuilt {rows} score rollup row(s).")
+
+
+if __name__ == "__main__":
+    rebuild_stats()
@@ -4,11 +4,14 @@ load_dotenv()  # <--- Loads variables from .env before anything else
 from app import create_app, db
 from flask_migrate import Migrate
 
-# Create the application instance
-app = create_app()
+# Local OCR worker processes (forkserver/spawn) re-import the main script as
+# __mp_main__ before running a page; they must not build an app and start workers.
+if __name__ != '__mp_main__':
+    # Create the application instance
+    app = create_app()
 
-# Initialize Migration Engine (Important for Database Updates)
-migrate = Migrate(app, db)
+    # Initialize Migration Engine (Important for Database Updates)
+    migrate = Migrate(app, db)
 
 if __name__ == '__main__':
     # Running in debug mode for local development